@@ -1,18 +1,114 @@
 from abc import ABC, abstractmethod
+from functools import lru_cache
+import heapq
+from typing import Optional
 from mirai import MessageEvent, MessageChain, Plain
 from mirai.models.message import Quote
+import zhconv
+
+from plugin import PreparedMessage, split_text
 
 class Activator(ABC):
     @abstractmethod
     def check(self, event: MessageEvent) -> MessageChain: ...
 
 class SharpActivator(Activator):
-    def check(self, event: MessageEvent) -> MessageChain: 
-        chain = event.message_chain
-        chain = chain[:]
+    PREFIXES = ('#', '＃', '/')
+
+    def check(self, event: MessageEvent) -> MessageChain:
+        prepared = self.check_prepared(PreparedMessage.of(event.message_chain))
+        return None if prepared is None else prepared.chain
+
+    def check_prepared(self, prepared: PreparedMessage) -> Optional[PreparedMessage]:
+        '''与check相同, 但直接复用消息已有的分词结果'''
+        chain = prepared.chain
         quote_li = []
+        # chain[0]是Source, 引用紧跟其后时移到指令末尾
+        first = 1
         if len(chain) > 1 and isinstance(chain[1], Quote):
-            quote_li = [chain.pop(1)]
-        if len(chain) > 1 and isinstance(chain[1], Plain) and len(str(chain[1])) > 0 and str(chain[1])[0] in ('#', '＃', '/'):
-            return [Plain(str(chain[1])[1:]), *chain[2:], *quote_li]
+            quote_li = [chain[1]]
+            first = 2
+        if len(chain) > first and isinstance(chain[first], Plain) and chain[first].text[:1] in self.PREFIXES:
+            head = chain[first].text[1:]
+            return PreparedMessage(
+                chain=[Plain(head), *chain[first + 1:], *quote_li],
+                tokens=[*split_text(head), *prepared.tokens_from(first + 1), *quote_li],
+            )
         return None
+
+class TextNormalizer():
+    '''消息进入插件前的文本规范化: 去掉方向控制符并统一转换为简体
+
+    zhconv逐字做最长匹配, 比较慢. 转换表中每个会改变文本的词条都至少有一个字
+    被选为哨兵字符, 文本中不含任何哨兵字符时转换结果一定与原文相同, 直接跳过;
+    纯ASCII文本同理. 哨兵按贪心的集合覆盖选取, 常用的简体字大多不在其中.
+    较短的文本还会缓存转换结果.
+    '''
+
+    CACHE_MAX_TEXT_LEN = 256
+
+    def __init__(self, locale: str = 'zh-cn', cache_size: int = 4096) -> None:
+        self.locale = locale
+        self.sentinels = self._select_sentinels(locale)
+        self._convert_cached = lru_cache(maxsize=cache_size)(self._convert)
+
+    @staticmethod
+    def _select_sentinels(locale: str) -> Optional[frozenset]:
+        try:
+            zhdict = zhconv.zhconv.getdict(locale)
+        except AttributeError:
+            # zhconv内部接口变化时退化为总是转换
+            return None
+        changing = [k for k, v in zhdict.items() if k != v]
+        sentinels = {k for k in changing if len(k) == 1}
+        uncovered = [k for k in changing if sentinels.isdisjoint(k)]
+        keys_of: dict[str, list[int]] = {}
+        for i, k in enumerate(uncovered):
+            for ch in set(k):
+                keys_of.setdefault(ch, []).append(i)
+        covered = [False] * len(uncovered)
+        # 每次选覆盖未覆盖词条最多的字, 计数过期时重新入堆
+        heap = [(-len(idxs), ch) for ch, idxs in keys_of.items()]
+        heapq.heapify(heap)
+        while heap:
+            neg_cnt, ch = heapq.heappop(heap)
+            cnt = sum(1 for i in keys_of[ch] if not covered[i])
+            if cnt == 0:
+                continue
+            if cnt < -neg_cnt:
+                heapq.heappush(heap, (-cnt, ch))
+                continue
+            sentinels.add(ch)
+            for i in keys_of[ch]:
+                covered[i] = True
+        return frozenset(sentinels)
+
+    def _convert(self, t: str) -> str:
+        return zhconv.convert(t, self.locale)
+
+    def normalize_text(self, t: str) -> str:
+        # U+202D(从左至右强制)
+        t = t.replace('\u202d', '')
+        if t.isascii():
+            return t
+        if self.sentinels is not None and self.sentinels.isdisjoint(t):
+            return t
+        if len(t) <= self.CACHE_MAX_TEXT_LEN:
+            return self._convert_cached(t)
+        return self._convert(t)
+
+    def prepare(self, event: MessageEvent) -> PreparedMessage:
+        '''规范化event.message_chain中的文本并分词, 每条消息只做一次'''
+        chain = event.message_chain
+        changed = False
+        comps = []
+        for comp in chain:
+            if isinstance(comp, Plain):
+                t = self.normalize_text(comp.text)
+                if t != comp.text:
+                    comp = Plain(t)
+                    changed = True
+            comps.append(comp)
+        if changed:
+            event.message_chain = chain = MessageChain(comps)
+        return PreparedMessage.of(chain)
@@ -1,26 +1,35 @@
 import traceback
-from activator import SharpActivator
+from activator import SharpActivator, TextNormalizer
 import mirai_compat  # noqa: F401
-from mirai import Event, MessageChain, MessageEvent, Plain
+from mirai import Event, MessageEvent
 import plugin
 from plugin import CommandNotFoundError
 from mirai.models.events import MemberCardChangeEvent, GroupRecallEvent, NudgeEvent, MemberJoinRequestEvent, MemberJoinEvent, MemberUnmuteEvent, GroupMessage, FriendMessage, StrangerMessage, TempMessage
 from mirai.models.api import RespOperate
-import zhconv
 import configs.config as config
 from napcat_adapter import NapCatBot, get_config_value
 
-bot = NapCatBot(
-    config.BOT_QQ_ID,
-    ws_url=get_config_value(config, "NAPCAT_WS_URL", "ws://127.0.0.1:3001"),
-    access_token=get_config_value(config, "NAPCAT_ACCESS_TOKEN", None),
-)
+# 图片分析的子进程以spawn方式启动, 会把本文件当作__mp_main__重新导入,
+# 所以这里不能在模块顶层创建bot和engine(连接、录制文件、插件加载等), 统一放到setup()中
+def setup():
+    global bot, engine, activator, normalizer
+    bot = NapCatBot(
+        config.BOT_QQ_ID,
+        ws_url=get_config_value(config, "NAPCAT_WS_URL", "ws://127.0.0.1:3001"),
+        access_token=get_config_value(config, "NAPCAT_ACCESS_TOKEN", None),
+        record_path=get_config_value(config, "NAPCAT_RECORD_PATH", None),
+    )
 
-activator = SharpActivator()
+    activator = SharpActivator()
+    normalizer = TextNormalizer()
 
-engine = plugin.Engine(bot)
+    engine = plugin.Engine(bot)
+
+    bot.on(MemberJoinRequestEvent)(on_join_req)
+    bot.on(Event)(on_event)
+    bot.on(MessageEvent)(on_message)
+    return bot
 
-@bot.on(MemberJoinRequestEvent)
 async def on_join_req(event: MemberJoinRequestEvent):
     if event.group_id != 139825481:
         return
@@ -30,7 +39,6 @@ async def on_join_req(event: MemberJoinRequestEvent):
             await bot.resp_member_join_request_event(event_id, event.from_id, event.group_id, op, msg)
         await ctx.exec_join(resp)
 
-@bot.on(Event)
 async def on_event(event: Event):
     if isinstance(event, (MemberCardChangeEvent, GroupRecallEvent, MemberJoinEvent, MemberUnmuteEvent, NudgeEvent)):
         if isinstance(event, MemberCardChangeEvent):
@@ -50,7 +58,7 @@ async def on_event(event: Event):
                 return
         with engine.of(event) as ctx:
             await ctx.exec()
-@bot.on(MessageEvent)
+
 async def on_message(event: MessageEvent):
     if isinstance(event, GroupMessage):
         if event.group.id != 139825481:
@@ -63,29 +71,21 @@ async def on_message(event: MessageEvent):
         if event.group.id != 139825481:
             return
     with engine.of(event) as ctx:
-        def map_text(comp):
-            if isinstance(comp, Plain):
-                t = comp.text
-                t = t.replace('‭', '')
-                t = zhconv.convert(t, 'zh-cn')
-                return Plain(t)
-            return comp
-
-        event.message_chain = MessageChain([map_text(c) for c in event.message_chain])
+        prepared = normalizer.prepare(event)
 
-        await ctx.exec_any(event.message_chain)
+        await ctx.exec_any(prepared)
 
-        chain = activator.check(event)
-        if chain is None: 
-            await ctx.exec_fall(event.message_chain)
+        command = activator.check_prepared(prepared)
+        if command is None: 
+            await ctx.exec_fall(prepared)
             return
 
         try:
-            await ctx.exec_cmd(chain)
+            await ctx.exec_cmd(command)
         except CommandNotFoundError as e:
             traceback.print_exc()
             try:
-                await ctx.exec_cmd(['notfound', *chain])
+                await ctx.exec_cmd(['notfound', *command.chain])
                 # await ctx.exec_cmd(['ai', *chain])
             except: ...
             ...
@@ -112,7 +112,10 @@ async def on_message(event: MessageEvent):
 #     })
 
 def main():
+    setup()
     engine.load()
+    bot.asgi.add_event_handler('shutdown', engine.backup_scheduler.flush_all)
+    bot.asgi.add_event_handler('shutdown', engine.http.close)
 
     bot.run(host='0.0.0.0')
     
@@ -0,0 +1,136 @@
+"""End-to-end load benchmark against a local NapCat stand-in.
+
+Usage:
+    python benchmarks/app_bench.py [frames.jsonl] [-n EVENTS] [--rate R]
+                                   [--api-latency S] [--groups G,G] [--bare]
+
+``frames.jsonl`` is a log written by ``NAPCAT_RECORD_PATH`` (one raw frame
+per line); its inbound events are replayed in a loop. Without it synthetic
+group messages are generated. The bot connects to the stand-in server from
+napcat_replay, which answers actions with generated data.
+
+By default ``app.py`` is imported and its plugins are loaded, so
+``configs/config.py`` must exist; NAPCAT_WS_URL is pointed at the stand-in.
+``--bare`` benchmarks the adapter alone with a no-op handler.
+Autorun tasks and the ASGI server are not started.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from napcat_replay import NapCatStandIn, load_event_frames, synthetic_group_frames  # noqa: E402
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_bot(url: str, bare: bool):
+    if bare:
+        from mirai.models.events import Event
+
+        from napcat_adapter import NapCatBot
+
+        bot = NapCatBot(10001, ws_url=url)
+
+        @bot.on(Event)
+        async def on_event(event):
+            pass
+
+        return bot
+
+    os.environ["NAPCAT_WS_URL"] = url
+    import app
+
+    app.setup()
+    app.engine.load()
+    return app.bot
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.frames:
+        frames = load_event_frames(args.frames)
+    else:
+        groups = [int(g) for g in args.groups.split(",")]
+        frames = synthetic_group_frames(groups=groups)
+    stand_in = NapCatStandIn(frames, port=args.port, rate=args.rate, limit=args.events, api_latency=args.api_latency)
+    await stand_in.start()
+
+    bot = make_bot(stand_in.url, args.bare)
+    latencies: list[float] = []
+    emit = bot._dispatcher.emit
+
+    async def timed_emit(event):
+        started_at = time.perf_counter()
+        try:
+            await emit(event)
+        finally:
+            latencies.append(time.perf_counter() - started_at)
+
+    bot._dispatcher.emit = timed_emit
+    await bot.startup()
+    background = asyncio.create_task(bot.background())
+
+    await stand_in.done.wait()
+    # wait until the bot has read every frame and its handlers are idle; frames
+    # that decode to nothing never reach the dispatcher, hence the stall check
+    deadline = time.monotonic() + args.drain_timeout
+    last_progress, progress_at = -1, time.monotonic()
+    dispatch = bot.dispatch_stats
+    while time.monotonic() < deadline:
+        received = dispatch.enqueued + dispatch.dropped
+        idle = not bot._dispatcher.depth and not bot._dispatcher._running
+        if idle and received >= stand_in.stats.events_sent:
+            break
+        if received + len(latencies) != last_progress:
+            last_progress, progress_at = received + len(latencies), time.monotonic()
+        elif idle and time.monotonic() - progress_at > 1.0:
+            break
+        await asyncio.sleep(0.01)
+    finished_at = time.perf_counter()
+
+    await bot.shutdown()
+    background.cancel()
+    await asyncio.gather(background, return_exceptions=True)
+    await stand_in.close()
+
+    stats = stand_in.stats
+    elapsed = finished_at - stats.started_at
+    handled = len(latencies)
+    print(f"events sent {stats.events_sent}, handled {handled}, dropped {dispatch.dropped}")
+    print(f"throughput {handled / elapsed:.1f} events/s over {elapsed:.2f}s")
+    print(
+        f"handler latency p50 {percentile(latencies, 50) * 1e3:.2f} ms, "
+        f"p99 {percentile(latencies, 99) * 1e3:.2f} ms, max {max(latencies, default=0) * 1e3:.2f} ms"
+    )
+    print(f"dispatch wait avg {dispatch.avg_wait * 1e3:.2f} ms, max {dispatch.max_wait * 1e3:.2f} ms")
+    per_event = stats.action_count / stats.events_sent if stats.events_sent else 0.0
+    print(f"api calls {stats.action_count} ({per_event:.2f} per event)")
+    for action, count in stats.actions.most_common(10):
+        print(f"  {action:<28} {count}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("frames", nargs="?")
+    parser.add_argument("-n", "--events", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=0, help="events per second, 0 for as fast as possible")
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--groups", default="139825481")
+    parser.add_argument("--port", type=int, default=3901)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--bare", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark banned-image lookup: ImageHashIndex vs. a linear hash_diff scan.
+
+Usage:
+    python benchmarks/image_hash_bench.py [-n BANNED] [-q QUERIES]
+
+Banned images are random crop-resistant hashes (several 64-bit segments
+each). Half of the queries are perturbed copies of banned hashes, half are
+unrelated. Both lookups must agree on every query.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_hash_index import ImageHashIndex, is_match, multihash_diff  # noqa: E402
+
+
+def random_multihash(rng: random.Random) -> list[int]:
+    return [rng.getrandbits(64) for _ in range(rng.randint(3, 8))]
+
+
+def perturb(rng: random.Random, segments: list[int]) -> list[int]:
+    out = []
+    for s in segments:
+        for _ in range(rng.randint(0, 3)):
+            s ^= 1 << rng.randrange(64)
+        out.append(s)
+    rng.shuffle(out)
+    return out[: max(1, len(out) - rng.randint(0, 2))]
+
+
+def to_key(segments: list[int]) -> str:
+    return ",".join(f"{s:016x}" for s in segments)
+
+
+def linear_match(banned: list[list[int]], target: list[int]) -> bool:
+    return any(is_match(*multihash_diff(tuple(b), 64, target)) for b in banned)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--banned", type=int, default=10000)
+    parser.add_argument("-q", "--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    banned = [random_multihash(rng) for _ in range(args.banned)]
+    queries = [perturb(rng, rng.choice(banned)) if i % 2 == 0 else random_multihash(rng) for i in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "image_hashes.txt")
+        started_at = time.perf_counter()
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(to_key(b) + "\n" for b in banned)
+        index = ImageHashIndex(path)
+        index.refresh()
+        print(f"{len(index)} banned hashes, index built in {(time.perf_counter() - started_at) * 1e3:.1f} ms")
+
+        started_at = time.perf_counter()
+        for _ in range(100):
+            index.add(to_key(random_multihash(rng)))
+        print(f"add {(time.perf_counter() - started_at) / 100 * 1e6:.1f} us/hash")
+
+        started_at = time.perf_counter()
+        indexed = [index.match(q) is not None for q in queries]
+        indexed_time = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    linear = [linear_match(banned, q) for q in queries]
+    linear_time = time.perf_counter() - started_at
+
+    # the 100 extra random hashes added above cannot turn a miss into a hit
+    # for unrelated queries with any meaningful probability, so compare directly
+    mismatches = sum(a != b for a, b in zip(indexed, linear))
+    print(f"queries {len(queries)}, hits {sum(indexed)}, mismatches {mismatches}")
+    print(f"index  {indexed_time / len(queries) * 1e6:.1f} us/query")
+    print(f"linear {linear_time / len(queries) * 1e6:.1f} us/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Microbenchmark for the NapCat websocket JSON codecs.
+
+Usage:
+    python benchmarks/json_codec_bench.py [frames.jsonl] [-n ROUNDS]
+
+``frames.jsonl`` holds one raw OneBot frame per line, as received from
+NapCat. Without it a small built-in sample of typical frames is used.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_codec import CODECS  # noqa: E402
+
+SAMPLE_FRAMES = [
+    '{"self_id":10001,"user_id":20002,"time":1700000000,"message_id":123456,"message_seq":123456,"real_id":123456,'
+    '"message_type":"group","sender":{"user_id":20002,"nickname":"小明","card":"群名片","role":"member"},'
+    '"raw_message":"[CQ:reply,id=123400]今天吃什么","font":14,"sub_type":"normal",'
+    '"message":[{"type":"reply","data":{"id":"123400"}},{"type":"text","data":{"text":"今天吃什么"}}],'
+    '"message_format":"array","post_type":"message","group_id":30003}',
+    '{"time":1700000001,"self_id":10001,"post_type":"notice","notice_type":"group_recall","group_id":30003,'
+    '"user_id":20002,"operator_id":20002,"message_id":123456}',
+    '{"time":1700000002,"self_id":10001,"post_type":"meta_event","meta_event_type":"heartbeat",'
+    '"status":{"online":true,"good":true},"interval":30000}',
+    '{"status":"ok","retcode":0,"data":{"message_id":123457},"message":"","wording":"","echo":"0f8e3c5d9a"}',
+    '{"status":"ok","retcode":0,"data":[' + ",".join(
+        '{"group_id":30003,"user_id":%d,"nickname":"成员%d","card":"","sex":"unknown","age":0,"area":"",'
+        '"level":"1","qq_level":0,"join_time":1690000000,"last_sent_time":1700000000,"title_expire_time":0,'
+        '"unfriendly":false,"card_changeable":true,"is_robot":false,"shut_up_timestamp":0,"role":"member","title":""}'
+        % (20000 + i, i)
+        for i in range(200)
+    ) + '],"message":"","wording":"","echo":"9b1d2f7e44"}',
+]
+
+SAMPLE_REQUEST = {
+    "action": "send_group_msg",
+    "params": {
+        "group_id": 30003,
+        "message": [
+            {"type": "reply", "data": {"id": "123456"}},
+            {"type": "at", "data": {"qq": "20002"}},
+            {"type": "text", "data": {"text": " 吃火锅吧"}},
+        ],
+    },
+    "echo": "0f8e3c5d9a",
+}
+
+
+def load_frames(path: str | None) -> list[str]:
+    if path is None:
+        return SAMPLE_FRAMES
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def bench(fn, rounds: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return time.perf_counter() - started_at
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("frames", nargs="?")
+    parser.add_argument("-n", "--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames)
+    frames_bytes = [frame.encode() for frame in frames]
+    total_bytes = sum(len(frame) for frame in frames_bytes)
+    print(f"{len(frames)} frames, {total_bytes} bytes, {args.rounds} rounds")
+
+    for name, factory in CODECS.items():
+        try:
+            codec = factory()
+        except ImportError:
+            print(f"{name:<8} not installed")
+            continue
+
+        def decode_str():
+            for frame in frames:
+                codec.loads(frame)
+
+        def decode_bytes():
+            for frame in frames_bytes:
+                codec.loads(frame)
+
+        def encode():
+            codec.dumps(SAMPLE_REQUEST)
+
+        t_str = bench(decode_str, args.rounds)
+        t_bytes = bench(decode_bytes, args.rounds)
+        t_enc = bench(encode, args.rounds * len(frames))
+        mb = total_bytes * args.rounds / 1024 / 1024
+        print(
+            f"{name:<8} decode str {mb / t_str:8.1f} MB/s  "
+            f"decode bytes {mb / t_bytes:8.1f} MB/s  "
+            f"encode {t_enc / (args.rounds * len(frames)) * 1e6:6.2f} us/request"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark OneBot frame -> mirai event decoding in NapCatBot.
+
+Usage:
+    python benchmarks/onebot_decode_bench.py [frames.jsonl] [-n ROUNDS]
+
+Frames use the same one-frame-per-line format as json_codec_bench.py.
+Only frames that decode to an event (messages, notices, requests) are
+timed. Allocations are measured with tracemalloc on a separate pass.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_codec_bench import load_frames  # noqa: E402
+from napcat_adapter import NapCatBot  # noqa: E402
+
+
+async def run(frames: list[str], rounds: int) -> None:
+    bot = NapCatBot(10001)
+    payloads = [bot._codec.loads(frame) for frame in frames]
+    payloads = [payload for payload in payloads if payload.get("post_type") in ("message", "notice", "request")]
+    if not payloads:
+        print("no event frames")
+        return
+
+    for payload in payloads:
+        await bot._event_from_onebot(payload)
+
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            await bot._event_from_onebot(payload)
+    elapsed = time.perf_counter() - started_at
+    count = rounds * len(payloads)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for payload in payloads:
+        await bot._event_from_onebot(payload)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+
+    print(f"{len(payloads)} event frames, {rounds} rounds")
+    print(f"decode {elapsed / count * 1e6:.1f} us/event")
+    print(f"retained {blocks / len(payloads):.0f} blocks, {size / len(payloads):.0f} bytes per event")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("frames", nargs="?")
+    parser.add_argument("-n", "--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(load_frames(args.frames), args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import json
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from enum import Enum, auto
+from typing import Any, Callable, Dict, Optional
+
+from pypinyin import lazy_pinyin
+
+from image_hash_index import ImageHashIndex
+from utilities import get_logger
+
+logger = get_logger()
+
+URL_PATTERN = re.compile(r'(https?:\/\/)((([0-9a-z]+\.)+[a-z]+)|(([0-9]{1,3}\.){3}[0-9]{1,3}))(:[0-9]+)?(\/[0-9a-z%/.\-_]*)?(\?[0-9a-z=&%_\-]*)?(\#[0-9a-z=&%_\-]*)?')
+
+# 出现这些字符的关键词按正则处理, 其余的按字面量进自动机
+REGEX_META_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+# 两次检查规则文件mtime之间的最小间隔(秒)
+RELOAD_CHECK_INTERVAL: float = 1.0
+
+
+class ReslovedCensorSpeechQual(Enum):
+    BASE = auto()
+    ALL = auto()
+    AT = auto()
+    CURIOUS = auto()
+    PINYIN = auto()
+
+@dataclass
+class ReslovedCensorSpeechKey():
+    quals: Dict[ReslovedCensorSpeechQual, list[str]]
+    reason: str
+    
+    @classmethod
+    def from_expr(cls, expr: str):
+        reason, *remains = expr.split(':')
+
+        return cls(
+            reason=reason,
+            quals={ReslovedCensorSpeechQual[(its := r.split('.'))[0].upper()]: its[1:] for r in remains},
+        )
+
+
+class AhoCorasick():
+    '''多模式字面量匹配, 扫描一次文本即可找出所有关键词, 耗时与关键词数量无关'''
+
+    def __init__(self, words: list[str]) -> None:
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[list[int]] = [[]]
+        for idx, word in enumerate(words):
+            node = 0
+            for ch in word:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(idx)
+        self._build()
+
+    def _build(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find_all(self, txt: str) -> set[int]:
+        '''返回在txt中出现过的关键词下标'''
+        found = set()
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in txt:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+@dataclass
+class CensorRule():
+    '''censor_speech.json中的一项: 一个"理由:限定..."的键及其关键词'''
+    order: int
+    key: ReslovedCensorSpeechKey
+    # 原始关键词, 以及可选的推荐替换词
+    words: list[tuple[str, Optional[str]]]
+    pinyin: bool
+
+
+@dataclass
+class CensorHit():
+    rule: CensorRule
+    word_idx: int
+    # 文本中实际命中的片段
+    matched: str
+
+    @property
+    def replacer(self) -> Optional[str]:
+        return self.rule.words[self.word_idx][1]
+
+    @property
+    def sort_key(self):
+        return (self.rule.order, self.word_idx)
+
+
+@dataclass
+class CompiledRules():
+    rules: list[CensorRule] = field(default_factory=list)
+    # 字面量关键词 -> (规则, 关键词下标)
+    literal_refs: list[tuple[CensorRule, int]] = field(default_factory=list)
+    literals: Optional[AhoCorasick] = None
+    regex_refs: list[tuple[CensorRule, int, re.Pattern]] = field(default_factory=list)
+    # 拼音首音节 -> [(规则, 关键词下标, 关键词拼音)]
+    pinyin_index: dict[str, list[tuple[CensorRule, int, tuple[str, ...]]]] = field(default_factory=dict)
+    # 拼音为空的关键词, 与原先的逐个匹配一致, 视为在开头命中
+    pinyin_empty: list[tuple[CensorRule, int]] = field(default_factory=list)
+
+    @classmethod
+    def compile(cls, o: dict[str, list]):
+        compiled = cls()
+        literal_words: list[str] = []
+        for order, (expr, items) in enumerate(o.items()):
+            words = []
+            for w_item in items:
+                if isinstance(w_item, dict):
+                    kw, replacer = next(iter(w_item.items()))
+                else:
+                    kw, replacer = w_item, None
+                words.append((kw, replacer))
+            key = ReslovedCensorSpeechKey.from_expr(expr)
+            rule = CensorRule(order=order, key=key, words=words, pinyin=ReslovedCensorSpeechQual.PINYIN in key.quals)
+            compiled.rules.append(rule)
+
+            for word_idx, (kw, _) in enumerate(words):
+                if rule.pinyin:
+                    kw_pinyin = tuple(lazy_pinyin(kw))
+                    if kw_pinyin:
+                        compiled.pinyin_index.setdefault(kw_pinyin[0], []).append((rule, word_idx, kw_pinyin))
+                    else:
+                        compiled.pinyin_empty.append((rule, word_idx))
+                elif kw and not REGEX_META_CHARS.intersection(kw):
+                    compiled.literal_refs.append((rule, word_idx))
+                    literal_words.append(kw)
+                else:
+                    try:
+                        pattern = re.compile(kw)
+                    except re.error:
+                        logger.warning(f'违禁词正则无效, 已忽略: {kw}')
+                        continue
+                    compiled.regex_refs.append((rule, word_idx, pattern))
+
+        if literal_words:
+            compiled.literals = AhoCorasick(literal_words)
+        return compiled
+
+    def scan(self, txt: str, *, with_pinyin: Callable[[], list[str]]) -> list[CensorHit]:
+        '''返回txt命中的所有关键词, 按规则及关键词在文件中的顺序排列'''
+        hits: list[CensorHit] = []
+        if self.literals is not None:
+            for idx in self.literals.find_all(txt):
+                rule, word_idx = self.literal_refs[idx]
+                hits.append(CensorHit(rule, word_idx, rule.words[word_idx][0]))
+
+        for rule, word_idx, pattern in self.regex_refs:
+            m = pattern.search(txt)
+            if m is not None:
+                hits.append(CensorHit(rule, word_idx, m.group(0)))
+
+        for rule, word_idx in self.pinyin_empty:
+            hits.append(CensorHit(rule, word_idx, ''))
+        if self.pinyin_index:
+            txt_pinyin = with_pinyin()
+            seen = set()
+            for i, syllable in enumerate(txt_pinyin):
+                for rule, word_idx, kw_pinyin in self.pinyin_index.get(syllable, ()):
+                    if (rule.order, word_idx) in seen:
+                        continue
+                    if tuple(txt_pinyin[i:i + len(kw_pinyin)]) == kw_pinyin:
+                        seen.add((rule.order, word_idx))
+                        hits.append(CensorHit(rule, word_idx, txt[i:i + len(kw_pinyin)]))
+
+        hits.sort(key=lambda hit: hit.sort_key)
+        return hits
+
+
+def find_repeated_char(txt: str, threshold: int = 70) -> Optional[str]:
+    '''返回出现次数不少于threshold的字符(空白除外), 多个时取最小的那个'''
+    if len(txt) < threshold:
+        return None
+    repeated = [ch for ch, cnt in Counter(txt).items() if cnt >= threshold and ch not in (' ', '\n')]
+    return min(repeated) if repeated else None
+
+
+class WatchedFile():
+    '''按mtime缓存文件(或目录)的解析结果'''
+
+    def __init__(self, path: str, loader: Callable[[str], Any]) -> None:
+        self.path = path
+        self.loader = loader
+        self.mtime: Optional[float] = None
+        self.value: Any = None
+
+    def refresh(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime and self.value is not None:
+            return False
+        # 先记下mtime, 加载失败时不会每次都重试同一个坏文件
+        self.mtime = mtime
+        self.value = self.loader(self.path)
+        return True
+
+
+def load_json(path: str):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class CensorEngine():
+    '''censor_speech使用的规则集合, 只在文件变动时重新加载和编译'''
+
+    def __init__(self, rules_path: str, market_face_path: str, hash_index_path: str, legacy_hashes_dir: Optional[str] = None) -> None:
+        self._rules = WatchedFile(rules_path, lambda p: CompiledRules.compile(load_json(p)))
+        self._market_faces = WatchedFile(market_face_path, load_json)
+        self._image_hashes = ImageHashIndex(hash_index_path, legacy_hashes_dir)
+        self._checked_at = 0.0
+
+    def refresh(self, *, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        for watched in (self._rules, self._market_faces):
+            try:
+                if watched.refresh():
+                    logger.info(f'[违禁词] 重新加载 {watched.path}')
+            except Exception:
+                if watched.value is None:
+                    raise
+                logger.exception(f'[违禁词] 加载{watched.path}失败, 继续使用旧规则')
+        if self._image_hashes.refresh():
+            logger.info(f'[违禁词] 重新加载 {self._image_hashes.path}, 共{len(self._image_hashes)}个图片hash')
+
+    @property
+    def rules(self) -> CompiledRules:
+        return self._rules.value
+
+    @property
+    def forbidden_market_faces(self) -> dict[str, dict[str, int]]:
+        return self._market_faces.value
+
+    @property
+    def image_hashes(self) -> ImageHashIndex:
+        return self._image_hashes
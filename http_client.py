@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from ttl_cache import SingleFlight
+from utilities import get_logger
+
+logger = get_logger()
+
+T = TypeVar('T')
+
+# 这些状态码通常是暂时性的, 幂等请求可以重试
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+@dataclass
+class HostPolicy():
+    timeout: float = 20
+    connect_timeout: float = 5
+    # 连接失败、超时或者RETRY_STATUSES时的重试次数, 只对幂等请求生效
+    retries: int = 2
+    backoff: float = 0.5
+    limit_per_host: int = 8
+
+
+@dataclass
+class Media():
+    data: bytes
+    content_type: Optional[str]
+
+
+@dataclass
+class HttpStats():
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    sessions: int = 0
+    media_memory_hits: int = 0
+    media_disk_hits: int = 0
+    media_downloads: int = 0
+    # 等待同一个媒体文件正在进行的下载, 而不是重复下载
+    media_coalesced: int = 0
+    media_bytes_downloaded: int = 0
+
+
+class MediaCache():
+    '''按字节数限制大小的媒体缓存, 内存中保留最近使用的部分, 其余写入磁盘'''
+
+    def __init__(self, directory: Optional[str], *, memory_bytes: int, disk_bytes: int) -> None:
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory: OrderedDict[str, Media] = OrderedDict()
+        self._memory_size = 0
+        # 文件名 -> 大小, 按最近使用排序; 第一次访问磁盘时再扫描目录
+        self._disk: Optional[OrderedDict[str, int]] = None
+        self._disk_size = 0
+
+    @staticmethod
+    def file_name(key: str) -> str:
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def get_memory(self, key: str) -> Optional[Media]:
+        media = self._memory.get(key)
+        if media is not None:
+            self._memory.move_to_end(key)
+        return media
+
+    def put_memory(self, key: str, media: Media):
+        size = len(media.data)
+        if size > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old.data)
+        self._memory[key] = media
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted.data)
+
+    def _scan_disk(self) -> OrderedDict[str, int]:
+        if self._disk is None:
+            self._disk = OrderedDict()
+            self._disk_size = 0
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name, st.st_size))
+            for _, name, size in sorted(entries):
+                self._disk[name] = size
+                self._disk_size += size
+        return self._disk
+
+    # 以下两个方法在线程中执行
+    def read_disk(self, key: str) -> Optional[Media]:
+        if self.directory is None:
+            return None
+        disk = self._scan_disk()
+        name = self.file_name(key)
+        if name not in disk:
+            return None
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                content_type, _, data = f.read().partition(b'\n')
+        except FileNotFoundError:
+            self._disk_size -= disk.pop(name, 0)
+            return None
+        disk.move_to_end(name)
+        return Media(data=data, content_type=content_type.decode() or None)
+
+    def write_disk(self, key: str, media: Media):
+        if self.directory is None:
+            return
+        disk = self._scan_disk()
+        name = self.file_name(key)
+        by = (media.content_type or '').encode() + b'\n' + media.data
+        if len(by) > self.disk_bytes:
+            return
+        path = os.path.join(self.directory, name)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(by)
+        os.replace(tmp_path, path)
+        self._disk_size += len(by) - disk.pop(name, 0)
+        disk[name] = len(by)
+        while self._disk_size > self.disk_bytes and disk:
+            evicted, size = disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(os.path.join(self.directory, evicted))
+            except FileNotFoundError:
+                ...
+
+
+class HttpClient():
+    '''所有插件共用的HTTP客户端
+
+    每个host(区分是否读取代理环境变量)复用一个ClientSession, 连接保持复用,
+    不必每次请求都重新握手. 超时和重试按host配置. fetch_media下载的图片等
+    媒体文件按key(默认为URL, QQ图片可以用image_id)缓存, 同一张图片在一次
+    事件中被多个插件使用时只下载一次.
+    '''
+
+    def __init__(
+        self,
+        *,
+        media_cache_dir: Optional[str] = None,
+        media_memory_bytes: int = 64 * 1024 * 1024,
+        media_disk_bytes: int = 512 * 1024 * 1024,
+        default_policy: Optional[HostPolicy] = None,
+    ) -> None:
+        self.default_policy = default_policy or HostPolicy()
+        self.policies: dict[str, HostPolicy] = {}
+        self.stats = HttpStats()
+        self.media = MediaCache(media_cache_dir, memory_bytes=media_memory_bytes, disk_bytes=media_disk_bytes)
+        self._sessions: dict[tuple[str, bool], aiohttp.ClientSession] = {}
+        self._media_inflight: SingleFlight[str, Media] = SingleFlight()
+        # 在事件循环中创建, 见disk_lock
+        self._disk_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def disk_lock(self) -> asyncio.Lock:
+        # 磁盘缓存的索引不是线程安全的, 同一时间只允许一个线程读写
+        if self._disk_lock is None:
+            self._disk_lock = asyncio.Lock()
+        return self._disk_lock
+
+    def set_policy(self, host: str, policy: HostPolicy):
+        self.policies[host] = policy
+
+    def policy_for(self, url: str) -> HostPolicy:
+        return self.policies.get(urlsplit(url).hostname or '', self.default_policy)
+
+    def session(self, url: str, *, trust_env: bool = False) -> aiohttp.ClientSession:
+        '''返回url所在host的共享session, 调用方不要关闭它'''
+        host = urlsplit(url).hostname or ''
+        key = (host, trust_env)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            policy = self.policy_for(url)
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=policy.limit_per_host, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=policy.timeout, connect=policy.connect_timeout),
+                trust_env=trust_env,
+            )
+            self._sessions[key] = session
+            self.stats.sessions += 1
+        return session
+
+    async def request(self, method: str, url: str, read: Callable[[aiohttp.ClientResponse], Awaitable[T]], *, trust_env: bool = False, **kwargs) -> T:
+        '''发出请求并用read读取响应, 幂等请求在暂时性错误时按策略重试'''
+        policy = self.policy_for(url)
+        retries = policy.retries if method.upper() in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            self.stats.requests += 1
+            try:
+                async with self.session(url, trust_env=trust_env).request(method, url, **kwargs) as resp:
+                    if resp.status not in RETRY_STATUSES or attempt >= retries:
+                        return await read(resp)
+                    logger.debug(f'{method} {url} -> {resp.status}, retrying')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    self.stats.errors += 1
+                    raise
+                logger.debug(f'{method} {url} failed {e=}, retrying')
+            attempt += 1
+            self.stats.retries += 1
+            await asyncio.sleep(policy.backoff * 2 ** (attempt - 1))
+
+    async def get_json(self, url: str, *, encoding: Optional[str] = None, content_type: Optional[str] = 'application/json', **kwargs) -> Any:
+        return await self.request('GET', url, lambda resp: resp.json(encoding=encoding, content_type=content_type), **kwargs)
+
+    async def get_text(self, url: str, *, encoding: Optional[str] = None, **kwargs) -> str:
+        return await self.request('GET', url, lambda resp: resp.text(encoding=encoding), **kwargs)
+
+    async def get_bytes(self, url: str, **kwargs) -> bytes:
+        async def read(resp: aiohttp.ClientResponse):
+            resp.raise_for_status()
+            return await resp.read()
+        return await self.request('GET', url, read, **kwargs)
+
+    async def head(self, url: str, **kwargs):
+        async def read(resp: aiohttp.ClientResponse):
+            return resp.headers
+        return await self.request('HEAD', url, read, **kwargs)
+
+    async def fetch_media(self, url: str, *, key: Optional[str] = None, **kwargs) -> Media:
+        '''下载图片等媒体文件, 结果按key缓存, 并发请求同一个key时只下载一次'''
+        key = key or url
+        media = self.media.get_memory(key)
+        if media is not None:
+            self.stats.media_memory_hits += 1
+            return media
+        if key in self._media_inflight:
+            self.stats.media_coalesced += 1
+        return await self._media_inflight.run(key, lambda: self._load_media(url, key, **kwargs))
+
+    async def _load_media(self, url: str, key: str, **kwargs) -> Media:
+        async with self.disk_lock:
+            media = await asyncio.to_thread(self.media.read_disk, key)
+        if media is not None:
+            self.stats.media_disk_hits += 1
+            self.media.put_memory(key, media)
+            return media
+
+        async def read(resp: aiohttp.ClientResponse):
+            resp.raise_for_status()
+            return Media(data=await resp.read(), content_type=resp.headers.get('Content-Type'))
+
+        started_at = time.perf_counter()
+        media = await self.request('GET', url, read, **kwargs)
+        self.stats.media_downloads += 1
+        self.stats.media_bytes_downloaded += len(media.data)
+        logger.debug(f'media downloaded {len(media.data)} bytes in {time.perf_counter() - started_at:.2f}s')
+        self.media.put_memory(key, media)
+        try:
+            async with self.disk_lock:
+                await asyncio.to_thread(self.media.write_disk, key, media)
+        except OSError as e:
+            logger.warning(f'media cache write failed {e=}')
+        return media
+
+    async def close(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
@@ -0,0 +1,153 @@
+'''在子进程中执行的图片处理函数
+
+这里的函数都会被pickle后送到ImageAnalyzer的进程池中执行, 所以只能放在
+顶层, 参数和返回值也都必须能被pickle. 模块本身只依赖PIL, 不导入插件相关的代码.
+不过子进程以spawn方式启动时会把入口脚本(app.py)当作__mp_main__重新导入,
+因此仍会加载mirai、plugin、napcat_adapter等模块(不会创建bot和engine, 见app.setup).
+'''
+import base64
+import hashlib
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Optional
+
+from PIL import ExifTags, Image, ImageOps
+from PIL.TiffImagePlugin import IFDRational
+
+
+def content_key(data: bytes) -> str:
+    '''图片内容的摘要, 用作分析结果的缓存键'''
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@dataclass
+class ImageAnalysis():
+    key: str
+    format: Optional[str]
+    width: int
+    height: int
+    # str(imagehash.crop_resistant_hash(...)), 可直接交给ImageHashIndex
+    crop_hash: Optional[str] = None
+    # 二维码等所有能识别的码的内容
+    qrcodes: list[str] = field(default_factory=list)
+    # 反色后识别出的CODE39条码(直播兑换码)
+    code39: list[str] = field(default_factory=list)
+
+
+def _open_for_analysis(data: bytes) -> tuple[Image.Image, Optional[str]]:
+    img = Image.open(BytesIO(data))
+    if img.format != 'GIF':
+        img.load()
+        return img, img.format
+    # 动图只取第一帧, 与原先Admin.load_image的处理一致, 保证hash不变
+    buffered = BytesIO()
+    img.convert('RGB').save(buffered, format='JPEG')
+    buffered.seek(0)
+    return Image.open(buffered), 'GIF'
+
+
+def _decoded(results) -> list[str]:
+    return [r.data.decode(errors='replace') for r in results]
+
+
+def analyze_image(data: bytes, key: Optional[str] = None) -> ImageAnalysis:
+    '''一次解码, 同时得到尺寸、crop_resistant_hash、二维码和反色CODE39条码'''
+    import imagehash
+    import pyzbar.pyzbar
+
+    if key is None:
+        key = content_key(data)
+    img, fmt = _open_for_analysis(data)
+    res = ImageAnalysis(key=key, format=fmt, width=img.width, height=img.height)
+    res.qrcodes = _decoded(pyzbar.pyzbar.decode(img))
+    res.crop_hash = str(imagehash.crop_resistant_hash(img))
+    inverted = ImageOps.invert(img.convert('RGB'))
+    res.code39 = _decoded(pyzbar.pyzbar.decode(inverted, symbols=[pyzbar.pyzbar.ZBarSymbol.CODE39]))
+    return res
+
+
+def thumbnail_resample():
+    return getattr(
+        getattr(Image, 'Resampling', Image),
+        'LANCZOS',
+        getattr(Image, 'ANTIALIAS', Image.BICUBIC),
+    )
+
+
+def save_limited_jpeg(source_path: str, target_path: str, *, max_dimension: int, quality: int = 85) -> str:
+    with Image.open(source_path) as img:
+        img.load()
+        if max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), thumbnail_resample())
+        img.convert('RGB').save(target_path, 'JPEG', quality=quality, optimize=True)
+    return target_path
+
+
+def read_exif(path: str, keys: dict[str, str]) -> dict:
+    '''读取EXIF中keys包含的标签并按keys重命名, 分数值转为float'''
+    with Image.open(path) as img:
+        getexif = getattr(img, '_getexif', None)
+        raw_exif = getexif() if getexif is not None else None
+    if raw_exif is None:
+        return {}
+    res = {}
+    for k, v in raw_exif.items():
+        name = ExifTags.TAGS.get(k)
+        if name not in keys:
+            continue
+        if isinstance(v, IFDRational):
+            v = float(v)
+        res[keys[name]] = v
+    return res
+
+
+def animation_formats() -> list[str]:
+    Image.init()
+    return [fmt for fmt in ('GIF', 'WEBP') if fmt in Image.SAVE_ALL]
+
+
+def encode_animation(
+    frames: list[str], durations: list[float], *, max_dimension: int, format: str = 'GIF', quality: int = 80
+) -> tuple[bytes, str, int]:
+    '''把录屏得到的base64 JPEG帧编码为动图, 返回(base64编码的动图, 实际格式, 保留的帧数)
+
+    逐帧解码并缩小, 与上一帧像素完全相同的帧直接丢弃, 显示时长累加到上一帧.
+    GIF的每帧解码后立即量化为调色板图像, 同时存在的只有每像素1字节的帧.
+    durations为每帧的显示时长(秒). 当前PIL不支持WebP动图时退化为GIF.
+    '''
+    format = format.upper()
+    if format not in animation_formats():
+        format = 'GIF'
+    images: list[Image.Image] = []
+    kept_durations: list[float] = []
+    prev_digest = None
+    for b64_data, duration in zip(frames, durations):
+        with Image.open(BytesIO(base64.b64decode(b64_data))) as frame:
+            img = frame.convert('RGB')
+        if max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), thumbnail_resample())
+        digest = hashlib.blake2b(img.tobytes(), digest_size=16).digest()
+        if digest == prev_digest:
+            kept_durations[-1] += duration
+            continue
+        prev_digest = digest
+        if format == 'GIF':
+            img = img.quantize(colors=256)
+        images.append(img)
+        kept_durations.append(duration)
+    if not images:
+        raise ValueError('no frames')
+
+    buffered = BytesIO()
+    first, *remaining = images
+    options = dict(
+        save_all=True,
+        append_images=remaining,
+        duration=[max(20, int(item * 1000)) for item in kept_durations],
+        loop=1,
+    )
+    if format == 'GIF':
+        first.save(buffered, format='GIF', disposal=2, **options)
+    else:
+        first.save(buffered, format='WEBP', quality=quality, **options)
+    return base64.b64encode(buffered.getvalue()), format, len(images)
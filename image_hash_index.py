@@ -0,0 +1,152 @@
+import os
+from typing import Iterable, Optional
+
+from utilities import get_logger
+
+logger = get_logger()
+
+
+def popcount(x: int) -> int:
+    return bin(x).count('1')
+
+
+def parse_multihash(s: str) -> tuple[tuple[int, ...], int]:
+    '''把str(ImageMultiHash)(逗号分隔的各分段hex)解析为整数, 同时返回每段的位数'''
+    parts = [p for p in s.strip().split(',') if p]
+    return tuple(int(p, 16) for p in parts), len(parts[0]) * 4 if parts else 0
+
+
+def multihash_diff(banned: tuple[int, ...], bits: int, target: Iterable[int]) -> tuple[int, int]:
+    '''与imagehash.ImageMultiHash.hash_diff(默认参数)的结果一致: (匹配上的分段数, 距离之和)'''
+    target = tuple(target)
+    if not target:
+        return 0, 0
+    cutoff = bits * 0.25
+    seg, dist = 0, 0
+    for s in banned:
+        lowest = min(popcount(s ^ o) for o in target)
+        if lowest <= cutoff:
+            seg += 1
+            dist += lowest
+    return seg, dist
+
+
+def is_match(seg: int, dist: int) -> bool:
+    return seg > 0 and dist < 4 * seg
+
+
+class ImageHashIndex():
+    '''违禁图片的crop_resistant_hash索引
+
+    判定条件是"匹配上的分段平均距离 < 4", 所以命中的图片至少有一个分段与
+    目标的某个分段距离不超过3. 把每个分段切成4块做多重索引(multi-index
+    hashing), 距离不超过3时至少有一块完全相同, 只需对这些候选做精确比较,
+    结果与逐个hash_diff完全一致, 耗时基本不随违禁图片数量增长.
+
+    只保存hash本身, 每行一个, 新增时直接追加到文件末尾. 旧版本保存在
+    hashes目录下、以hash命名的图片也会一并读入.
+    '''
+
+    MAX_CANDIDATE_DISTANCE = 3
+    # 鸽巢原理: 距离不超过MAX_CANDIDATE_DISTANCE时至少有一块相同
+    CHUNKS = MAX_CANDIDATE_DISTANCE + 1
+
+    def __init__(self, path: str, legacy_dir: Optional[str] = None) -> None:
+        self.path = path
+        self.legacy_dir = legacy_dir
+        # (原始hash字符串, 各分段, 每段位数)
+        self.entries: list[tuple[str, tuple[int, ...], int]] = []
+        self.keys: dict[str, int] = {}
+        self.tables: list[dict[tuple[int, int], list[int]]] = [{} for _ in range(self.CHUNKS)]
+        self._mtimes = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _stat(self):
+        mtimes = []
+        for p in (self.path, self.legacy_dir):
+            try:
+                mtimes.append(os.stat(p).st_mtime_ns if p is not None else None)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def refresh(self) -> bool:
+        '''文件在外部被修改过时重建索引'''
+        mtimes = self._stat()
+        if mtimes == self._mtimes:
+            return False
+        self._mtimes = mtimes
+        self.entries.clear()
+        self.keys.clear()
+        self.tables = [{} for _ in range(self.CHUNKS)]
+        if self.legacy_dir is not None and os.path.isdir(self.legacy_dir):
+            for file_name in os.listdir(self.legacy_dir):
+                if not file_name.startswith('.'):
+                    self._insert(file_name.split('.')[0])
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._insert(line.strip())
+        return True
+
+    def _chunks(self, h: int, bits: int):
+        width = max(1, bits // self.CHUNKS)
+        mask = (1 << width) - 1
+        for i in range(self.CHUNKS):
+            yield i, (bits, (h >> (i * width)) & mask)
+
+    def _insert(self, key: str) -> bool:
+        if key in self.keys:
+            return False
+        try:
+            segments, bits = parse_multihash(key)
+        except ValueError:
+            logger.warning(f'无法解析的图片hash: {key}')
+            return False
+        if not segments:
+            return False
+        idx = len(self.entries)
+        self.entries.append((key, segments, bits))
+        self.keys[key] = idx
+        for s in segments:
+            for i, chunk in self._chunks(s, bits):
+                bucket = self.tables[i].setdefault(chunk, [])
+                if not bucket or bucket[-1] != idx:
+                    bucket.append(idx)
+        return True
+
+    def add(self, key: str) -> bool:
+        '''新增一个违禁hash(str(ImageMultiHash)), 已存在时返回False'''
+        self.refresh()
+        key = key.strip()
+        if not self._insert(key):
+            return False
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(key + '\n')
+        self._mtimes = self._stat()
+        return True
+
+    def candidates(self, target: Iterable[int], bits: int) -> set[int]:
+        found = set()
+        for s in target:
+            for i, chunk in self._chunks(s, bits):
+                found.update(self.tables[i].get(chunk, ()))
+        return found
+
+    def match(self, target: Iterable[int], bits: int = 64) -> Optional[tuple[str, int, int]]:
+        '''返回第一个命中的违禁hash及其(分段数, 距离之和), 没有命中时返回None'''
+        target = tuple(target)
+        for idx in sorted(self.candidates(target, bits)):
+            key, segments, entry_bits = self.entries[idx]
+            seg, dist = multihash_diff(segments, entry_bits, target)
+            if is_match(seg, dist):
+                return key, seg, dist
+        return None
+
+    def match_multihash(self, target_hash) -> Optional[tuple[str, int, int]]:
+        '''target_hash为imagehash.ImageMultiHash或者它的str'''
+        segments, bits = parse_multihash(str(target_hash))
+        return self.match(segments, bits)
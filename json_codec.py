@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Callable, Optional, Union
+
+Frame = Union[str, bytes, bytearray, memoryview]
+
+
+class JsonCodec:
+    """JSON encoder/decoder used on the NapCat websocket hot path.
+
+    ``loads`` accepts text or binary frames without decoding them to ``str``
+    first; ``dumps`` returns text, since NapCat expects text frames.
+    """
+
+    name = "json"
+
+    def loads(self, raw: Frame) -> Any:
+        if isinstance(raw, memoryview):
+            raw = raw.tobytes()
+        return json.loads(raw)
+
+    def dumps(self, value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._loads = orjson.loads
+        self._dumps = orjson.dumps
+        self._decode_error = orjson.JSONDecodeError
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def loads(self, raw: Frame) -> Any:
+        return self._loads(raw)
+
+    def dumps(self, value: Any) -> str:
+        try:
+            return self._dumps(value, option=self._option).decode()
+        except TypeError:
+            # orjson rejects some values the stdlib accepts (e.g. ints > 64 bit)
+            return super().dumps(value)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec
+
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder()
+
+    def loads(self, raw: Frame) -> Any:
+        return self._decoder.decode(raw)
+
+    def dumps(self, value: Any) -> str:
+        try:
+            return self._encoder.encode(value).decode()
+        except TypeError:
+            return super().dumps(value)
+
+
+CODECS: dict[str, Callable[[], JsonCodec]] = {
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+    "json": JsonCodec,
+}
+
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    """Return the codec called ``name``, or the fastest installed one.
+
+    ``name`` defaults to the ``NAPCAT_JSON_CODEC`` environment variable and
+    then to ``"auto"``, which tries orjson, msgspec and the stdlib in order.
+    """
+    name = name or os.environ.get("NAPCAT_JSON_CODEC", "auto")
+    if name != "auto":
+        return CODECS[name]()
+    for factory in CODECS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+    return JsonCodec()
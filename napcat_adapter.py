@@ -2,14 +2,18 @@ from __future__ import annotations
 
 import asyncio
 import base64
+import heapq
 import json
+import logging
 import os
 import time
 import uuid
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime
+from enum import IntEnum
 from pathlib import Path
-from typing import Any, Awaitable, Callable, Optional, Type
+from typing import Any, Awaitable, Callable, Hashable, Optional, Type
 
 import websockets
 from dacite import Config
@@ -33,6 +37,9 @@ from mirai.models.message import App, File, Forward, ForwardMessageNode, Message
 
 import mirai_compat  # noqa: F401
 from mirai.models.message import MarketFace, ShortVideo
+from json_codec import JsonCodec, get_codec
+from napcat_replay import FrameRecorder
+from ttl_cache import CacheStats, TTLCache
 from utilities import get_logger
 
 
@@ -40,6 +47,28 @@ Handler = Callable[[Any], Awaitable[None]]
 logger = get_logger()
 
 
+def _construct(model: Type[Any], **fields: Any) -> Any:
+    """Build a mirai model from values that are already typed, skipping pydantic validation.
+
+    Only used for models without validators that rewrite their input, on the
+    inbound message path where validation dominated the decode cost.
+    """
+    return model.construct(**fields)
+
+
+class _LazyStr:
+    """Defers building a log argument until the record is actually formatted."""
+
+    __slots__ = ("_fn", "_args")
+
+    def __init__(self, fn: Callable[..., str], *args: Any) -> None:
+        self._fn = fn
+        self._args = args
+
+    def __str__(self) -> str:
+        return self._fn(*self._args)
+
+
 @dataclass
 class ActionResponse:
     status: str = "ok"
@@ -97,7 +126,564 @@ class ResourceAccessor:
         return await self._setter(*args)
 
 
+@dataclass
+class DispatchStats:
+    enqueued: int = 0
+    dispatched: int = 0
+    dropped: int = 0
+    coalesced: int = 0
+    # handlers a worker stopped waiting for after lane_timeout
+    detached: int = 0
+    max_depth: int = 0
+    last_wait: float = 0.0
+    max_wait: float = 0.0
+    total_wait: float = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.dispatched if self.dispatched else 0.0
+
+
+@dataclass
+class _QueuedEvent:
+    event: Any
+    priority: bool
+    enqueued_at: float
+
+
+@dataclass
+class _EventLane:
+    key: tuple
+    items: deque = field(default_factory=deque)
+    priority_count: int = 0
+    scheduled: bool = False
+    active: bool = False
+
+
+class EventDispatcher:
+    """Bounded fan-out from the websocket reader to event handlers.
+
+    Events are queued in per-group (or per-user) FIFO lanes. Workers serve
+    one event per lane turn and put the lane back at the end of the ready
+    queue, so a flooding group cannot starve the others. Lanes holding
+    notices or admin messages are served first, and those events are
+    admitted past ``max_queue`` up to ``max_priority_queue``.
+
+    Handlers of one lane start in arrival order. A lane waits for its
+    current handler for at most ``lane_timeout`` seconds; after that the
+    handler is detached and the lane moves on, so a slow handler (an AI
+    reply, a render) delays its group's next event by at most
+    ``lane_timeout`` and may still be running when that event starts. At
+    most ``max_detached`` handlers (four per worker by default) may be
+    detached at once; past that, workers wait for their handler, so running
+    handlers stay bounded.
+
+    Overflow policies once a limit is reached: ``"drop"`` drops the
+    incoming event, ``"coalesce"`` evicts the oldest ordinary event from the
+    longest lane to make room. Past ``max_priority_queue`` the oldest
+    priority event is evicted when no ordinary event is left.
+    """
+
+    OVERFLOW_POLICIES = ("drop", "coalesce")
+
+    def __init__(
+        self,
+        emit: Handler,
+        *,
+        workers: int = 8,
+        max_queue: int = 1000,
+        max_priority_queue: Optional[int] = None,
+        overflow: str = "drop",
+        lane_timeout: float = 5.0,
+        max_detached: Optional[int] = None,
+        prioritize: bool = True,
+    ) -> None:
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.emit = emit
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_priority_queue = 2 * max_queue if max_priority_queue is None else max_priority_queue
+        self.overflow = overflow
+        self.lane_timeout = lane_timeout
+        self.max_detached = 4 * workers if max_detached is None else max_detached
+        self.prioritize = prioritize
+        self.stats = DispatchStats()
+        self.depth = 0
+        self._lanes: dict[tuple, _EventLane] = {}
+        self._ready: Optional[asyncio.PriorityQueue] = None
+        self._ready_seq = 0
+        self._worker_tasks: list[asyncio.Task] = []
+        self._running: set[asyncio.Task] = set()
+        self._detached = 0
+
+    def lane_depths(self) -> dict[tuple, int]:
+        return {key: len(lane.items) for key, lane in self._lanes.items() if lane.items}
+
+    def submit(self, event: Any) -> bool:
+        self._ensure_workers()
+        priority = self.prioritize and self._is_priority(event)
+        limit = self.max_priority_queue if priority else self.max_queue
+        if self.depth >= limit and not self._make_room(evict_priority=priority):
+            self.stats.dropped += 1
+            logger.warning("napcat event dropped depth=%d %s", self.depth, self._lane_key(event))
+            return False
+        key = self._lane_key(event)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _EventLane(key)
+        lane.items.append(_QueuedEvent(event, priority, time.monotonic()))
+        if priority:
+            lane.priority_count += 1
+        self.depth += 1
+        self.stats.enqueued += 1
+        self.stats.max_depth = max(self.stats.max_depth, self.depth)
+        if not lane.active and (not lane.scheduled or priority):
+            self._schedule(lane)
+        return True
+
+    async def close(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks.clear()
+        self._ready = None
+        if self.depth:
+            logger.info("napcat event dispatcher closed with %d queued events", self.depth)
+
+    def _ensure_workers(self) -> None:
+        if self._ready is not None:
+            return
+        self._ready = asyncio.PriorityQueue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _schedule(self, lane: _EventLane) -> None:
+        # stale entries are skipped by the worker, so a lane may be queued twice
+        lane.scheduled = True
+        self._ready_seq += 1
+        self._ready.put_nowait((0 if lane.priority_count else 1, self._ready_seq, lane))
+
+    def _make_room(self, *, evict_priority: bool = False) -> bool:
+        if self.overflow != "coalesce" or not self._lanes:
+            return False
+        longest = max(self._lanes.values(), key=lambda lane: len(lane.items) - lane.priority_count)
+        victim = next((item for item in longest.items if not item.priority), None)
+        if victim is None and evict_priority:
+            longest = max(self._lanes.values(), key=lambda lane: len(lane.items))
+            victim = longest.items[0] if longest.items else None
+        if victim is None:
+            return False
+        longest.items.remove(victim)
+        if victim.priority:
+            longest.priority_count -= 1
+        self.depth -= 1
+        self.stats.coalesced += 1
+        if not longest.items and not longest.active:
+            # its ready-queue entry is now stale; a later submit must reschedule
+            self._drop_lane(longest)
+        return True
+
+    def _drop_lane(self, lane: _EventLane) -> None:
+        lane.scheduled = False
+        if self._lanes.get(lane.key) is lane:
+            del self._lanes[lane.key]
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, lane = await self._ready.get()
+            if lane.active or not lane.scheduled:
+                continue
+            if not lane.items:
+                self._drop_lane(lane)
+                continue
+            lane.scheduled = False
+            lane.active = True
+            item: _QueuedEvent = lane.items.popleft()
+            self.depth -= 1
+            if item.priority:
+                lane.priority_count -= 1
+            wait = time.monotonic() - item.enqueued_at
+            self.stats.dispatched += 1
+            self.stats.last_wait = wait
+            self.stats.max_wait = max(self.stats.max_wait, wait)
+            self.stats.total_wait += wait
+            try:
+                task = asyncio.create_task(self.emit(item.event))
+                self._running.add(task)
+                task.add_done_callback(self._on_done)
+                done, _ = await asyncio.wait({task}, timeout=self.lane_timeout)
+                if not done:
+                    if self._detached < self.max_detached:
+                        self._detached += 1
+                        self.stats.detached += 1
+                        task.add_done_callback(self._on_detached_done)
+                    else:
+                        await asyncio.wait({task})
+            finally:
+                self._release_lane(lane)
+
+    def _release_lane(self, lane: _EventLane) -> None:
+        lane.active = False
+        if lane.items:
+            if self._ready is not None:
+                self._schedule(lane)
+        elif not lane.scheduled:
+            self._drop_lane(lane)
+
+    def _on_detached_done(self, task: asyncio.Task) -> None:
+        self._detached -= 1
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("napcat event handler failed", exc_info=task.exception())
+
+    def _lane_key(self, event: Any) -> tuple:
+        if isinstance(event, GroupMessage):
+            return ("group", getattr(getattr(event, "group", None), "id", None))
+        if isinstance(event, MessageEvent):
+            return ("user", getattr(getattr(event, "sender", None), "id", None))
+        group_id = getattr(event, "group_id", None)
+        if group_id is None:
+            group = getattr(event, "group", None) or getattr(getattr(event, "member", None), "group", None)
+            group_id = getattr(group, "id", None)
+        if group_id is None:
+            subject = getattr(event, "subject", None)
+            if getattr(subject, "kind", None) == "Group":
+                group_id = getattr(subject, "id", None)
+        if group_id is not None:
+            return ("group", group_id)
+        return ("user", getattr(event, "from_id", None))
+
+    def _is_priority(self, event: Any) -> bool:
+        if not isinstance(event, MessageEvent):
+            return True
+        permission = getattr(getattr(event, "sender", None), "permission", None)
+        return permission in (Permission.Administrator, Permission.Owner)
+
+
+class SendPriority(IntEnum):
+    # recalls, mutes and kicks: bypass the per-target bucket and the queue bound
+    MODERATION = 0
+    NORMAL = 1
+    # broadcasts and other sends that may wait behind replies
+    BULK = 2
+
+
+class OutboundQueueFull(RuntimeError):
+    pass
+
+
+@dataclass
+class SendStats:
+    enqueued: int = 0
+    sent: int = 0
+    failed: int = 0
+    rejected: int = 0
+    # sends folded into an earlier queued text send to the same target
+    merged: int = 0
+    max_depth: int = 0
+    last_wait: float = 0.0
+    max_wait: float = 0.0
+    total_wait: float = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.sent if self.sent else 0.0
+
+
+class _TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def ready_at(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+@dataclass(order=True)
+class _OutboundItem:
+    priority: int
+    seq: int
+    action: str = field(compare=False)
+    params: dict[str, Any] = field(compare=False)
+    response_cls: Type[ActionResponse] = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    not_before: float = field(compare=False)
+    mergeable: bool = field(compare=False)
+    waiters: list[Optional[asyncio.Future]] = field(compare=False, default_factory=list)
+
+
+@dataclass
+class _OutboundLane:
+    key: Hashable
+    bucket: _TokenBucket
+    items: list[_OutboundItem] = field(default_factory=list)
+    # newest queued item, the only one later text sends may merge into
+    tail: Optional[_OutboundItem] = None
+    busy: bool = False
+
+
+class OutboundScheduler:
+    """Rate-shaped queue in front of the send/moderation actions.
+
+    Every target (group or user) has its own token bucket and sends to it
+    are performed one at a time, in priority order and FIFO within a
+    priority. A global bucket caps the account-wide rate, since QQ risk
+    control looks at the account rather than at single groups.
+
+    With ``merge_window`` > 0, plain-text sends are held for that long and
+    further plain-text sends to the same target made meanwhile are appended
+    to them, so several handlers replying to one message produce a single
+    message. All merged callers receive the same response.
+    """
+
+    MERGEABLE_ACTIONS = ("send_group_msg", "send_private_msg", "send_msg")
+
+    def __init__(
+        self,
+        perform: Callable[[str, dict[str, Any], Type[ActionResponse]], Awaitable[ActionResponse]],
+        *,
+        rate: float = 1.0,
+        burst: float = 5,
+        global_rate: float = 5.0,
+        global_burst: float = 10,
+        max_queue: int = 500,
+        concurrency: int = 4,
+        merge_window: float = 0.0,
+    ) -> None:
+        self.perform = perform
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.concurrency = concurrency
+        self.merge_window = merge_window
+        self.stats = SendStats()
+        self.depth = 0
+        self._global = _TokenBucket(global_rate, global_burst)
+        self._lanes: dict[Hashable, _OutboundLane] = {}
+        self._seq = 0
+        self._inflight = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+
+    def lane_depths(self) -> dict[Hashable, int]:
+        return {key: len(lane.items) for key, lane in self._lanes.items() if lane.items}
+
+    async def submit(
+        self,
+        target: Hashable,
+        action: str,
+        params: dict[str, Any],
+        *,
+        priority: SendPriority = SendPriority.NORMAL,
+        wait: bool = True,
+        response_cls: Type[ActionResponse] = ActionResponse,
+    ) -> Optional[ActionResponse]:
+        """Queue ``action`` for ``target``.
+
+        With ``wait`` the call returns the action's response once it has been
+        performed; otherwise it returns None right away and failures are
+        only logged.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not None and self._loop is not loop and self._loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(
+                self.submit(target, action, params, priority=priority, wait=wait, response_cls=response_cls),
+                self._loop,
+            )
+            return await asyncio.wrap_future(future)
+        self._ensure_pump(loop)
+
+        if self.depth >= self.max_queue and priority != SendPriority.MODERATION:
+            self.stats.rejected += 1
+            logger.warning("napcat outbound queue full depth=%d action=%s target=%s", self.depth, action, target)
+            if wait:
+                raise OutboundQueueFull(f"outbound queue full ({self.depth})")
+            return None
+
+        future = loop.create_future() if wait else None
+        lane = self._lanes.get(target)
+        if lane is None:
+            lane = self._lanes[target] = _OutboundLane(target, _TokenBucket(self.rate, self.burst))
+        now = time.monotonic()
+        mergeable = self.merge_window > 0 and self._is_plain_text(action, params)
+        tail = lane.tail
+        if (
+            mergeable
+            and tail is not None
+            and tail.mergeable
+            and tail.action == action
+            and tail.priority == priority
+            and now - tail.enqueued_at <= self.merge_window
+        ):
+            tail.params["message"] = [*tail.params["message"], {"type": "text", "data": {"text": "\n"}}, *params["message"]]
+            tail.waiters.append(future)
+            self.stats.merged += 1
+        else:
+            self._seq += 1
+            item = _OutboundItem(
+                priority=int(priority),
+                seq=self._seq,
+                action=action,
+                params=params,
+                response_cls=response_cls,
+                enqueued_at=now,
+                not_before=now + self.merge_window if mergeable else now,
+                mergeable=mergeable,
+                waiters=[future],
+            )
+            heapq.heappush(lane.items, item)
+            lane.tail = item
+            self.depth += 1
+            self.stats.enqueued += 1
+            self.stats.max_depth = max(self.stats.max_depth, self.depth)
+            self._wakeup.set()
+        if future is None:
+            return None
+        return await future
+
+    async def close(self) -> None:
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            await asyncio.gather(self._pump_task, return_exceptions=True)
+            self._pump_task = None
+        for lane in self._lanes.values():
+            for item in lane.items:
+                for future in item.waiters:
+                    if future is not None and not future.done():
+                        future.cancel()
+        if self.depth:
+            logger.info("napcat outbound scheduler closed with %d queued sends", self.depth)
+        self._lanes.clear()
+        self.depth = 0
+
+    def _ensure_pump(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._pump_task is not None and self._loop is loop and not self._pump_task.done():
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._pump_task = asyncio.create_task(self._pump())
+
+    def _is_plain_text(self, action: str, params: dict[str, Any]) -> bool:
+        if action not in self.MERGEABLE_ACTIONS:
+            return False
+        message = params.get("message")
+        return bool(message) and all(seg.get("type") == "text" for seg in message)
+
+    async def _pump(self) -> None:
+        while True:
+            self._wakeup.clear()
+            delay = self._start_ready()
+            if delay is None:
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_ready(self) -> Optional[float]:
+        """Start every send that may go now; return how long until the next one could."""
+        while self._inflight < self.concurrency:
+            now = time.monotonic()
+            best: Optional[_OutboundLane] = None
+            next_at: Optional[float] = None
+            for lane in self._lanes.values():
+                if lane.busy or not lane.items:
+                    continue
+                head = lane.items[0]
+                ready_at = head.not_before
+                if head.priority != SendPriority.MODERATION:
+                    ready_at = max(ready_at, lane.bucket.ready_at(now))
+                if ready_at > now:
+                    next_at = ready_at if next_at is None else min(next_at, ready_at)
+                elif best is None or head < best.items[0]:
+                    best = lane
+            if best is None:
+                return None if next_at is None else next_at - now
+            global_at = self._global.ready_at(now)
+            if global_at > now:
+                return global_at - now
+            self._global.take()
+            self._start(best, now)
+        return None
+
+    def _start(self, lane: _OutboundLane, now: float) -> None:
+        item = heapq.heappop(lane.items)
+        if lane.tail is item:
+            lane.tail = None
+        if item.priority != SendPriority.MODERATION:
+            lane.bucket.take()
+        lane.busy = True
+        self.depth -= 1
+        self._inflight += 1
+        wait = now - item.enqueued_at
+        self.stats.last_wait = wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        self.stats.total_wait += wait
+        task = asyncio.create_task(self._run(lane, item))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, lane: _OutboundLane, item: _OutboundItem) -> None:
+        try:
+            resp = await self.perform(item.action, item.params, item.response_cls)
+        except Exception as exc:
+            self.stats.failed += 1
+            if not any(item.waiters):
+                logger.warning("napcat outbound %s failed target=%s", item.action, lane.key, exc_info=True)
+            for future in item.waiters:
+                if future is not None and not future.done():
+                    future.set_exception(exc)
+        else:
+            self.stats.sent += 1
+            for future in item.waiters:
+                if future is not None and not future.done():
+                    future.set_result(resp)
+        finally:
+            lane.busy = False
+            self._inflight -= 1
+            if not lane.items and lane.tail is None:
+                self._lanes.pop(lane.key, None)
+            self._wakeup.set()
+
+
 class NapCatBot:
+    # OneBot segment type -> decoder method, see _message_from_onebot
+    SEGMENT_DECODERS = {
+        "text": "_segment_text",
+        "at": "_segment_at",
+        "face": "_segment_face",
+        "reply": "_segment_reply",
+        "image": "_segment_image",
+        "record": "_segment_record",
+        "video": "_segment_video",
+        "file": "_segment_file",
+        "json": "_segment_json",
+        "forward": "_segment_forward",
+    }
+    NOTICE_DECODERS = {
+        "group_recall": "_notice_group_recall",
+        "group_increase": "_notice_group_increase",
+        "group_ban": "_notice_group_ban",
+        "group_card": "_notice_group_card",
+        "notify": "_notice_notify",
+    }
+
     def __init__(
         self,
         qq: int,
@@ -106,12 +692,35 @@ class NapCatBot:
         access_token: Optional[str] = None,
         reconnect_interval: float = 5.0,
         api_timeout: float = 30.0,
+        event_workers: int = 8,
+        event_queue_size: int = 1000,
+        event_overflow: str = "drop",
+        event_lane_timeout: float = 5.0,
+        json_codec: Optional[str] = None,
+        member_cache_size: int = 20000,
+        member_cache_ttl: float = 600.0,
+        group_cache_size: int = 2000,
+        group_cache_ttl: float = 3600.0,
+        message_cache_size: int = 4096,
+        message_cache_ttl: float = 1800.0,
+        quote_hydration: str = "eager",
+        send_rate: Optional[float] = 1.0,
+        send_burst: float = 5,
+        send_global_rate: float = 5.0,
+        send_global_burst: float = 10,
+        send_queue_size: int = 500,
+        send_concurrency: int = 4,
+        send_merge_window: float = 0.0,
+        record_path: Optional[str] = None,
     ) -> None:
         self.qq = qq
         self.ws_url = ws_url
         self.access_token = access_token
         self.reconnect_interval = reconnect_interval
         self.api_timeout = api_timeout
+        self._codec: JsonCodec = get_codec(json_codec)
+        self._segment_decoders = {typ: getattr(self, name) for typ, name in self.SEGMENT_DECODERS.items()}
+        self._notice_decoders = {typ: getattr(self, name) for typ, name in self.NOTICE_DECODERS.items()}
         self._handlers: list[tuple[Type[Any], Handler]] = []
         self._pending: dict[str, tuple[str, asyncio.Future]] = {}
         self._ws = None
@@ -119,9 +728,35 @@ class NapCatBot:
         self._connected_events: dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
         self._stopping = False
         self._background_tasks: list[asyncio.Task] = []
-        self._event_tasks: set[asyncio.Task] = set()
-        self._group_cache: dict[int, Group] = {}
-        self._member_cache: dict[tuple[int, int], GroupMember] = {}
+        self._dispatcher = EventDispatcher(
+            self._emit,
+            workers=event_workers,
+            max_queue=event_queue_size,
+            overflow=event_overflow,
+            lane_timeout=event_lane_timeout,
+        )
+        self._group_cache: TTLCache[int, Group] = TTLCache(group_cache_size, group_cache_ttl)
+        self._member_cache: TTLCache[tuple[int, int], GroupMember] = TTLCache(member_cache_size, member_cache_ttl)
+        # raw OneBot message dicts (the get_msg shape) keyed by message_id, used to resolve quotes
+        self._message_cache: TTLCache[int, dict[str, Any]] = TTLCache(message_cache_size, message_cache_ttl)
+        if quote_hydration not in ("eager", "lazy"):
+            raise ValueError(f"unknown quote_hydration {quote_hydration!r}")
+        self.quote_hydration = quote_hydration
+        # send_rate=None sends straight through, without the outbound scheduler
+        self._outbound: Optional[OutboundScheduler] = None
+        if send_rate is not None:
+            self._outbound = OutboundScheduler(
+                self._perform_outbound,
+                rate=send_rate,
+                burst=send_burst,
+                global_rate=send_global_rate,
+                global_burst=send_global_burst,
+                max_queue=send_queue_size,
+                concurrency=send_concurrency,
+                merge_window=send_merge_window,
+            )
+        # raw inbound frames and outbound requests, for napcat_replay / benchmarks
+        self._recorder: Optional[FrameRecorder] = FrameRecorder(record_path) if record_path else None
         self.asgi = ASGI()
 
         self.group_list = ResourceAccessor(self._get_group_list)
@@ -178,6 +813,11 @@ class NapCatBot:
         for _, future in list(self._pending.values()):
             if not future.done():
                 future.cancel()
+        await self._dispatcher.close()
+        if self._outbound is not None:
+            await self._outbound.close()
+        if self._recorder is not None:
+            self._recorder.close()
 
     async def background(self) -> None:
         while not self._stopping:
@@ -263,10 +903,12 @@ class NapCatBot:
         logger.info("napcat ws background task started")
 
     async def _handle_raw(self, raw: str | bytes) -> None:
+        if self._recorder is not None:
+            self._recorder.record(raw)
         try:
-            payload = json.loads(raw)
+            payload = self._codec.loads(raw)
         except Exception:
-            logger.warning("napcat ws received invalid json raw=%s", self._preview(raw), exc_info=True)
+            logger.warning("napcat ws received invalid json raw=%s", _LazyStr(self._preview, raw), exc_info=True)
             raise
 
         # logger.debug("napcat ws frame received %s raw=%s", self._payload_summary(payload), self._preview(raw))
@@ -284,27 +926,38 @@ class NapCatBot:
                 future.set_result(payload)
             return
         if echo is not None:
-            logger.warning("napcat api response has unknown echo=%s %s", echo, self._payload_summary(payload))
+            logger.warning("napcat api response has unknown echo=%s %s", echo, _LazyStr(self._payload_summary, payload))
             return
 
         event = await self._event_from_onebot(payload)
         if event is None:
-            logger.debug("napcat event ignored %s", self._payload_summary(payload))
+            logger.debug("napcat event ignored %s", _LazyStr(self._payload_summary, payload))
             return
         # logger.info("napcat event received %s", self._event_summary(event))
         self._schedule_event(event)
 
     def _schedule_event(self, event: Any) -> None:
-        task = asyncio.create_task(self._emit(event))
-        self._event_tasks.add(task)
-        task.add_done_callback(self._event_tasks.discard)
-        logger.debug("napcat event scheduled %s pending_event_tasks=%d", self._event_summary(event), len(self._event_tasks))
+        if self._dispatcher.submit(event) and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("napcat event scheduled %s queue_depth=%d", _LazyStr(self._event_summary, event), self._dispatcher.depth)
+
+    @property
+    def dispatch_stats(self) -> DispatchStats:
+        return self._dispatcher.stats
+
+    @property
+    def send_stats(self) -> Optional[SendStats]:
+        return self._outbound.stats if self._outbound is not None else None
+
+    @property
+    def message_cache_stats(self) -> CacheStats:
+        return self._message_cache.stats
 
     async def _emit(self, event: Any) -> None:
-        try:
-            await self._hydrate_event_quotes(event)
-        except Exception:
-            logger.warning("napcat event quote hydration failed %s", self._event_summary(event), exc_info=True)
+        if self.quote_hydration == "eager":
+            try:
+                await self._hydrate_event_quotes(event)
+            except Exception:
+                logger.warning("napcat event quote hydration failed %s", _LazyStr(self._event_summary, event), exc_info=True)
         for event_type, handler in list(self._handlers):
             if isinstance(event, event_type):
                 await handler(event)
@@ -358,7 +1011,10 @@ class NapCatBot:
         #     echo,
         #     self._preview(params or {}),
         # )
-        await self._ws.send(json.dumps(req, ensure_ascii=False))
+        frame = self._codec.dumps(req)
+        if self._recorder is not None:
+            self._recorder.record(frame)
+        await self._ws.send(frame)
         try:
             payload = await asyncio.wait_for(future, timeout=self.api_timeout)
         except asyncio.TimeoutError:
@@ -477,8 +1133,10 @@ class NapCatBot:
         message_chain=None,
         quote: Optional[int] = None,
         *args,
+        priority: SendPriority = SendPriority.NORMAL,
+        wait: bool = True,
         **kwargs,
-    ) -> MessageResponse:
+    ) -> Optional[MessageResponse]:
         group_id = target
         if group_id is None and args:
             group_id = args[0]
@@ -489,12 +1147,12 @@ class NapCatBot:
             message_chain = args[0]
         forward = self._extract_forward(message_chain)
         if forward is not None:
-            return await self._send_group_forward_message(group_id, forward)
+            return await self._send_group_forward_message(group_id, forward, priority=priority, wait=wait)
         params = {
             "group_id": group_id,
             "message": self._message_to_onebot(message_chain, quote=quote),
         }
-        return await self.call_action("send_group_msg", params, response_cls=MessageResponse)
+        return await self._send_action(("group", group_id), "send_group_msg", params, priority=priority, wait=wait, response_cls=MessageResponse)
 
     async def send_friend_message(
         self,
@@ -502,8 +1160,10 @@ class NapCatBot:
         message_chain=None,
         quote: Optional[int] = None,
         *args,
+        priority: SendPriority = SendPriority.NORMAL,
+        wait: bool = True,
         **kwargs,
-    ) -> MessageResponse:
+    ) -> Optional[MessageResponse]:
         user_id = target
         if user_id is None and args:
             user_id = args[0]
@@ -514,12 +1174,12 @@ class NapCatBot:
             message_chain = args[0]
         forward = self._extract_forward(message_chain)
         if forward is not None:
-            return await self._send_private_forward_message(user_id, forward)
+            return await self._send_private_forward_message(user_id, forward, priority=priority, wait=wait)
         params = {
             "user_id": user_id,
             "message": self._message_to_onebot(message_chain, quote=quote),
         }
-        return await self.call_action("send_private_msg", params, response_cls=MessageResponse)
+        return await self._send_action(("user", user_id), "send_private_msg", params, priority=priority, wait=wait, response_cls=MessageResponse)
 
     async def send_temp_message(
         self,
@@ -528,22 +1188,24 @@ class NapCatBot:
         message_chain=None,
         quote: Optional[int] = None,
         *args,
+        priority: SendPriority = SendPriority.NORMAL,
+        wait: bool = True,
         **kwargs,
-    ) -> MessageResponse:
+    ) -> Optional[MessageResponse]:
         if message_chain is None:
             message_chain = kwargs.get("message")
         if message_chain is None and args:
             message_chain = args[0]
         forward = self._extract_forward(message_chain)
         if forward is not None:
-            return await self._send_private_forward_message(qq, forward)
+            return await self._send_private_forward_message(qq, forward, priority=priority, wait=wait)
         params = {
             "message_type": "private",
             "user_id": qq,
             "group_id": group,
             "message": self._message_to_onebot(message_chain, quote=quote),
         }
-        return await self.call_action("send_msg", params, response_cls=MessageResponse)
+        return await self._send_action(("user", qq), "send_msg", params, priority=priority, wait=wait, response_cls=MessageResponse)
 
     async def send(self, target, message, quote: bool = False) -> int:
         quoting = None
@@ -561,19 +1223,20 @@ class NapCatBot:
             return (await self.send_group_message(target.group.id, message, quote=quoting)).message_id
         raise ValueError(f"{target} is not a valid message target")
 
-    async def recall(self, message_id: int, group: Optional[int] = None):
-        return await self.call_action("delete_msg", {"message_id": message_id})
+    async def recall(self, message_id: int, group: Optional[int] = None, *, wait: bool = True):
+        target = ("group", int(group)) if group else ("recall",)
+        return await self._send_action(target, "delete_msg", {"message_id": message_id}, priority=SendPriority.MODERATION, wait=wait)
 
     async def mute(self, group: int, member: int, time_s: int):
         group_id = int(group)
         user_id = int(member)
         duration = max(0, int(time_s))
-        resp = await self.call_action("set_group_ban", {
+        resp = await self._send_action(("group", group_id), "set_group_ban", {
             "group_id": group_id,
             "user_id": user_id,
             "duration": duration,
-        })
-        cached = self._member_cache.get((group_id, user_id))
+        }, priority=SendPriority.MODERATION)
+        cached = self._member_cache.peek((group_id, user_id))
         if cached is not None:
             cached.mute_time_remaining = duration
         return resp
@@ -584,11 +1247,11 @@ class NapCatBot:
     async def kick(self, group: int, member: int, msg: str = "", reject_add_request: bool = False):
         group_id = int(group)
         user_id = int(member)
-        resp = await self.call_action("set_group_kick", {
+        resp = await self._send_action(("group", group_id), "set_group_kick", {
             "group_id": group_id,
             "user_id": user_id,
             "reject_add_request": bool(reject_add_request),
-        })
+        }, priority=SendPriority.MODERATION)
         self._member_cache.pop((group_id, user_id), None)
         return resp
 
@@ -601,7 +1264,7 @@ class NapCatBot:
             "user_id": user_id,
             "enable": enabled,
         })
-        cached = self._member_cache.get((group_id, user_id))
+        cached = self._member_cache.peek((group_id, user_id))
         if cached is not None:
             cached.permission = Permission.Administrator if enabled else Permission.Member
         return resp
@@ -626,33 +1289,37 @@ class NapCatBot:
         })
 
     async def get_group(self, id_: int) -> Optional[Group]:
-        group = self._group_cache.get(int(id_))
-        if group is not None:
-            return group
-        return await self._fetch_group(id_, no_cache=False)
+        group_id = int(id_)
+
+        async def load():
+            return self._group_from_onebot(
+                await self.call_action_data("get_group_info", {"group_id": group_id, "no_cache": False})
+            )
+
+        return await self._group_cache.get_or_load(group_id, load)
 
     async def _fetch_group(self, id_: int, *, no_cache: bool) -> Optional[Group]:
         data = await self.call_action_data("get_group_info", {"group_id": int(id_), "no_cache": no_cache})
         group = self._group_from_onebot(data)
-        self._group_cache[group.id] = group
+        self._group_cache.set(group.id, group)
         return group
 
     async def get_group_member(self, group, id_: int) -> Optional[GroupMember]:
         group_id = group.id if isinstance(group, Group) else int(group)
-        cached = self._member_cache.get((group_id, int(id_)))
-        if cached is not None:
-            return cached
-        try:
+        user_id = int(id_)
+
+        async def load():
             data = await self.call_action_data("get_group_member_info", {
                 "group_id": group_id,
-                "user_id": id_,
+                "user_id": user_id,
                 "no_cache": False,
             })
+            return await self._member_from_onebot(data, group_id=group_id)
+
+        try:
+            return await self._member_cache.get_or_load((group_id, user_id), load)
         except Exception:
             return None
-        member = await self._member_from_onebot(data, group_id=group_id)
-        self._member_cache[(group_id, member.id)] = member
-        return member
 
     async def _get_group_list(self) -> list[Group]:
         data = await self.call_action_data("get_group_list", {"no_cache": False})
@@ -668,7 +1335,7 @@ class NapCatBot:
         data = await self.call_action_data("get_group_member_list", {"group_id": group, "no_cache": False})
         members = [await self._member_from_onebot(item, group_id=group) for item in data or []]
         for member in members:
-            self._member_cache[(member.group.id, member.id)] = member
+            self._member_cache.set((member.group.id, member.id), member)
         return ListResponse(data=members)
 
     def _get_member_info_update_value(self, info: Any, *names: str):
@@ -722,7 +1389,7 @@ class NapCatBot:
                         "user_id": member,
                         "card": group_card,
                     })
-                    cached = bot._member_cache.get((int(group), int(member)))
+                    cached = bot._member_cache.peek((int(group), int(member)))
                     if cached is not None:
                         cached.member_name = group_card
                     changed = True
@@ -732,7 +1399,7 @@ class NapCatBot:
                         "user_id": member,
                         "special_title": special_title,
                     })
-                    cached = bot._member_cache.get((int(group), int(member)))
+                    cached = bot._member_cache.peek((int(group), int(member)))
                     if cached is not None:
                         cached.special_title = special_title
                     changed = True
@@ -762,13 +1429,13 @@ class NapCatBot:
                     "group_id": group_id,
                     "group_name": name,
                 })
-                cached = bot._group_cache.get(group_id)
+                cached = bot._group_cache.peek(group_id)
                 if cached is None:
-                    bot._group_cache[group_id] = Group(
+                    bot._group_cache.set(group_id, Group(
                         id=group_id,
                         name=name,
                         permission=Permission.Member,
-                    )
+                    ))
                 else:
                     cached.name = name
                 return resp
@@ -776,10 +1443,49 @@ class NapCatBot:
         return GroupConfigAccessor()
 
     async def message_from_id(self, message_id: int, group: Optional[int] = None) -> MessageFromIdResponse:
-        data = await self.call_action_data("get_msg", {"message_id": message_id})
+        data = await self._get_message_data(message_id)
         event = await self._message_event_from_get_msg(data, group)
         return MessageFromIdResponse(data=event)
 
+    async def _get_message_data(self, message_id: int) -> dict[str, Any]:
+        return await self._message_cache.get_or_load(
+            int(message_id),
+            lambda: self.call_action_data("get_msg", {"message_id": message_id}),
+        )
+
+    def _remember_message(self, data: dict[str, Any]) -> None:
+        message_id = self._int_or_none(data.get("message_id"))
+        if message_id is not None and message_id > 0:
+            self._message_cache.set(message_id, data)
+
+    def _remember_sent_message(self, resp: MessageResponse, message: list[dict[str, Any]], *, group_id: Optional[int] = None) -> None:
+        try:
+            message_id = resp.message_id
+        except (TypeError, ValueError):
+            return
+        data = {
+            "message_id": message_id,
+            "message_type": "group" if group_id else "private",
+            "user_id": self.qq,
+            "sender": {"user_id": self.qq},
+            "message": [self._quotable_segment(seg) for seg in message],
+            "time": int(time.time()),
+            # built locally, the sender carries no name or role
+            "synthesized": True,
+        }
+        if group_id:
+            data["group_id"] = group_id
+        self._remember_message(data)
+
+    _MEDIA_PLACEHOLDERS = {"image": "[图片]", "record": "[语音]", "video": "[视频]"}
+
+    def _quotable_segment(self, seg: dict[str, Any]) -> dict[str, Any]:
+        # inline base64 media would pin megabytes per cached message; quotes only need a stand-in
+        placeholder = self._MEDIA_PLACEHOLDERS.get(seg.get("type"))
+        if placeholder is not None and str((seg.get("data") or {}).get("file") or "").startswith("base64://"):
+            return {"type": "text", "data": {"text": placeholder}}
+        return seg
+
     async def file_mkdir(self, parent: str, group: int, name: str):
         return await self.call_action("create_group_file_folder", {
             "group_id": group,
@@ -795,19 +1501,39 @@ class NapCatBot:
         params.update(kwargs)
         return await self.call_action("_send_group_notice", params)
 
-    async def _send_group_forward_message(self, group_id: int, forward: Forward) -> MessageResponse:
+    async def _send_group_forward_message(self, group_id: int, forward: Forward, **kwargs) -> Optional[MessageResponse]:
         params = {
             "group_id": group_id,
             "messages": [self._forward_node_to_onebot(n) for n in forward.node_list],
         }
-        return await self.call_action("send_group_forward_msg", params, response_cls=MessageResponse)
+        return await self._send_action(("group", group_id), "send_group_forward_msg", params, response_cls=MessageResponse, **kwargs)
 
-    async def _send_private_forward_message(self, user_id: int, forward: Forward) -> MessageResponse:
+    async def _send_private_forward_message(self, user_id: int, forward: Forward, **kwargs) -> Optional[MessageResponse]:
         params = {
             "user_id": user_id,
             "messages": [self._forward_node_to_onebot(n) for n in forward.node_list],
         }
-        return await self.call_action("send_private_forward_msg", params, response_cls=MessageResponse)
+        return await self._send_action(("user", user_id), "send_private_forward_msg", params, response_cls=MessageResponse, **kwargs)
+
+    async def _send_action(
+        self,
+        target: Hashable,
+        action: str,
+        params: dict[str, Any],
+        *,
+        priority: SendPriority = SendPriority.NORMAL,
+        wait: bool = True,
+        response_cls: Type[ActionResponse] = ActionResponse,
+    ) -> Optional[ActionResponse]:
+        if self._outbound is None:
+            return await self._perform_outbound(action, params, response_cls)
+        return await self._outbound.submit(target, action, params, priority=priority, wait=wait, response_cls=response_cls)
+
+    async def _perform_outbound(self, action: str, params: dict[str, Any], response_cls: Type[ActionResponse]) -> ActionResponse:
+        resp = await self.call_action(action, params, response_cls=response_cls)
+        if action in OutboundScheduler.MERGEABLE_ACTIONS:
+            self._remember_sent_message(resp, params["message"], group_id=params.get("group_id") if action == "send_group_msg" else None)
+        return resp
 
     def _extract_forward(self, message) -> Optional[Forward]:
         if isinstance(message, Forward):
@@ -908,6 +1634,7 @@ class NapCatBot:
         return None
 
     async def _message_event_from_onebot(self, data: dict[str, Any]):
+        self._remember_message(data)
         message_type = data.get("message_type")
         chain = await self._message_from_onebot(
             data.get("message") or [],
@@ -917,19 +1644,19 @@ class NapCatBot:
             sender_id=data.get("user_id"),
         )
         if message_type == "group":
-            group_id = int(data["group_id"])
-            group = await self._group_from_event(data)
+            group = self._group_from_event_sync(data)
             sender = await self._member_from_event(data, group=group)
-            return GroupMessage(sender=sender, messageChain=chain)
+            return _construct(GroupMessage, sender=sender, message_chain=chain)
         if message_type == "private":
             sub_type = data.get("sub_type")
             sender_data = data.get("sender") or {}
             user_id = int(data.get("user_id"))
             if sub_type == "group" and data.get("group_id"):
-                group = await self._group_from_event(data)
+                group = self._group_from_event_sync(data)
                 sender = await self._member_from_event(data, group=group)
-                return TempMessage(sender=sender, messageChain=chain)
-            return FriendMessage(sender=Friend(id=user_id, nickname=sender_data.get("nickname")), messageChain=chain)
+                return _construct(TempMessage, sender=sender, message_chain=chain)
+            friend = _construct(Friend, id=user_id, nickname=sender_data.get("nickname"), remark=None)
+            return _construct(FriendMessage, sender=friend, message_chain=chain)
         return None
 
     async def _message_event_from_get_msg(self, data: dict[str, Any], group: Optional[int]):
@@ -944,7 +1671,11 @@ class NapCatBot:
         )
         if group_id:
             group_obj = await self.get_group(group_id)
-            sender = await self._member_from_event({"sender": data.get("sender") or {}, "user_id": sender_id, "group_id": group_id}, group=group_obj)
+            if data.get("synthesized"):
+                # our own sent message: never let the bare sender overwrite the cached member
+                sender = self._member_cache.peek((group_id, sender_id)) or self._member_placeholder(group_obj, sender_id)
+            else:
+                sender = await self._member_from_event({"sender": data.get("sender") or {}, "user_id": sender_id, "group_id": group_id}, group=group_obj)
             return GroupMessage(sender=sender, messageChain=chain)
         return FriendMessage(sender=Friend(id=sender_id), messageChain=chain)
 
@@ -967,19 +1698,34 @@ class NapCatBot:
                 continue
             quoted_event = quoted_events.get(comp.id)
             if quoted_event is None:
-                try:
-                    quoted_event = (await self.message_from_id(comp.id, group_id)).data
-                except Exception:
-                    logger.warning(
-                        "napcat quote lookup failed message_id=%s group_id=%s",
-                        comp.id,
-                        group_id,
-                        exc_info=True,
-                    )
+                quoted_event = await self._quoted_event(comp.id, group_id)
+                if quoted_event is None:
                     continue
                 quoted_events[comp.id] = quoted_event
             self._apply_quoted_event_to_quote(comp, quoted_event)
 
+    async def hydrate_quote(self, quote: Quote, event: Optional[MessageEvent] = None) -> Quote:
+        """Fill in ``quote`` from the quoted message; used when quote_hydration is "lazy"."""
+        if self.quote_hydration != "lazy" or quote.id is None or quote.id <= 0:
+            return quote
+        group_id = event.group.id if isinstance(event, (GroupMessage, TempMessage)) else None
+        quoted_event = await self._quoted_event(quote.id, group_id)
+        if quoted_event is not None:
+            self._apply_quoted_event_to_quote(quote, quoted_event)
+        return quote
+
+    async def _quoted_event(self, message_id: int, group_id: Optional[int]) -> Optional[MessageEvent]:
+        try:
+            return (await self.message_from_id(message_id, group_id)).data
+        except Exception:
+            logger.warning(
+                "napcat quote lookup failed message_id=%s group_id=%s",
+                message_id,
+                group_id,
+                exc_info=True,
+            )
+            return None
+
     def _apply_quoted_event_to_quote(self, quote: Quote, event: MessageEvent) -> None:
         sender = getattr(event, "sender", None)
         if sender is not None:
@@ -998,58 +1744,98 @@ class NapCatBot:
             quote.target_id = self.qq if quote.sender_id != self.qq else event.sender.id
 
     async def _notice_event_from_onebot(self, data: dict[str, Any]):
+        self._invalidate_from_notice(data)
+        decoder = self._notice_decoders.get(data.get("notice_type"))
+        return decoder(data) if decoder is not None else None
+
+    def _invalidate_from_notice(self, data: dict[str, Any]) -> None:
         notice_type = data.get("notice_type")
-        group_id = data.get("group_id")
-        if notice_type == "group_recall":
-            group = self._group_from_event_sync(data)
-            operator = None
-            if data.get("operator_id"):
-                operator = self._member_placeholder(group, int(data["operator_id"]))
-            return GroupRecallEvent(
-                authorId=int(data.get("user_id", 0)),
-                messageId=int(data.get("message_id", 0)),
-                time=datetime.fromtimestamp(int(data.get("time", time.time()))),
-                group=group,
-                operator=operator,
-            )
-        if notice_type == "group_increase":
-            group = self._group_from_event_sync(data)
-            member = self._member_placeholder(group, int(data.get("user_id")))
-            invitor = None
-            if data.get("operator_id"):
-                invitor = self._member_placeholder(group, int(data.get("operator_id")))
-            return MemberJoinEvent(member=member, invitor=invitor)
-        if notice_type == "group_ban" and data.get("sub_type") == "lift_ban":
-            group = self._group_from_event_sync(data)
-            member = self._member_placeholder(group, int(data.get("user_id")))
-            operator = None
-            if data.get("operator_id"):
-                operator = self._member_placeholder(group, int(data.get("operator_id")))
-            return MemberUnmuteEvent(member=member, operator=operator)
+        if notice_type in ("group_recall", "friend_recall"):
+            message_id = self._int_or_none(data.get("message_id"))
+            if message_id is not None:
+                self._message_cache.pop(message_id)
+            return
+        group_id = self._int_or_none(data.get("group_id"))
+        user_id = self._int_or_none(data.get("user_id"))
+        if group_id is None or user_id is None:
+            return
+        key = (group_id, user_id)
         if notice_type == "group_card":
-            group = self._group_from_event_sync(data)
-            member = self._member_placeholder(group, int(data.get("user_id")), name=data.get("card_new") or "")
-            return MemberCardChangeEvent(
-                origin=data.get("card_old", ""),
-                current=data.get("card_new", ""),
-                member=member,
-            )
-        if notice_type == "notify" and data.get("sub_type") == "poke":
-            subject = Subject(id=int(group_id), kind="Group") if group_id else Subject(id=int(data.get("user_id")), kind="Friend")
-            return NudgeEvent(
-                fromId=int(data.get("user_id", 0)),
-                target=int(data.get("target_id", 0)),
-                subject=subject,
-                action="戳了戳",
-                suffix="",
-            )
-        return None
+            cached = self._member_cache.peek(key)
+            if cached is not None:
+                cached.member_name = data.get("card_new") or str(user_id)
+        elif notice_type == "group_admin":
+            cached = self._member_cache.peek(key)
+            if cached is not None:
+                cached.permission = Permission.Administrator if data.get("sub_type") == "set" else Permission.Member
+            if user_id == self.qq:
+                self._group_cache.pop(group_id)
+        elif notice_type == "group_decrease":
+            self._member_cache.pop(key)
+            if user_id == self.qq or data.get("sub_type") == "kick_me":
+                self._group_cache.pop(group_id)
+                self._member_cache.invalidate_where(lambda k: k[0] == group_id)
+        elif notice_type in ("group_increase", "group_ban"):
+            self._member_cache.pop(key)
+
+    def _notice_group_recall(self, data: dict[str, Any]):
+        group = self._group_from_event_sync(data)
+        operator = None
+        if data.get("operator_id"):
+            operator = self._member_placeholder(group, int(data["operator_id"]))
+        return GroupRecallEvent(
+            authorId=int(data.get("user_id", 0)),
+            messageId=int(data.get("message_id", 0)),
+            time=datetime.fromtimestamp(int(data.get("time", time.time()))),
+            group=group,
+            operator=operator,
+        )
+
+    def _notice_group_increase(self, data: dict[str, Any]):
+        group = self._group_from_event_sync(data)
+        member = self._member_placeholder(group, int(data.get("user_id")))
+        invitor = None
+        if data.get("operator_id"):
+            invitor = self._member_placeholder(group, int(data.get("operator_id")))
+        return MemberJoinEvent(member=member, invitor=invitor)
+
+    def _notice_group_ban(self, data: dict[str, Any]):
+        if data.get("sub_type") != "lift_ban":
+            return None
+        group = self._group_from_event_sync(data)
+        member = self._member_placeholder(group, int(data.get("user_id")))
+        operator = None
+        if data.get("operator_id"):
+            operator = self._member_placeholder(group, int(data.get("operator_id")))
+        return MemberUnmuteEvent(member=member, operator=operator)
+
+    def _notice_group_card(self, data: dict[str, Any]):
+        group = self._group_from_event_sync(data)
+        member = self._member_placeholder(group, int(data.get("user_id")), name=data.get("card_new") or "")
+        return MemberCardChangeEvent(
+            origin=data.get("card_old", ""),
+            current=data.get("card_new", ""),
+            member=member,
+        )
+
+    def _notice_notify(self, data: dict[str, Any]):
+        if data.get("sub_type") != "poke":
+            return None
+        group_id = data.get("group_id")
+        subject = Subject(id=int(group_id), kind="Group") if group_id else Subject(id=int(data.get("user_id")), kind="Friend")
+        return NudgeEvent(
+            fromId=int(data.get("user_id", 0)),
+            target=int(data.get("target_id", 0)),
+            subject=subject,
+            action="戳了戳",
+            suffix="",
+        )
 
     async def _request_event_from_onebot(self, data: dict[str, Any]):
         if data.get("request_type") != "group":
             return None
         group_id = int(data.get("group_id", 0))
-        group = self._group_cache.get(group_id)
+        group = self._group_cache.peek(group_id)
         flag = data.get("flag", "")
         event_id = int(flag) if str(flag).isdigit() else 0
         event = MemberJoinRequestEvent(
@@ -1073,83 +1859,92 @@ class NapCatBot:
         sender_id: Optional[int] = None,
     ) -> MessageChain:
         if isinstance(segments, str):
-            components = [Plain(segments)]
+            components = [_construct(Plain, text=segments)]
         else:
             components = []
+            decoders = self._segment_decoders
             for segment in segments:
-                component = await self._segment_to_component(segment, group_id=group_id, sender_id=sender_id)
+                decoder = decoders.get(segment.get("type"))
+                if decoder is None:
+                    component = _construct(Plain, text=str(segment))
+                else:
+                    component = decoder(segment.get("data") or {}, group_id, sender_id)
                 if component is None:
                     continue
                 if isinstance(component, list):
                     components.extend(component)
                 else:
                     components.append(component)
-        source = Source(
+        source = _construct(
+            Source,
             id=int(message_id or -1),
             time=datetime.fromtimestamp(int(timestamp or time.time())),
         )
-        return MessageChain([source, *components])
-
-    async def _segment_to_component(self, segment: dict[str, Any], *, group_id: Optional[int], sender_id: Optional[int]):
-        typ = segment.get("type")
-        data = segment.get("data") or {}
-        if typ == "text":
-            return Plain(data.get("text", ""))
-        if typ == "at":
-            qq = data.get("qq")
-            if qq == "all":
-                return AtAll()
-            return At(target=int(qq), display=data.get("name"))
-        if typ == "face":
-            raw_id = data.get("id") or data.get("face_id")
-            return Face(faceId=int(raw_id), name=data.get("name")) if raw_id is not None else None
-        if typ == "reply":
-            quoted_id = int(data.get("id", 0))
-            reply_group_id = self._int_or_none(data.get("group_id")) or group_id
-            reply_sender_id = (
-                self._int_or_none(data.get("qq"))
-                or self._int_or_none(data.get("user_id"))
-                or self._int_or_none(data.get("sender_id"))
-                or self._int_or_none(data.get("senderId"))
-            )
-            reply_origin = MessageChain([])
-            if data.get("text"):
-                reply_origin = MessageChain([Plain(str(data.get("text")))])
-            return Quote(
-                id=quoted_id,
-                groupId=reply_group_id,
-                senderId=reply_sender_id,
-                targetId=reply_group_id or self.qq,
-                origin=reply_origin,
+        return _construct(MessageChain, __root__=[source, *components])
+
+    def _segment_text(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        return _construct(Plain, text=data.get("text", ""))
+
+    def _segment_at(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        qq = data.get("qq")
+        if qq == "all":
+            return _construct(AtAll)
+        return _construct(At, target=int(qq), display=data.get("name"))
+
+    def _segment_face(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        raw_id = data.get("id") or data.get("face_id")
+        return _construct(Face, face_id=int(raw_id), name=data.get("name")) if raw_id is not None else None
+
+    def _segment_reply(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        quoted_id = int(data.get("id", 0))
+        reply_group_id = self._int_or_none(data.get("group_id")) or group_id
+        reply_sender_id = (
+            self._int_or_none(data.get("qq"))
+            or self._int_or_none(data.get("user_id"))
+            or self._int_or_none(data.get("sender_id"))
+            or self._int_or_none(data.get("senderId"))
+        )
+        origin = []
+        if data.get("text"):
+            origin = [_construct(Plain, text=str(data.get("text")))]
+        return _construct(
+            Quote,
+            id=quoted_id,
+            group_id=reply_group_id,
+            sender_id=reply_sender_id,
+            target_id=reply_group_id or self.qq,
+            origin=_construct(MessageChain, __root__=origin),
+        )
+
+    def _segment_image(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        if data.get("emoji_id") or data.get("emoji_package_id"):
+            emoji_id = self._int_or_original(data.get("emoji_id"))
+            emoji_package_id = self._int_or_original(data.get("emoji_package_id"))
+            return MarketFace(
+                id=emoji_package_id if emoji_package_id is not None else emoji_id,
+                name=data.get("summary"),
+                image_id=data.get("file") or data.get("url"),
+                url=data.get("url"),
+                emoji_id=emoji_id,
+                emoji_package_id=emoji_package_id,
             )
-        if typ == "image":
-            if data.get("emoji_id") or data.get("emoji_package_id"):
-                emoji_id = self._int_or_original(data.get("emoji_id"))
-                emoji_package_id = self._int_or_original(data.get("emoji_package_id"))
-                return MarketFace(
-                    id=emoji_package_id if emoji_package_id is not None else emoji_id,
-                    name=data.get("summary"),
-                    image_id=data.get("file") or data.get("url"),
-                    url=data.get("url"),
-                    emoji_id=emoji_id,
-                    emoji_package_id=emoji_package_id,
-                )
-            return Image(imageId=data.get("file"), url=data.get("url"))
-        if typ == "record":
-            return Voice(voiceId=data.get("file"), url=data.get("url"), path=data.get("path"))
-        if typ == "video":
-            return ShortVideo(file=data.get("file"), url=data.get("url"))
-        if typ == "file":
-            return File(id=data.get("file_id") or data.get("file") or "", name=data.get("file") or "", size=int(data.get("file_size") or 0))
-        if typ == "json":
-            return App(content=json.dumps(data.get("data"), ensure_ascii=False) if not isinstance(data.get("data"), str) else data.get("data"))
-        if typ == "forward":
-            return Forward(nodeList=[])
-        return Plain(str(segment))
-
-    async def _group_from_event(self, data: dict[str, Any]) -> Group:
-        group_id = int(data["group_id"])
-        return self._group_from_event_sync(data)
+        # Image validates url and path, keep the validated constructor
+        return Image(imageId=data.get("file"), url=data.get("url"))
+
+    def _segment_record(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        return Voice(voiceId=data.get("file"), url=data.get("url"), path=data.get("path"))
+
+    def _segment_video(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        return ShortVideo(file=data.get("file"), url=data.get("url"))
+
+    def _segment_file(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        return File(id=data.get("file_id") or data.get("file") or "", name=data.get("file") or "", size=int(data.get("file_size") or 0))
+
+    def _segment_json(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        return App(content=json.dumps(data.get("data"), ensure_ascii=False) if not isinstance(data.get("data"), str) else data.get("data"))
+
+    def _segment_forward(self, data: dict[str, Any], group_id: Optional[int], sender_id: Optional[int]):
+        return Forward(nodeList=[])
 
     def _group_from_event_sync(self, data: dict[str, Any]) -> Group:
         group_id = int(data["group_id"])
@@ -1157,39 +1952,42 @@ class NapCatBot:
         if group is not None:
             return group
         sender = data.get("sender") or {}
-        group = Group(
+        group = _construct(
+            Group,
             id=group_id,
             name=str(data.get("group_name") or sender.get("group_name") or group_id),
             permission=Permission.Member,
         )
-        self._group_cache[group.id] = group
+        self._group_cache.set(group.id, group)
         return group
 
     def _member_placeholder(self, group: Group, user_id: int, *, name: Optional[str] = None) -> GroupMember:
-        member = GroupMember(
+        member = _construct(
+            GroupMember,
             id=user_id,
-            memberName=name or str(user_id),
+            member_name=name or str(user_id),
             permission=Permission.Member,
             group=group,
         )
-        self._member_cache[(group.id, member.id)] = member
+        # placeholders carry no real name or role, keep them out of the cache
         return member
 
     async def _member_from_event(self, data: dict[str, Any], *, group: Group) -> GroupMember:
         sender = data.get("sender") or {}
         user_id = int(data.get("user_id") or sender.get("user_id"))
-        member = GroupMember(
+        member = _construct(
+            GroupMember,
             id=user_id,
-            memberName=sender.get("card") or sender.get("nickname") or str(user_id),
+            member_name=sender.get("card") or sender.get("nickname") or str(user_id),
             permission=self._permission_from_role(sender.get("role")),
             group=group,
-            specialTitle=sender.get("title") or "",
+            special_title=sender.get("title") or "",
         )
-        self._member_cache[(group.id, member.id)] = member
+        self._member_cache.set((group.id, member.id), member)
         return member
 
     async def _member_from_onebot(self, data: dict[str, Any], *, group_id: int) -> GroupMember:
-        group = self._group_cache.get(group_id) or await self.get_group(group_id)
+        group = self._group_cache.peek(group_id) or await self.get_group(group_id)
         member = GroupMember(
             id=int(data.get("user_id")),
             memberName=data.get("card") or data.get("nickname") or str(data.get("user_id")),
@@ -0,0 +1,334 @@
+"""Recording and replaying NapCat websocket traffic.
+
+``FrameRecorder`` appends raw frames to a log with one frame per line, the
+same format the benchmarks read. Inbound events, API responses and our
+outbound action requests all go to the same file and can be told apart by
+their keys (``post_type``, ``echo``, ``action``).
+
+``NapCatStandIn`` is a local websocket server that behaves enough like
+NapCat for load tests: it pushes recorded or synthetic events at a fixed
+rate and answers the actions the bot issues with canned or generated data.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional, TextIO, Union
+
+import websockets
+
+from json_codec import JsonCodec, get_codec
+from utilities import get_logger
+
+logger = get_logger()
+
+EVENT_POST_TYPES = ("message", "notice", "request")
+
+
+class FrameRecorder:
+    """Appends raw websocket frames to ``path``, one per line."""
+
+    def __init__(self, path: str, *, flush_every: int = 64) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self._file: Optional[TextIO] = open(path, "a", encoding="utf-8")
+
+    def record(self, raw: Union[str, bytes]) -> None:
+        if self._file is None:
+            return
+        if isinstance(raw, (bytes, bytearray, memoryview)):
+            raw = bytes(raw).decode("utf-8", errors="replace")
+        if "\n" in raw:
+            # keep one frame per line; escaped newlines inside strings are untouched
+            raw = json.dumps(json.loads(raw), ensure_ascii=False)
+        self._file.write(raw)
+        self._file.write("\n")
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_event_frames(path: str) -> list[dict[str, Any]]:
+    """Return the inbound events of a recorded log, skipping responses and our own requests."""
+    frames = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            frame = json.loads(line)
+            if frame.get("post_type") in EVENT_POST_TYPES:
+                frames.append(frame)
+    return frames
+
+
+def synthetic_group_frames(
+    *,
+    self_id: int = 10001,
+    groups: Iterable[int] = (30003,),
+    users: int = 200,
+    texts: Iterable[str] = ("今天吃什么", "早上好", "#签到", "哈哈哈哈", "有人吗"),
+    reply_ratio: float = 0.2,
+    seed: int = 0,
+) -> Iterator[dict[str, Any]]:
+    """Generate an endless stream of plausible group messages."""
+    rng = random.Random(seed)
+    groups = list(groups)
+    texts = list(texts)
+    recent: list[int] = []
+    for message_id in itertools.count(1_000_000):
+        group_id = rng.choice(groups)
+        user_id = 20000 + rng.randrange(users)
+        text = rng.choice(texts)
+        message = []
+        if recent and rng.random() < reply_ratio:
+            message.append({"type": "reply", "data": {"id": str(rng.choice(recent))}})
+        message.append({"type": "text", "data": {"text": text}})
+        recent = (recent + [message_id])[-32:]
+        yield {
+            "self_id": self_id,
+            "user_id": user_id,
+            "time": int(time.time()),
+            "message_id": message_id,
+            "message_seq": message_id,
+            "real_id": message_id,
+            "message_type": "group",
+            "sender": {"user_id": user_id, "nickname": f"成员{user_id}", "card": "", "role": "member"},
+            "raw_message": text,
+            "font": 14,
+            "sub_type": "normal",
+            "message": message,
+            "message_format": "array",
+            "post_type": "message",
+            "group_id": group_id,
+        }
+
+
+@dataclass
+class StandInStats:
+    events_sent: int = 0
+    actions: Counter = field(default_factory=Counter)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def action_count(self) -> int:
+        return sum(self.actions.values())
+
+
+class NapCatStandIn:
+    """Local websocket server that stands in for NapCat.
+
+    Once the bot connects, ``frames`` are pushed at ``rate`` events per
+    second (0 sends as fast as possible) until ``limit`` events have been
+    sent. When a recorded log is looped, message ids (and the reply
+    segments pointing at them) are shifted on every pass so they stay
+    unique. ``api_latency`` delays every action response.
+
+    Extra or overriding action handlers can be passed in ``handlers`` as
+    ``{action: fn(params) -> data}``.
+    """
+
+    def __init__(
+        self,
+        frames: Iterable[dict[str, Any]],
+        *,
+        host: str = "127.0.0.1",
+        port: int = 3901,
+        rate: float = 0,
+        limit: Optional[int] = None,
+        loop_frames: bool = True,
+        api_latency: float = 0.0,
+        handlers: Optional[dict[str, Callable[[dict[str, Any]], Any]]] = None,
+        codec: Optional[JsonCodec] = None,
+    ) -> None:
+        self.frames = frames
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.limit = limit
+        self.loop_frames = loop_frames
+        self.api_latency = api_latency
+        self.codec = codec or get_codec()
+        self.stats = StandInStats()
+        self.done = asyncio.Event()
+        self._messages: dict[int, dict[str, Any]] = {}
+        # ids handed out for messages the bot sends
+        self._next_message_id = itertools.count(900_000_000)
+        self._server = None
+        self._tasks: set[asyncio.Task] = set()
+        self._handlers: dict[str, Callable[[dict[str, Any]], Any]] = {
+            "get_msg": self._get_msg,
+            "get_group_member_info": self._get_group_member_info,
+            "get_group_member_list": self._get_group_member_list,
+            "get_group_info": self._get_group_info,
+            "get_group_list": lambda params: [self._get_group_info({"group_id": 30003})],
+            "get_login_info": lambda params: {"user_id": 10001, "nickname": "bot"},
+            "get_stranger_info": lambda params: {"user_id": params.get("user_id"), "nickname": "陌生人", "qq_level": 10},
+            "send_group_msg": self._send_msg,
+            "send_private_msg": self._send_msg,
+            "send_msg": self._send_msg,
+            "send_group_forward_msg": self._send_msg,
+            "send_private_forward_msg": self._send_msg,
+        }
+        if handlers:
+            self._handlers.update(handlers)
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await websockets.serve(self._serve, self.host, self.port, max_size=None)
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, ws, path: str = "/") -> None:
+        logger.info("napcat stand-in client connected %s", path)
+        pusher = asyncio.create_task(self._push_events(ws))
+        self._tasks.add(pusher)
+        pusher.add_done_callback(self._tasks.discard)
+        try:
+            async for raw in ws:
+                request = self.codec.loads(raw)
+                task = asyncio.create_task(self._answer(ws, request))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            pusher.cancel()
+
+    LOOP_ID_STRIDE = 10_000_000
+
+    def _event_stream(self) -> Iterator[dict[str, Any]]:
+        if not self.loop_frames or not isinstance(self.frames, (list, tuple)):
+            yield from self.frames
+            return
+        for loop_no in itertools.count():
+            if loop_no == 0:
+                yield from self.frames
+                continue
+            offset = loop_no * self.LOOP_ID_STRIDE
+            for frame in self.frames:
+                yield self._shift_ids(frame, offset)
+
+    @staticmethod
+    def _shift_ids(frame: dict[str, Any], offset: int) -> dict[str, Any]:
+        if "message_id" not in frame:
+            return frame
+        frame = dict(frame, message_id=int(frame["message_id"]) + offset)
+        message = frame.get("message")
+        if isinstance(message, list):
+            frame["message"] = [
+                {"type": "reply", "data": dict(seg["data"], id=str(int(seg["data"]["id"]) + offset))}
+                if seg.get("type") == "reply" and str(seg.get("data", {}).get("id", "")).isdigit()
+                else seg
+                for seg in message
+            ]
+        return frame
+
+    async def _push_events(self, ws) -> None:
+        interval = 1 / self.rate if self.rate > 0 else 0
+        self.stats.started_at = time.perf_counter()
+        next_at = time.monotonic()
+        for frame in self._event_stream():
+            if self.limit is not None and self.stats.events_sent >= self.limit:
+                break
+            frame = dict(frame, time=int(time.time()))
+            if frame.get("post_type") == "message":
+                self._messages[int(frame["message_id"])] = frame
+            await ws.send(self.codec.dumps(frame))
+            self.stats.events_sent += 1
+            if interval:
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            elif self.stats.events_sent % 64 == 0:
+                await asyncio.sleep(0)
+        self.stats.finished_at = time.perf_counter()
+        self.done.set()
+
+    async def _answer(self, ws, request: dict[str, Any]) -> None:
+        action = request.get("action", "")
+        params = request.get("params") or {}
+        self.stats.actions[action] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        handler = self._handlers.get(action)
+        try:
+            data = handler(params) if handler is not None else None
+            payload = {"status": "ok", "retcode": 0, "data": data, "message": "", "wording": ""}
+        except Exception as exc:
+            payload = {"status": "failed", "retcode": 1200, "data": None, "message": str(exc), "wording": str(exc)}
+        payload["echo"] = request.get("echo")
+        try:
+            await ws.send(self.codec.dumps(payload))
+        except websockets.ConnectionClosed:
+            pass
+
+    def _send_msg(self, params: dict[str, Any]) -> dict[str, Any]:
+        return {"message_id": next(self._next_message_id)}
+
+    def _get_msg(self, params: dict[str, Any]) -> dict[str, Any]:
+        message_id = int(params.get("message_id", 0))
+        frame = self._messages.get(message_id)
+        if frame is not None:
+            return frame
+        return {
+            "message_id": message_id,
+            "message_type": "group",
+            "group_id": 30003,
+            "user_id": 20000,
+            "sender": {"user_id": 20000, "nickname": "成员20000", "card": "", "role": "member"},
+            "message": [{"type": "text", "data": {"text": "被引用的消息"}}],
+            "time": int(time.time()),
+        }
+
+    def _member_info(self, group_id: int, user_id: int) -> dict[str, Any]:
+        return {
+            "group_id": group_id,
+            "user_id": user_id,
+            "nickname": f"成员{user_id}",
+            "card": "",
+            "sex": "unknown",
+            "age": 0,
+            "area": "",
+            "level": "1",
+            "qq_level": 10,
+            "join_time": 1690000000,
+            "last_sent_time": int(time.time()),
+            "title_expire_time": 0,
+            "unfriendly": False,
+            "card_changeable": True,
+            "is_robot": False,
+            "shut_up_timestamp": 0,
+            "role": "member",
+            "title": "",
+        }
+
+    def _get_group_member_info(self, params: dict[str, Any]) -> dict[str, Any]:
+        return self._member_info(int(params.get("group_id", 0)), int(params.get("user_id", 0)))
+
+    def _get_group_member_list(self, params: dict[str, Any]) -> list[dict[str, Any]]:
+        group_id = int(params.get("group_id", 0))
+        return [self._member_info(group_id, 20000 + i) for i in range(200)]
+
+    def _get_group_info(self, params: dict[str, Any]) -> dict[str, Any]:
+        group_id = int(params.get("group_id", 0))
+        return {"group_id": group_id, "group_name": f"群{group_id}", "member_count": 200, "max_member_count": 500}
@@ -8,7 +8,10 @@ import time
 from types import MethodType, ModuleType
 from typing import Any, Awaitable, Callable, Final, Dict, ForwardRef, Generic, List, Literal, Optional, Set, Tuple, Type, TypeVar, Union, get_args, get_origin
 import pickle
+import struct
+from uuid import uuid4
 import glob
+import heapq
 import re
 from typing import Union
 from mirai import Event, FriendMessage, GroupMessage, MessageChain, MessageEvent, Plain, At, StrangerMessage, TempMessage
@@ -17,7 +20,7 @@ from mirai.models.message import MessageComponent, Quote
 from mirai.models.entities import GroupMember, Group
 import os
 import asyncio
-import aiofile
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import inflection
 from functools import wraps
 import contextvars
@@ -25,12 +28,23 @@ import traceback
 from collections.abc import Iterable
 from mirai.models.api import RespOperate
 
-from utilities import AchvEnum, AchvExtra, GroupMemberOp, GroupOp, Msg, MsgOp, Overrides, ProxyContext, Redirected, ResolverMixer, Source, SourceOp, Target, User, bind, ensure_attr, get_logger, to_unbind
+from http_client import HttpClient
+from utilities import AchvEnum, AchvExtra, GroupLocalStorageAsAt, GroupLocalStorageAsEvent, GroupMemberOp, GroupOp, GroupSpecAsEvent, Msg, MsgOp, Overrides, ProxyContext, Redirected, ResolverMixer, Source, SourceOp, Target, TrackedStorage, User, UserSpecAsEvent, bind, ensure_attr, get_logger, to_unbind
 
 logger = get_logger()
 
 PLUGIN_PATH: Final[str] = './plugins/*.py'
 BACKUP_PATH: Final[str] = './backups'
+# 插件共用的HTTP客户端下载的图片等媒体文件的磁盘缓存
+MEDIA_CACHE_PATH: Final[str] = './cache/media'
+# 增量日志超过这些限制时重新写入完整快照
+WAL_COMPACT_RECORDS: Final[int] = 64
+WAL_COMPACT_BYTES: Final[int] = 4 * 1024 * 1024
+# 最后一次标记dirty后等待BACKUP_WINDOW秒再备份, 但距第一次标记不超过BACKUP_MAX_LATENCY秒
+BACKUP_WINDOW: Final[float] = 2.0
+BACKUP_MAX_LATENCY: Final[float] = 10.0
+# 备份失败后等待这么久再重试, 退出前的最后一次备份失败不再重试
+BACKUP_RETRY_DELAY: Final[float] = 5.0
 
 class CommandNotFoundError(Exception):
     ...
@@ -45,6 +59,25 @@ class InstrAttr(Enum):
     BACKGROUND = auto()
     INTERCEPT_EXCEPTIONS = auto()
     HIGH_PRIORITY = auto()
+    # 不依赖同一事件的其他处理器, 可以与它们并发执行
+    # any_instr全部执行完才会执行fall_instr和指令, 所以审查总在AI回复等之前完成
+    CONCURRENT = auto()
+
+INSTR_KINDS: Final[Tuple[str, ...]] = (
+    '_any_instr_',
+    '_fall_instr_',
+    '_top_instr_name_',
+    '_instr_name_',
+    '_nudge_instr_',
+    '_join_req_instr_',
+    '_joined_instr_',
+    '_member_card_changed_instr_',
+    '_recall_instr_',
+    '_unmute_instr_',
+)
+
+# 这两类指令的属性值是需要匹配的正则
+NAMED_INSTR_KINDS: Final[Tuple[str, ...]] = ('_top_instr_name_', '_instr_name_')
 
 @dataclass
 class PluginPath():
@@ -116,15 +149,25 @@ class State():
     ...
 
 # 被注解的类变量是状态
+# 完整快照写入<module>.pkl, 之后的变化以增量记录追加到<module>.wal
+# 快照末尾附带的wal_id与日志头部一致时, 加载快照后按顺序重放日志
 class BackupMan():
-    t: asyncio.Task
     target: 'Plugin'
     # dirty: bool
+    wal_id: Optional[str]
+    wal_records: int
+    wal_bytes: int
+    storages: Dict[str, TrackedStorage]
+    stats: 'BackupStats'
 
     def __init__(self, target: 'Plugin'):
-        self.t = None
         self.target = target
         # self.dirty = False
+        self.wal_id = None
+        self.wal_records = 0
+        self.wal_bytes = 0
+        self.storages = {}
+        self.stats = BackupStats()
 
     def __enter__(self):
         ...
@@ -133,21 +176,90 @@ class BackupMan():
         self.target.engine.clear_dirty_plugins()
         ...
 
+    def need_compact(self):
+        return self.wal_id is None or self.wal_records >= WAL_COMPACT_RECORDS or self.wal_bytes >= WAL_COMPACT_BYTES
+
     def trigger_backup(self):
-        if self.t is not None and not self.t.done():
-            return
-        async def fn():
-            file_path = self.get_filepath(self.target.__class__)
-            try:
-                by = pickle.dumps(self.target)
-                async with aiofile.async_open(file_path, 'wb') as f:
-                    await f.write(by)
-                logger.debug(f'{self.target.__class__.__name__} state backuped')
-            except Exception as e:
-                logger.error(f'pickle failed {e=}')
-                print(self.target.__getstate__)
-                print(self.target.__getstate__())
-        self.t = asyncio.create_task(fn())
+        self.target.engine.backup_scheduler.mark(self.target)
+
+    # 序列化在事件循环中进行以保证状态一致, 文件读写交给executor
+    async def flush(self, executor: ThreadPoolExecutor) -> int:
+        try:
+            if self.need_compact():
+                wal_id, by = self.dump_snapshot()
+            else:
+                wal_id, by = None, self.dump_delta()
+                if by is None:
+                    return 0
+        except Exception as e:
+            logger.error(f'pickle failed {e=}')
+            print(self.target.__getstate__)
+            print(self.target.__getstate__())
+            # 下次备份时重新写入完整快照
+            self.wal_id = None
+            raise
+
+        loop = asyncio.get_running_loop()
+        try:
+            if wal_id is not None:
+                header = self.pack_record({'wal_id': wal_id})
+                await loop.run_in_executor(executor, self.write_snapshot, by, header)
+                self.wal_id = wal_id
+                self.wal_records = 0
+                self.wal_bytes = len(header)
+                logger.debug(f'{self.target.__class__.__name__} state backuped ({len(by)} bytes)')
+                return len(by) + len(header)
+            await loop.run_in_executor(executor, self.append_wal, by)
+            self.wal_records += 1
+            self.wal_bytes += len(by)
+            logger.debug(f'{self.target.__class__.__name__} state delta backuped ({len(by)} bytes)')
+            return len(by)
+        except Exception as e:
+            logger.error(f'backup failed {e=}')
+            self.wal_id = None
+            raise
+
+    def dump_snapshot(self) -> Tuple[str, bytes]:
+        state = self.target.__getstate__()
+        self.storages = {k: v for k, v in state.items() if isinstance(v, TrackedStorage)}
+        for storage in self.storages.values():
+            storage.get_touched().clear()
+        wal_id = uuid4().hex
+        return wal_id, pickle.dumps(self.target) + pickle.dumps({'wal_id': wal_id})
+
+    def dump_delta(self) -> Optional[bytes]:
+        attrs = {}
+        storages = {}
+        for k, v in self.target.__getstate__().items():
+            if isinstance(v, TrackedStorage) and self.storages.get(k) is v:
+                delta = v.collect_delta()
+                if len(delta) > 0:
+                    storages[k] = delta
+                continue
+            # 被整体替换的存储按普通属性完整写入, 之后再记录它的增量
+            if isinstance(v, TrackedStorage):
+                v.get_touched().clear()
+                self.storages[k] = v
+            attrs[k] = v
+        if len(attrs) == 0 and len(storages) == 0:
+            return None
+        return self.pack_record({'attrs': attrs, 'storages': storages})
+
+    @staticmethod
+    def pack_record(record: Any) -> bytes:
+        by = pickle.dumps(record)
+        return struct.pack('<I', len(by)) + by
+
+    def write_snapshot(self, by: bytes, header: bytes):
+        write_atomic(self.get_filepath(self.target.__class__), by)
+        # 快照落盘后才切换日志, 中途失败时旧日志的wal_id与新快照不符, 不会被重放
+        write_atomic(self.get_wal_filepath(self.target.__class__), header)
+
+    def append_wal(self, by: bytes):
+        with open(self.get_wal_filepath(self.target.__class__), 'ab') as f:
+            f.write(by)
+            f.flush()
+            os.fsync(f.fileno())
 
     def set_dirty(self):
         # self.dirty = True
@@ -157,18 +269,69 @@ class BackupMan():
     def get_filepath(cls, target_cls: Type['Plugin']):
         return os.path.join(BACKUP_PATH, f'{target_cls.__module__.split(".")[-1]}.pkl')
 
+    @classmethod
+    def get_wal_filepath(cls, target_cls: Type['Plugin']):
+        return os.path.join(BACKUP_PATH, f'{target_cls.__module__.split(".")[-1]}.wal')
+
     @classmethod
     def has_backup(cls, target_cls: Type['Plugin']):
         return os.path.exists(cls.get_filepath(target_cls))
 
     @classmethod
-    def load_plugin(cls, target_cls: Type['Plugin']) -> 'Plugin':
-        if cls.has_backup(target_cls):
+    def read_wal(cls, target_cls: Type['Plugin']):
+        file_path = cls.get_wal_filepath(target_cls)
+        if not os.path.exists(file_path):
+            return
+        with open(file_path, 'rb') as f:
+            while True:
+                head = f.read(4)
+                if len(head) < 4:
+                    return
+                size, = struct.unpack('<I', head)
+                by = f.read(size)
+                # 最后一条记录可能写到一半
+                if len(by) < size:
+                    logger.warning(f'{target_cls.__name__} wal truncated')
+                    return
+                yield pickle.loads(by)
+
+    @classmethod
+    def replay_wal(cls, obj: 'Plugin', wal_id: Optional[str]):
+        if wal_id is None:
+            return
+        records = cls.read_wal(obj.__class__)
+        header = next(records, None)
+        if header is None or header.get('wal_id') != wal_id:
+            return
+        cnt = 0
+        for record in records:
+            for k, v in record['attrs'].items():
+                setattr(obj, k, v)
+            for k, delta in record['storages'].items():
+                getattr(obj, k).apply_delta(delta)
+            cnt += 1
+        logger.debug(f'{obj.__class__.__name__} replayed {cnt} wal records')
+
+    # 只读取文件和反序列化, 可以在其他线程中执行
+    @classmethod
+    def read_backup(cls, target_cls: Type['Plugin']) -> 'Plugin':
+        with open(cls.get_filepath(target_cls), 'rb') as f:
+            obj = pickle.load(f)
+            try:
+                meta = pickle.load(f)
+            except EOFError:
+                # 旧版本的快照没有附带信息
+                meta = {}
+        cls.replay_wal(obj, meta.get('wal_id'))
+        return obj
+
+    @classmethod
+    def load_plugin(cls, target_cls: Type['Plugin'], prefetched: Optional[Future] = None) -> 'Plugin':
+        if prefetched is not None or cls.has_backup(target_cls):
             logger.debug(f'resume {target_cls.__name__} from backup')
-            with open(cls.get_filepath(target_cls), 'rb') as f:
-                obj = pickle.load(f)
-                obj.__init__()
-                return obj
+            obj = cls.read_backup(target_cls) if prefetched is None else prefetched.result()
+            obj.__init__()
+            return obj
         else:
             obj = target_cls()
             for anno in obj.__annotations__.keys():
@@ -181,6 +344,145 @@ class BackupMan():
             obj.init_state()
             return obj
 
+# 先写临时文件并fsync, 再原子地替换目标文件
+def write_atomic(file_path: str, by: bytes):
+    tmp_path = f'{file_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(by)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    try:
+        fd = os.open(os.path.dirname(file_path) or '.', os.O_RDONLY)
+    except OSError:
+        # windows下无法打开目录
+        return
+    try:
+        os.fsync(fd)
+    except OSError: ...
+    finally:
+        os.close(fd)
+
+@dataclass
+class BackupStats():
+    flushes: int = 0
+    failures: int = 0
+    # 合并到已在等待中的备份里的dirty标记数
+    coalesced: int = 0
+    bytes: int = 0
+    last_bytes: int = 0
+    last_duration: float = 0
+    max_duration: float = 0
+    # 第一次标记dirty到开始备份的时间
+    last_lag: float = 0
+    max_lag: float = 0
+
+    def record(self, bytes: int, duration: float, lag: float):
+        self.flushes += 1
+        self.bytes += bytes
+        self.last_bytes = bytes
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+
+# 合并一段时间内的dirty标记, 由单个任务依次备份
+# 备份进行中的新标记会进入下一轮, 不会丢失
+class BackupScheduler():
+    window: float
+    max_latency: float
+    retry_delay: float
+    # 插件 -> 第一次标记的时间
+    pending: Dict['Plugin', float]
+    last_mark: float
+    t: Optional[asyncio.Task]
+    wakeup: Optional[asyncio.Event]
+    draining: bool
+    executor: ThreadPoolExecutor
+    stats: BackupStats
+
+    def __init__(self, window: float = BACKUP_WINDOW, max_latency: float = BACKUP_MAX_LATENCY, retry_delay: float = BACKUP_RETRY_DELAY):
+        self.window = window
+        self.max_latency = max_latency
+        self.retry_delay = retry_delay
+        self.pending = {}
+        self.last_mark = 0
+        self.t = None
+        self.wakeup = None
+        self.draining = False
+        # 单线程保证同一插件的文件按顺序写入
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup')
+        self.stats = BackupStats()
+
+    def mark(self, p: 'Plugin'):
+        now = time.monotonic()
+        if p in self.pending:
+            self.stats.coalesced += 1
+            p.backup_man.stats.coalesced += 1
+        else:
+            self.pending[p] = now
+        self.last_mark = now
+        if self.draining or (self.t is not None and not self.t.done()):
+            return
+        self.t = asyncio.create_task(self.run())
+
+    def queue_lag(self) -> float:
+        if len(self.pending) == 0:
+            return 0
+        return time.monotonic() - min(self.pending.values())
+
+    async def wait_window(self):
+        while not self.draining and len(self.pending) > 0:
+            now = time.monotonic()
+            deadline = min(self.last_mark + self.window, min(self.pending.values()) + self.max_latency)
+            if now >= deadline:
+                return
+            self.wakeup = asyncio.Event()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), deadline - now)
+            except asyncio.TimeoutError: ...
+
+    async def run(self):
+        while len(self.pending) > 0:
+            await self.wait_window()
+            batch, self.pending = self.pending, {}
+            failed: Dict['Plugin', float] = {}
+            for p, marked_at in batch.items():
+                started_at = time.monotonic()
+                try:
+                    by = await p.backup_man.flush(self.executor)
+                except Exception:
+                    self.stats.failures += 1
+                    p.backup_man.stats.failures += 1
+                    failed[p] = marked_at
+                    continue
+                if by == 0:
+                    continue
+                duration = time.monotonic() - started_at
+                lag = started_at - marked_at
+                self.stats.record(by, duration, lag)
+                p.backup_man.stats.record(by, duration, lag)
+            if len(failed) > 0:
+                if self.draining:
+                    logger.error(f'backup failed on shutdown: {[p.__class__.__name__ for p in failed]}')
+                    continue
+                # 失败的插件重新标记, 保留第一次标记的时间
+                await asyncio.sleep(self.retry_delay)
+                for p, marked_at in failed.items():
+                    self.pending.setdefault(p, marked_at)
+
+    # 退出前立即写入所有等待中的备份
+    async def flush_all(self):
+        self.draining = True
+        if self.wakeup is not None:
+            self.wakeup.set()
+        try:
+            if self.t is not None and not self.t.done():
+                await self.t
+            await self.run()
+        finally:
+            self.draining = False
+
 def delegate(*attr, custom_resolver: Optional[Callable[[MethodType, list], Awaitable[list]]] = None, custom_wrapper: Optional[Callable[[Callable[..., Awaitable]], Awaitable]]=None):
     def deco(fn):
         @wraps(fn)
@@ -238,6 +540,7 @@ class Plugin(object, metaclass=MetaPlugin):
     path: PluginPath
     backup_man: 'BackupMan'
     engine: 'Engine'
+    http: HttpClient
     disabled: bool
 
     def __getattr__(self, name):
@@ -249,9 +552,11 @@ class Plugin(object, metaclass=MetaPlugin):
 
     def disable(self):
         self.disabled = True
+        self.engine.instr_index.invalidate(self)
 
     def enable(self):
         self.disabled = False
+        self.engine.instr_index.add(self)
 
     def override(self, *args, to: Optional[Target] = None):
         return Overrides(
@@ -271,8 +576,10 @@ class Plugin(object, metaclass=MetaPlugin):
     def init(self, bot: Any, engine: 'Engine'):
         self.bot = bot
         self.engine = engine
+        self.http = engine.http
         self.backup_man = BackupMan(self)
         self.disabled = False
+        self.arg_plans = {}
 
         for _, method in inspect.getmembers(self, predicate=inspect.ismethod):
             
@@ -280,7 +587,11 @@ class Plugin(object, metaclass=MetaPlugin):
                 def get_wrapper(m):
                     return delegate()(m)(self)
 
-                bot.add_background_task(get_wrapper(method))
+                # 延迟加载的插件在bot启动之后才初始化, 直接创建任务
+                if engine.running:
+                    asyncio.create_task(get_wrapper(method))
+                else:
+                    bot.add_background_task(get_wrapper(method))
 
     
     def __setattr__(self, name, value):
@@ -292,6 +603,10 @@ class Plugin(object, metaclass=MetaPlugin):
                 # self.backup_man.set_dirty()
                 # TODO: 写时dirty机制
                 ...
+
+        # 形参解析计划里引用了ResolverMixer提供的解析器, 替换时需要重新生成
+        if 'arg_plans' in self.__dict__ and (isinstance(value, ResolverMixer) or isinstance(self.__dict__.get(name), ResolverMixer)):
+            self.arg_plans.clear()
             
         self.__dict__[name] = value
 
@@ -320,27 +635,182 @@ def flatten(S):
 class PlaceholderEvent(Event):
     ...
 
+@dataclass(eq=False)
+class InstrEntry():
+    plugin: 'Plugin'
+    method: MethodType
+    attrs: list
+    order: Tuple[int, int, int]
+    pattern: Optional[re.Pattern] = None
+    literal: Optional[str] = None
+
+    @property
+    def concurrent(self):
+        return InstrAttr.CONCURRENT in self.attrs
+
+# 加载时按指令类型收集好各插件的指令方法, 避免每条消息都反射一遍所有插件
+# 不含正则元字符的指令名放进字面量表, 大部分指令查表即可命中
+class InstrIndex():
+    entries: Dict[str, List[InstrEntry]]
+    literals: Dict[str, Dict[str, List[InstrEntry]]]
+    patterns: Dict[str, List[InstrEntry]]
+    plugin_order: Dict['Plugin', int]
+
+    def __init__(self) -> None:
+        self.entries = {}
+        self.literals = {}
+        self.patterns = {}
+        self.plugin_order = {}
+
+    def build(self, plugins: Iterable['Plugin']):
+        self.entries.clear()
+        self.literals.clear()
+        self.patterns.clear()
+        for plugin in plugins:
+            self.add(plugin)
+
+    def add(self, plugin: 'Plugin'):
+        self.invalidate(plugin)
+        if plugin.disabled:
+            return
+        plugin_order = self.plugin_order.setdefault(plugin, len(self.plugin_order))
+        for method_order, (_, method) in enumerate(inspect.getmembers(plugin, predicate=inspect.ismethod)):
+            for kind in INSTR_KINDS:
+                if not hasattr(method, kind): continue
+                attrs = method._instr_attrs_
+                entry = InstrEntry(
+                    plugin=plugin,
+                    method=method,
+                    attrs=attrs,
+                    order=(0 if InstrAttr.HIGH_PRIORITY in attrs else 1, plugin_order, method_order),
+                )
+                if kind in NAMED_INSTR_KINDS:
+                    name: str = getattr(method, kind)
+                    entry.pattern = re.compile(name, flags=re.IGNORECASE)
+                    if re.escape(name) == name:
+                        entry.literal = name.lower()
+                self._insert(kind, entry)
+
+    def _insert(self, kind: str, entry: InstrEntry):
+        def insert_sorted(li: List[InstrEntry]):
+            li.append(entry)
+            li.sort(key=lambda e: e.order)
+
+        insert_sorted(self.entries.setdefault(kind, []))
+        if entry.pattern is None:
+            return
+        if entry.literal is not None:
+            insert_sorted(self.literals.setdefault(kind, {}).setdefault(entry.literal, []))
+        else:
+            insert_sorted(self.patterns.setdefault(kind, []))
+
+    def invalidate(self, plugin: 'Plugin'):
+        def without(li: List[InstrEntry]):
+            return [e for e in li if e.plugin is not plugin]
+
+        for kind in list(self.entries.keys()):
+            self.entries[kind] = without(self.entries[kind])
+        for kind in list(self.patterns.keys()):
+            self.patterns[kind] = without(self.patterns[kind])
+        for literals in self.literals.values():
+            for literal in list(literals.keys()):
+                remains = without(literals[literal])
+                if len(remains) > 0:
+                    literals[literal] = remains
+                else:
+                    del literals[literal]
+
+    def of(self, kind: str, plugins: Optional[Iterable['Plugin']] = None) -> List[InstrEntry]:
+        entries = self.entries.get(kind, [])
+        if plugins is None:
+            return entries
+        plugins = list(plugins)
+        return [e for e in entries if e.plugin in plugins]
+
+    def match(self, kind: str, name: str, plugins: Optional[Iterable['Plugin']] = None) -> List[Tuple[InstrEntry, re.Match]]:
+        if plugins is not None:
+            plugins = list(plugins)
+        candidates = heapq.merge(
+            self.literals.get(kind, {}).get(name.lower(), []),
+            self.patterns.get(kind, []),
+            key=lambda e: e.order
+        )
+        res = []
+        for entry in candidates:
+            if plugins is not None and entry.plugin not in plugins: continue
+            match_result = entry.pattern.fullmatch(name)
+            if match_result:
+                res.append((entry, match_result))
+        return res
+
+def get_rss() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@dataclass
+class PluginLoadStat():
+    name: str
+    module: str
+    import_time: float = 0
+    # 导入模块前后的常驻内存差, 无法获取时为None
+    import_rss: Optional[int] = None
+    unpickle_time: float = 0
+    init_time: float = 0
+    init_rss: Optional[int] = None
+    deferred: bool = False
+
+    @property
+    def total_time(self):
+        return self.import_time + self.unpickle_time + self.init_time
+
+    @property
+    def total_rss(self):
+        if self.import_rss is None or self.init_rss is None:
+            return None
+        return self.import_rss + self.init_rss
+
 class Engine():
     plugins: Dict[str, Plugin]
     dirty_plugins: Set[Plugin]
+    instr_index: InstrIndex
+    backup_scheduler: BackupScheduler
+    http: HttpClient
+    # bot开始运行后为True, 之后加载的插件需要自行启动后台任务
+    running: bool
+    deferred_plugin_clses: List[Type[Plugin]]
+    backup_futures: Dict[Type[Plugin], Future]
+    load_stats: Dict[str, PluginLoadStat]
     bot: Any
     _context: contextvars.ContextVar = contextvars.ContextVar['Context']('Context')
 
     def __init__(self, bot: Any) -> None:
         self.plugins = {}
         self.dirty_plugins = set()
+        self.instr_index = InstrIndex()
+        self.backup_scheduler = BackupScheduler()
+        self.http = HttpClient(media_cache_dir=MEDIA_CACHE_PATH)
+        self.running = False
+        self.deferred_plugin_clses = []
+        self.backup_futures = {}
+        self.load_stats = {}
         # self._context = contextvars.ContextVar[Context]('Context')
         self.bot = bot
 
-    def load(self):
+    def load(self, defer_load: bool = True):
         mods: List[ModuleType] = []
+        import_stats: Dict[str, Tuple[float, Optional[int]]] = {}
         for file in glob.glob(PLUGIN_PATH):
             mod_name = file.replace('\\', '/').replace('./', '.').replace('/', '.')[:-3]
             mod_name = mod_name[1:]
             spec = importlib.util.spec_from_file_location(mod_name, file)
             mod = importlib.util.module_from_spec(spec)
             sys.modules[mod_name] = mod
+            started_at, rss = time.perf_counter(), get_rss()
             spec.loader.exec_module(mod)
+            import_stats[mod_name] = (time.perf_counter() - started_at, None if rss is None else get_rss() - rss)
             mods.append(mod)
         
         for mod in mods:
@@ -348,15 +818,81 @@ class Engine():
                 if issubclass(member, Plugin):
                     globals()[member.__name__] = member
 
+        plugin_clses: List[Type[Plugin]] = []
         for mod in mods:
             for _, member in inspect.getmembers(mod, lambda m: inspect.isclass(m) and m.__module__ == mod.__name__):
                 if issubclass(member, Plugin):
-                    self._load_plugin_cls(member)
+                    plugin_clses.append(member)
+                    import_time, import_rss = import_stats[mod.__name__]
+                    self.load_stats[member.__name__] = PluginLoadStat(
+                        name=member.__name__,
+                        module=mod.__name__,
+                        import_time=import_time,
+                        import_rss=import_rss,
+                    )
+
+        # 所有模块导入完成后才能反序列化, 备份中可能引用其他插件模块中的类
+        self.prefetch_backups(plugin_clses)
+
+        for member in plugin_clses:
+            if defer_load and ensure_attr(member, PluginConfig).defer_load:
+                self.deferred_plugin_clses.append(member)
+                continue
+            self._load_plugin_cls(member)
+
+        self.instr_index.build(self.plugins.values())
 
         for plugin in self.plugins.values():
             if isinstance(plugin, AllLoadedNotifier):
                 plugin.all_loaded()
 
+        if len(self.deferred_plugin_clses) > 0:
+            self.bot.add_background_task(self.load_deferred)
+        self.report_load_stats()
+
+    def prefetch_backups(self, plugin_clses: List[Type[Plugin]]):
+        clses = [member for member in plugin_clses if BackupMan.has_backup(member)]
+        if len(clses) == 0:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(8, len(clses)), thread_name_prefix='unpickle')
+        def read_backup(member: Type[Plugin]):
+            started_at = time.perf_counter()
+            try:
+                return BackupMan.read_backup(member)
+            finally:
+                self.load_stats[member.__name__].unpickle_time = time.perf_counter() - started_at
+        for member in clses:
+            self.backup_futures[member] = executor.submit(read_backup, member)
+        executor.shutdown(wait=False)
+
+    # bot启动后再加载标记了defer_load的插件, 在此之前这些插件不会响应事件
+    async def load_deferred(self):
+        self.running = True
+        for member in self.deferred_plugin_clses:
+            future = self.backup_futures.get(member)
+            if future is not None:
+                await asyncio.wrap_future(future)
+            self.load_stats[member.__name__].deferred = True
+            p = self._load_plugin_cls(member)
+            self.instr_index.add(p)
+            await asyncio.sleep(0)
+        self.deferred_plugin_clses.clear()
+
+        for plugin in self.plugins.values():
+            if isinstance(plugin, AllLoadedNotifier):
+                plugin.all_loaded()
+        self.report_load_stats(deferred=True)
+
+    def report_load_stats(self, deferred: bool = False):
+        def fmt_rss(rss: Optional[int]):
+            return '?' if rss is None else f'{rss / 1024 / 1024:.1f}MB'
+        loaded = {p.__class__.__name__ for p in self.plugins.values()}
+        stats = [stat for stat in self.load_stats.values() if stat.deferred == deferred and stat.name in loaded]
+        stats.sort(key=lambda stat: stat.total_time, reverse=True)
+        for stat in stats:
+            logger.info(f'{stat.name:<20} {stat.total_time:.3f}s (import {stat.import_time:.3f}s, unpickle {stat.unpickle_time:.3f}s, init {stat.init_time:.3f}s) rss {fmt_rss(stat.total_rss)}')
+        logger.info(f'{len(stats)} {"deferred " if deferred else ""}plugins loaded in {sum(stat.total_time for stat in stats):.3f}s')
+
     def append_dirty_plugin(self, p: Plugin):
         self.dirty_plugins.add(p)
         ...
@@ -372,8 +908,17 @@ class Engine():
         if may_already_exist is not None:
             return may_already_exist
         logger.info(f'loading {member.__name__}...')
-        p = BackupMan.load_plugin(member)
+        prefetched = self.backup_futures.pop(member, None)
+        if prefetched is not None:
+            # 等待反序列化的时间已计入unpickle_time
+            wait([prefetched])
+        started_at, rss = time.perf_counter(), get_rss()
+        p = BackupMan.load_plugin(member, prefetched)
         p.init(self.bot, self)
+        stat = self.load_stats.get(member.__name__)
+        if stat is not None:
+            stat.init_time = time.perf_counter() - started_at
+            stat.init_rss = None if rss is None else get_rss() - rss
         config = ensure_attr(member, PluginConfig)
         self.plugins[config.name] = p
 
@@ -444,8 +989,11 @@ class Context(ResolverMixer):
         self.token = None
         self.event = event
         self.overrides_stack_save = contextvars.ContextVar[list[Overrides]]('overrides_stack_save')
-        self.redirected: 'Redirected' = None
+        # 并发执行的处理器各自持有redirected, 互不覆盖
+        self.redirected_save = contextvars.ContextVar['Redirected']('redirected_save', default=None)
         self.debug = False
+        self.resolvers: Dict[type, Callable[..., Any]] = None
+        self.resolved: Dict[Tuple[Tuple[int, ...], Any], Any] = {}
 
     def __enter__(self):
         ...
@@ -464,37 +1012,46 @@ class Context(ResolverMixer):
     def get_instr_attr_name(self):
         ...
 
-    async def instrs(self, instr_attr_name, cb: Callable[[MethodType], Awaitable], *, raise_error = False, plugins: list[Plugin] = None):
-        if plugins is None:
-            plugins = self.engine.plugins.values()
+    async def instrs(self, instr_attr_name, cb: Callable[[MethodType], Awaitable], *, raise_error = False, plugins: list[Plugin] = None, entries: List[InstrEntry] = None):
+        if entries is None:
+            entries = self.engine.instr_index.of(instr_attr_name, plugins)
         with self:
-            for plugin in plugins:
-                if plugin.disabled: continue
-                
-                for _, method in inspect.getmembers(plugin, predicate=inspect.ismethod):
-                    if hasattr(method, instr_attr_name):
-                        # print(f'found {method=}')
-                        if InstrAttr.FORCE_BACKUP in method._instr_attrs_:
-                            plugin.backup_man.set_dirty()
-                        res = None
-                        try:
-                            async with plugin.override() as redirected:
-                                self.set_redirected(None)
-                                try:
-                                    res = await cb(method) # 需要抛一个异常让with吃到
-                                except Exception as e:
-                                    if not isinstance(e, ExecFailedError) and InstrAttr.INTERCEPT_EXCEPTIONS not in method._instr_attrs_:
-                                        raise
-                                    else:
-                                        if self.debug:
-                                            traceback.print_exc()
-                        except: ...
-                        if res is not None:
-                            if self.redirected is None:
-                                redirected(res, attrs=method._instr_attrs_)
-                        if self.redirected is not None:
-                            await self.send()
-
+            tasks: List[asyncio.Task] = []
+            for entry in entries:
+                if entry.plugin.disabled: continue
+                if entry.concurrent:
+                    copied = self.copy_overrides_stack()
+                    async def task(entry=entry, copied=copied):
+                        self.set_overrides_stack(copied)
+                        await self.run_instr(entry, cb)
+                    tasks.append(asyncio.create_task(task()))
+                else:
+                    await self.run_instr(entry, cb)
+            if len(tasks) > 0:
+                await asyncio.gather(*tasks)
+
+    async def run_instr(self, entry: InstrEntry, cb: Callable[[MethodType], Awaitable]):
+        plugin = entry.plugin
+        if InstrAttr.FORCE_BACKUP in entry.attrs:
+            plugin.backup_man.set_dirty()
+        res = None
+        try:
+            async with plugin.override() as redirected:
+                self.set_redirected(None)
+                try:
+                    res = await cb(entry.method) # 需要抛一个异常让with吃到
+                except Exception as e:
+                    if not isinstance(e, ExecFailedError) and InstrAttr.INTERCEPT_EXCEPTIONS not in entry.attrs:
+                        raise
+                    else:
+                        if self.debug:
+                            traceback.print_exc()
+        except: ...
+        if res is not None:
+            if self.redirected is None:
+                redirected(res, attrs=entry.attrs)
+        if self.redirected is not None:
+            await self.send()
 
     async def exec(self):
         async def cb(method: MethodType):
@@ -544,9 +1101,19 @@ class Context(ResolverMixer):
     
     def remove_overrides(self, o: Overrides):
         self.get_overrides_stack().remove(o)
+        if o.vals:
+            self.resolved = {k: v for k, v in self.resolved.items() if id(o) not in k[0]}
+
+    # 解析结果的缓存按当前生效的覆盖值区分, 不带覆盖值的Overrides不影响解析结果
+    def get_overrides_signature(self) -> Tuple[int, ...]:
+        return tuple(id(o) for o in self.get_overrides_stack() if o.vals)
+
+    @property
+    def redirected(self) -> 'Redirected':
+        return self.redirected_save.get()
 
     def set_redirected(self, redirected: 'Redirected'):
-        self.redirected = redirected
+        self.redirected_save.set(redirected)
         # print(f'{self.redirected=}')
 
     async def get_override(self, t, _def_factory: Callable[[], Awaitable]=None):
@@ -565,6 +1132,11 @@ class Context(ResolverMixer):
         ...
 
     def resolver_mixin(self) -> Dict[type, Callable[..., Any]]:
+        if self.resolvers is None:
+            self.resolvers = self.build_resolvers()
+        return self.resolvers
+
+    def build_resolvers(self) -> Dict[type, Callable[..., Any]]:
         async def resolve_user(event: Event):
             async def user_from_event():
                 if isinstance(event, (GroupMessage, FriendMessage, StrangerMessage, TempMessage)):
@@ -606,6 +1178,10 @@ class Context(ResolverMixer):
         async def resolve_quote(event: MessageEvent):
             for c in event.message_chain:
                 if isinstance(c, Quote):
+                    # 延迟补全引用内容的bot只在真正用到Quote参数时才去查询
+                    hydrate = getattr(self.engine.bot, 'hydrate_quote', None)
+                    if hydrate is not None:
+                        return await hydrate(c, event)
                     return c
             else:
                 raise ExecFailedError(f'消息类型不匹配 Quote, {event=}')
@@ -737,78 +1313,156 @@ class Context(ResolverMixer):
         return comp.text
 
 
-    async def resolve_args(self, method: MethodType, chain: List[Union[MessageComponent, Any]], plugin: Plugin = None, *, match: re.Match[str] = None):
+    def get_resolved(self, key):
+        res = self.resolved[key]
+        if isinstance(res, ExecFailedError):
+            raise ExecFailedError(*res.args)
+        return res
+
+    def get_arg_plan(self, method: Callable, plugin: Plugin, plan_key: Any = None) -> 'ArgPlan':
+        if plan_key is None:
+            plan_key = (to_unbind(method), inspect.ismethod(method))
+        plan = plugin.arg_plans.get(plan_key)
+        if plan is None:
+            plan = self.build_arg_plan(method, plugin)
+            plugin.arg_plans[plan_key] = plan
+        return plan
+
+    def build_arg_plan(self, method: Callable, plugin: Plugin) -> 'ArgPlan':
         s = inspect.signature(method)
-        if plugin is None:
-            plugin = method.__self__
         params = [p for p in s.parameters.values() if p.kind not in (p.KEYWORD_ONLY, p.VAR_KEYWORD)]
-        
-        if isinstance(self.event, MessageEvent) and not self.is_target_msg(params, self.event):
-            raise ExecFailedError(f'无法在当前上下文中调用')
-        args = []
-        resolvers = plugin.get_resolvers()
-        resolvers.update(self.resolver_mixin())
+
+        ctx_resolvers = self.resolver_mixin()
+
+        # 优先级与原先合并字典的顺序一致: ResolverMixer > 上下文 > get_resolvers
+        mixer_resolvers: Dict[type, Callable[..., Any]] = {}
         for ff in plugin.__dict__.values():
             if not isinstance(ff, ResolverMixer): continue
-            resolvers.update(ff.resolver_mixin())
+            mixer_resolvers.update(ff.resolver_mixin())
+        own_resolvers = plugin.get_resolvers()
+
+        def find_resolver(anno) -> Optional[ResolverRef]:
+            if anno in mixer_resolvers:
+                resolver = mixer_resolvers[anno]
+            elif anno in ctx_resolvers:
+                return ResolverRef(
+                    ctx_anno=anno,
+                    is_coro=inspect.iscoroutinefunction(ctx_resolvers[anno]),
+                    memo_key=(Context, anno) if anno in MEMOIZED_CTX_TYPES else None
+                )
+            elif anno in own_resolvers:
+                resolver = own_resolvers[anno]
+            else:
+                return None
+            if isinstance(resolver, Iterable):
+                resolver = next(iter(resolver), None)
+                if resolver is None:
+                    return None
+            return ResolverRef(
+                fn=resolver,
+                is_coro=inspect.iscoroutinefunction(resolver),
+                memo_key=resolver if get_origin(anno) in MEMOIZED_VIEW_TYPES else None,
+                memo_by_at=get_origin(anno) is GroupLocalStorageAsAt
+            )
+
+        allowed_events = None
+        for p in params:
+            allowed_events = self.get_allowed_events(p)
+            if allowed_events is not None: break
+
+        param_plans = []
         for p in params:
+            pp = ParamPlan(param=p, var_positional=p.kind is inspect._ParameterKind.VAR_POSITIONAL)
+            param_plans.append(pp)
+            anno = p.annotation
+            pp.is_event = self.is_type_of(anno, Event)
+            if self.is_type_of(anno, Context):
+                pp.is_context = True
+                continue
+            pp.injected = self.engine.try_load_injector(anno)
+            if pp.injected is not None:
+                continue
+            pp.resolver = find_resolver(anno)
+            if self.is_optional(anno):
+                pp.will_skip = True
+                anno = get_args(anno)[0]
+            if p.default is not inspect._empty:
+                pp.will_skip = True
+            pp.anno = anno
+            pp.anno_resolver = find_resolver(anno)
+            pp.patharg = try_get_patharg_params(anno, p.name)
+        return ArgPlan(params=param_plans, allowed_events=allowed_events)
+
+    async def resolve_args(self, method: MethodType, chain: List[Union[MessageComponent, Any]], plugin: Plugin = None, *, match: re.Match[str] = None, plan_key: Any = None):
+        if plugin is None:
+            plugin = method.__self__
+        plan = self.get_arg_plan(method, plugin, plan_key)
+
+        if isinstance(self.event, MessageEvent) and plan.allowed_events is not None and not isinstance(self.event, plan.allowed_events):
+            raise ExecFailedError(f'无法在当前上下文中调用')
+        args = []
+        for pp in plan.params:
+            p = pp.param
             #下面这些是不消耗实参，直接从上下文中获得的形参
-            if self.is_type_of(p.annotation, Event) and isinstance(self.event, p.annotation):
+            if pp.is_event and isinstance(self.event, p.annotation):
                 args.append(self.event)
                 continue
-            if self.is_type_of(p.annotation, Context):
+            if pp.is_context:
                 args.append(self)
                 continue
-            injected = self.engine.try_load_injector(p.annotation)
-            if injected is not None:
-                if isinstance(injected, InjectNotifier):
-                    injected.injected(plugin)
-                args.append(injected)
+            if pp.injected is not None:
+                if isinstance(pp.injected, InjectNotifier):
+                    pp.injected.injected(plugin)
+                args.append(pp.injected)
                 continue
-            async def append_from_resolver(anno):
-                # print(f'append_from_resolver prep {anno=}, {resolvers=}')
-                if anno in resolvers:
-                    resolvers_of_type = resolvers[anno]
-
-                    if not isinstance(resolvers_of_type, Iterable):
-                        resolvers_of_type = [resolvers_of_type]
-                    
-                    for resolver in resolvers_of_type:
-                        # print(f'append_from_resolver try {anno=}, {resolver=}')
-                        sub_args = await self.resolve_args(resolver, chain, plugin)
-                        # print(f'{sub_args=}')
-                        try:
-                            if inspect.iscoroutinefunction(resolver):
-                                sub_res = await resolver(*sub_args)
-                            else:
-                                sub_res = resolver(*sub_args)
-                            args.append(sub_res)
-                            # print(f'append_from_resolver result {anno=}, {sub_res=}')
-                        except ExecFailedError as e:
-                            # traceback.print_exc()
-                            raise
+            async def append_from_resolver(ref: Optional[ResolverRef]):
+                if ref is None:
+                    return False
+                key = None
+                if ref.memo_key is not None:
+                    key = (self.get_overrides_signature(), ref.memo_key)
+                    if key in self.resolved:
+                        args.append(self.get_resolved(key))
                         return True
-                return False
+                try:
+                    if ref.fn is not None:
+                        resolver = ref.fn
+                        sub_args = await self.resolve_args(resolver, chain, plugin)
+                    else:
+                        resolver = self.resolver_mixin()[ref.ctx_anno]
+                        sub_args = await self.resolve_args(resolver, chain, plugin, plan_key=(Context, ref.ctx_anno))
+                    if ref.memo_by_at:
+                        at = next((a for a in sub_args if isinstance(a, At)), None)
+                        if at is not None:
+                            key = (self.get_overrides_signature(), (ref.fn, at.target))
+                            if key in self.resolved:
+                                args.append(self.get_resolved(key))
+                                return True
+                    if ref.is_coro:
+                        sub_res = await resolver(*sub_args)
+                    else:
+                        sub_res = resolver(*sub_args)
+                except ExecFailedError as e:
+                    if key is not None:
+                        self.resolved[key] = e
+                    raise
+                if key is not None:
+                    self.resolved[key] = sub_res
+                args.append(sub_res)
+                return True
 
             async def append_single_arg():
-                anno = p.annotation
-                will_skip = False
+                anno = pp.anno
                 front = None
                 curr_arg = None
                 try:
-                    if await append_from_resolver(anno): return
+                    if await append_from_resolver(pp.resolver): return
                 except ExecFailedError as e:
                     ...
-                if self.is_optional(anno):
-                    will_skip = True
-                    anno = get_args(anno)[0]
-                if  p.default is not inspect._empty:
-                    will_skip = True
                 try:
-                    if await append_from_resolver(anno): return
-                    patharg_params = try_get_patharg_params(anno, p.name)
-                    if patharg_params is not None and match is not None:
-                        xtype, pos = patharg_params
+                    if await append_from_resolver(pp.anno_resolver): return
+                    if pp.patharg is not None and match is not None:
+                        xtype, pos = pp.patharg
                         curr_arg = match[pos]
                         anno = xtype
                     else:
@@ -854,20 +1508,52 @@ class Context(ResolverMixer):
                 # except ExecFailedError as e:
                 #     raise
                 except Exception as e:
-                    if not will_skip: raise
+                    if not pp.will_skip: raise
                     if front is not None:
                         chain.insert(0, front)
                     default = p.default
                     if default is inspect._empty:
                         default = None
                     args.append(default)
-            if p.kind is inspect._ParameterKind.VAR_POSITIONAL:
+            if pp.var_positional:
                 while len(chain) > 0:
                     await append_single_arg()
             else:
                 await append_single_arg()
         return args
 
+# 这些解析结果在同一个事件内不会变化(除非被override), 解析一次后缓存在上下文中
+# 存储的数据本身不缓存, 因为处理器可能在同一事件内创建或删除它
+MEMOIZED_CTX_TYPES: Final = (User, Group, GroupMember, Source, Msg)
+MEMOIZED_VIEW_TYPES: Final = (GroupLocalStorageAsEvent, GroupSpecAsEvent, UserSpecAsEvent)
+
+@dataclass
+class ResolverRef():
+    fn: Optional[Callable] = None # 插件自身或ResolverMixer提供的解析器
+    ctx_anno: Any = None # 上下文提供的解析器, 闭包随上下文变化, 执行时再按注解取
+    is_coro: bool = False
+    memo_key: Any = None
+    memo_by_at: bool = False # GroupLocalStorageAsAt按at的目标缓存
+
+@dataclass
+class ParamPlan():
+    param: inspect.Parameter
+    var_positional: bool = False
+    is_event: bool = False
+    is_context: bool = False
+    injected: Optional[Plugin] = None
+    resolver: Optional[ResolverRef] = None
+    anno: Any = None # 去掉Optional之后的注解
+    anno_resolver: Optional[ResolverRef] = None
+    will_skip: bool = False
+    patharg: Optional[Tuple[Any, Any]] = None
+
+# 每个方法的形参解析计划, 首次调用时生成并缓存在插件上, 之后每次调用只需按计划执行
+@dataclass
+class ArgPlan():
+    params: List[ParamPlan]
+    allowed_events: Optional[Tuple]
+
 
 class OutOfContext(Context):
     event: PlaceholderEvent
@@ -912,19 +1598,21 @@ class JoinReqContext(Context):
                     fin_res = res
                     return
 
-            for plugin in self.engine.plugins.values():
+            entries = self.engine.instr_index.of('_join_req_instr_')
+            for plugin in dict.fromkeys(e.plugin for e in entries):
                 if plugin.disabled: continue
                 async with plugin.override():
-                    for _, method in inspect.getmembers(plugin, predicate=inspect.ismethod):
-                        if hasattr(method, '_join_req_instr_'):
-                            logger.debug(f'found {method=}')
-                            try:
-                                if InstrAttr.FORCE_BACKUP in method._instr_attrs_:
-                                    plugin.backup_man.set_dirty()
-                                res = await method(*(await self.resolve_args(method, [])))
-                                update_res(res)
-                            except:
-                                traceback.print_exc()
+                    for entry in entries:
+                        if entry.plugin is not plugin: continue
+                        method = entry.method
+                        logger.debug(f'found {method=}')
+                        try:
+                            if InstrAttr.FORCE_BACKUP in entry.attrs:
+                                plugin.backup_man.set_dirty()
+                            res = await method(*(await self.resolve_args(method, [])))
+                            update_res(res)
+                        except:
+                            traceback.print_exc()
             if fin_res is not None:
                 if not isinstance(fin_res, tuple):
                     fin_res = (fin_res,)
@@ -950,27 +1638,52 @@ class UnmuteContext(Context):
     def get_instr_attr_name(self):
         return '_unmute_instr_'
 
+def split_text(text: str) -> List[str]:
+    return [x for x in text.split(' ') if x != '']
+
+@dataclass
+class PreparedMessage():
+    '''分好词的消息, exec_any、exec_fall和exec_cmd共用同一份分词结果'''
+    chain: List[Any]
+    tokens: List[Any]
+    # chain[i]的分词结果从tokens[starts[i]]开始
+    starts: List[int] = field(default_factory=list)
+
+    @classmethod
+    def of(cls, chain: List[Any]):
+        tokens: List[Any] = []
+        starts: List[int] = []
+        for msg in chain:
+            starts.append(len(tokens))
+            if isinstance(msg, Plain):
+                tokens.extend(split_text(msg.text))
+            else:
+                tokens.append(msg)
+        return cls(chain=chain, tokens=tokens, starts=starts)
+
+    def tokens_from(self, idx: int) -> List[Any]:
+        '''chain[idx:]的分词结果'''
+        if idx >= len(self.starts):
+            return []
+        return self.tokens[self.starts[idx]:]
+
 class MessageContext(Context):
     event: MessageEvent
             
     @staticmethod
-    def preprocess(chain: MessageChain):
-        res: List[MessageComponent] = []
-        for msg in chain:
-            if isinstance(msg, Plain):
-                res.extend(list(filter(lambda x: x != '', msg.text.split(' '))))
-            else:
-                res.append(msg)
-        return res
+    def preprocess(chain: Union[MessageChain, List[Any], PreparedMessage]) -> List[MessageComponent]:
+        if isinstance(chain, PreparedMessage):
+            return chain.tokens
+        return PreparedMessage.of(chain).tokens
             
-    async def exec_any(self, chain: MessageChain):
+    async def exec_any(self, chain: Union[MessageChain, PreparedMessage]):
         processed_chain = self.preprocess(chain)
         async def cb(method: MethodType):
             return await method(*(await self.resolve_args(method, processed_chain[1:])))
         
         await self.instrs('_any_instr_', cb)
 
-    async def exec_fall(self, chain: MessageChain):
+    async def exec_fall(self, chain: Union[MessageChain, PreparedMessage]):
         processed_chain = self.preprocess(chain)
         async def cb(method: MethodType):
             return await method(*(await self.resolve_args(method, processed_chain[2:])))
@@ -978,7 +1691,7 @@ class MessageContext(Context):
         await self.instrs('_fall_instr_', cb)
 
 
-    async def exec_cmd(self, chain: MessageChain):
+    async def exec_cmd(self, chain: Union[MessageChain, PreparedMessage]):
         
         top_instr_mod = False
         processed_chain = self.preprocess(chain)
@@ -989,7 +1702,7 @@ class MessageContext(Context):
         try:
             plugins = [self.engine.plugins[plugin_name]]
         except:
-            plugins = self.engine.plugins.values()
+            plugins = None
             top_instr_mod = True
 
         self.stack.append(plugin_name)
@@ -1006,9 +1719,12 @@ class MessageContext(Context):
         instr_attr_name = '_top_instr_name_' if top_instr_mod else '_instr_name_'
         found = False
 
+        matched = self.engine.instr_index.match(instr_attr_name, instr_name, plugins)
+        match_results = {entry.method: match_result for entry, match_result in matched}
+
         async def cb(method: MethodType):
             nonlocal found
-            match_result = re.fullmatch(getattr(method, instr_attr_name), instr_name, flags=re.IGNORECASE)
+            match_result = match_results.get(method)
             if match_result:
                 logger.debug(f'{instr_name=}, {match_result=}')
                 found = True
@@ -1022,7 +1738,7 @@ class MessageContext(Context):
                         traceback.print_exc()
                     raise
 
-        await self.instrs(instr_attr_name, cb, plugins=plugins)
+        await self.instrs(instr_attr_name, cb, entries=[entry for entry, _ in matched])
 
         if not found:
             raise CommandNotFoundError(f'指令{instr_name}不存在')
@@ -1286,6 +2002,7 @@ def try_get_patharg_params(anno, _def_pos: str):
 class PluginConfig():
     name: str = field(init=False)
     backup_enabled = False
+    defer_load = False
     ...
 
 def route(name):
@@ -1305,6 +2022,12 @@ def enable_backup(cls):
     return cls
     ...
 
+# 不影响核心功能的插件可以在bot开始接收事件之后再加载
+def defer_load(cls):
+    config = ensure_attr(cls, PluginConfig)
+    config.defer_load = True
+    return cls
+
 @dataclass
 class State(Generic[T]):
     default: T = None
@@ -1,3 +1,4 @@
+import asyncio
 from collections.abc import Iterable
 from dataclasses import dataclass, field
 from datetime import datetime
@@ -6,7 +7,7 @@ import inspect
 from itertools import groupby
 import sys
 import time
-from typing import Awaitable, Callable, Dict, Optional, Union
+from typing import Awaitable, Callable, Dict, Final, Optional, Union
 from event_types import AchvObtainedEvent, AchvRemovedEvent
 from mirai import At, Image
 from plugin import AchvCustomizer, Inject, InjectNotifier, InstrAttr, Plugin, any_instr, autorun, card_changed_instr, delegate, top_instr, route, enable_backup
@@ -54,6 +55,46 @@ class CollectedAchvMan():
         if not self.has_static(e): return None
         return self.achvs[e]
 
+class AchvIndex():
+    '''成就的内存索引, 注册时和第一次查询时从registed_achv与gls推导, 不单独持久化
+
+    holders记录man.achvs中存在的成就, 即有进度的成员, 由submit/remove维护;
+    是否已获得仍由has_static判断, 其他插件直接修改obtained_cnt不会使索引失效.
+    '''
+
+    def __init__(self):
+        self.by_aka: dict[str, AchvEnum] = {}
+        self.customizers: dict[EnumMeta, Plugin] = {}
+        # 成就 -> 群号 -> 成员
+        self.holders: dict[AchvEnum, dict[int, set[int]]] = {}
+        self.built = False
+
+    def register(self, plugin: Plugin, em: EnumMeta):
+        # 与原先按注册顺序线性查找的结果一致, 重名时以先注册的为准
+        self.customizers.setdefault(em, plugin)
+        for e in em:
+            self.by_aka.setdefault(typing.cast(AchvInfo, e.value).aka, e)
+
+    def build(self, gls: GroupLocalStorage[CollectedAchvMan]):
+        self.holders.clear()
+        for group_id, group in gls.groups.items():
+            for member_id, man in group.items():
+                for e in man.achvs:
+                    self.holders.setdefault(e, {}).setdefault(group_id, set()).add(member_id)
+        self.built = True
+
+    def add(self, e: AchvEnum, group_id: int, member_id: int):
+        # 尚未建立时不必维护, 建立时会读到最新的数据
+        if self.built:
+            self.holders.setdefault(e, {}).setdefault(group_id, set()).add(member_id)
+
+    def discard(self, e: AchvEnum, group_id: int, member_id: int):
+        if self.built:
+            self.holders.get(e, {}).get(group_id, set()).discard(member_id)
+
+    def holders_of(self, e: AchvEnum, group_id: int) -> set[int]:
+        return self.holders.get(e, {}).get(group_id, set())
+
 #使用方式：插件注入Achv、并且插件同文件下存在从AchvEnum继承的枚举
 
 @route('成就系统')
@@ -69,8 +110,12 @@ class Achv(Plugin, InjectNotifier):
     nap_cat: Inject['NapCat']
     voucher: Inject['Voucher']
 
+    # batch_submit同时获取的成员数
+    BATCH_FETCH_CONCURRENCY: Final = 8
+
     def __init__(self):
         self.registed_achv: Dict[Plugin, EnumMeta] = {}
+        self.achv_index = AchvIndex()
 
     def _share_token(self, group_id: int, member_id: int):
         raw = f'{group_id}:{member_id}'.encode('utf-8')
@@ -116,6 +161,7 @@ class Achv(Plugin, InjectNotifier):
         if plugin in self.registed_achv: return
         logger.debug(f'add {em.__name__} from {plugin.__class__.__name__}')
         self.registed_achv[plugin] = em
+        self.achv_index.register(plugin, em)
 
     def injected(self, target: Plugin):
         if target in self.registed_achv: return
@@ -128,6 +174,17 @@ class Achv(Plugin, InjectNotifier):
     def get_registed_achvs(self):
         return list(self.registed_achv.values())
 
+    def customizer_of(self, e: AchvEnum) -> AchvCustomizer:
+        return self.achv_index.customizers[e.__class__]
+
+    def find_achv(self, aka: str) -> Optional[AchvEnum]:
+        return self.achv_index.by_aka.get(aka)
+
+    def _holder_index(self):
+        if not self.achv_index.built:
+            self.achv_index.build(self.gls)
+        return self.achv_index
+
     @delegate()
     async def is_deletable(self, e: AchvEnum, man: Optional[CollectedAchvMan]):
         info = typing.cast(AchvInfo, e.value)
@@ -141,7 +198,7 @@ class Achv(Plugin, InjectNotifier):
             return False
 
         if info.opts.dynamic_deletable:
-            p: AchvCustomizer = next((k for k, v in self.registed_achv.items() if v is e.__class__))
+            p: AchvCustomizer = self.customizer_of(e)
             res = await p.is_achv_deletable(e)
             if res is None:
                 res = False
@@ -169,11 +226,12 @@ class Achv(Plugin, InjectNotifier):
                 raise RuntimeError(f'目前还不能撤销{info.aka}')
 
             if info.opts.custom_remove:
-                p: AchvCustomizer = next((k for k, v in self.registed_achv.items() if v is e.__class__))
+                p: AchvCustomizer = self.customizer_of(e)
                 await p.remove_achv(e, man.achvs[e])
                 # logger.info(f'{man.achvs[e].obtained_cnt=}')
             else:
                 man.achvs.pop(e)
+                await self.discard_holder(e)
 
             if notify:
                 await self.events.emit(AchvRemovedEvent(e))
@@ -183,21 +241,49 @@ class Achv(Plugin, InjectNotifier):
             await self.update_member_name()
         return has_achv
     
+    @delegate()
+    async def discard_holder(self, e: AchvEnum, member: GroupMember):
+        self.achv_index.discard(e, member.group.id, member.id)
+
     @delegate(InstrAttr.FORCE_BACKUP)
     async def batch_submit(self, e: AchvEnum, op: GroupOp, *, member_ids: Iterable[int], override_obtain_cnt: int = None, silent: bool = False):
-        
-        async def ctx_submit(member_id: int):
-            member = await op.get_member(member_id)
-            async with self.override(member):
-                return await self.submit(e, override_obtain_cnt=override_obtain_cnt, silent=True)
+        '''为群内多个成员提交同一个成就, 返回值与去重后的member_ids一一对应
 
-        res = [(await ctx_submit(member_id), member_id) for member_id in member_ids]
+        成员信息并发获取, 状态一次性修改完再依次发出事件; 只为名片可能变化的成员
+        更新名片, 整个群只发一条通知, 备份也只标记一次.
+        '''
+        member_ids = list(dict.fromkeys(member_ids))
+        info = typing.cast(AchvInfo, e.value)
+        sem = asyncio.Semaphore(self.BATCH_FETCH_CONCURRENCY)
+
+        async def fetch_member(member_id: int):
+            async with sem:
+                return await op.get_member(member_id)
+
+        members: list[Optional[GroupMember]] = await asyncio.gather(*(fetch_member(member_id) for member_id in member_ids))
+
+        res = []
+        obtained: list[tuple[GroupMember, CollectedAchvMan]] = []
+        for member_id, member in zip(member_ids, members):
+            if member is None:
+                res.append(False)
+                continue
+            man = self.gls.get_or_create_data(op.group.id, member_id)
+            b = await self._apply_submit(e, man, op.group.id, member_id, override_obtain_cnt=override_obtain_cnt)
+            res.append(b)
+            if b:
+                obtained.append((member, man))
+
+        for member, man in obtained:
+            async with self.override(member):
+                await self.events.emit(AchvObtainedEvent(e))
+                # 只有置顶显示或正在佩戴的成就会出现在名片中
+                if info.opts.display_pinned or man._using is e:
+                    await self.update_member_name()
 
-        filtered_res_ids = [id for b, id in res if b]
+        filtered_res_ids = [member.id for member, _ in obtained]
 
         if not silent and len(filtered_res_ids) > 0:
-            info = typing.cast(AchvInfo, e.value)
-
             if info.opts.custom_obtain_msg is not None:
                 msg = ['[新成就] ', *[At(target=member_id) for member_id in filtered_res_ids], f' {info.opts.custom_obtain_msg}']
             else:
@@ -206,13 +292,13 @@ class Achv(Plugin, InjectNotifier):
                 await op.send(msg)
             except: ...
 
-        return [b for b, _ in res]
+        return res
 
-    @delegate(InstrAttr.FORCE_BACKUP)
-    async def submit(
-        self, e: AchvEnum, member: GroupMember, op: GroupOp, man: CollectedAchvMan, 
-        *, override_obtain_cnt: int = None, silent: bool = False, by: Callable[['AchvExtra'], Awaitable[None]] = None
-    ):
+    async def _apply_submit(
+        self, e: AchvEnum, man: CollectedAchvMan, group_id: int, member_id: int,
+        *, override_obtain_cnt: int = None, by: Callable[['AchvExtra'], Awaitable[None]] = None
+    ) -> bool:
+        '''只修改进度, 返回是否因此新获得了成就'''
         info = typing.cast(AchvInfo, e.value)
         prev_obtained_cnt = 0
 
@@ -220,6 +306,7 @@ class Achv(Plugin, InjectNotifier):
             prev_obtained_cnt = man.achvs[e].obtained_cnt
         else:
             man.achvs[e] = AchvExtra()
+            self.achv_index.add(e, group_id, member_id)
 
         if override_obtain_cnt is not None:
             man.achvs[e].obtained_cnt = override_obtain_cnt
@@ -230,8 +317,19 @@ class Achv(Plugin, InjectNotifier):
 
         if not (prev_obtained_cnt < info.opts.target_obtained_cnt and man.achvs[e].obtained_cnt >= info.opts.target_obtained_cnt):
             return False
-        
+
         man.achvs[e].obtained_ts = time.time()
+        return True
+
+    @delegate(InstrAttr.FORCE_BACKUP)
+    async def submit(
+        self, e: AchvEnum, member: GroupMember, op: GroupOp, man: CollectedAchvMan, 
+        *, override_obtain_cnt: int = None, silent: bool = False, by: Callable[['AchvExtra'], Awaitable[None]] = None
+    ):
+        info = typing.cast(AchvInfo, e.value)
+
+        if not await self._apply_submit(e, man, member.group.id, member.id, override_obtain_cnt=override_obtain_cnt, by=by):
+            return False
         
         await self.events.emit(AchvObtainedEvent(e))
 
@@ -305,7 +403,7 @@ class Achv(Plugin, InjectNotifier):
         
         info: AchvInfo = e.value
         if info.opts.dynamic_obtained:
-            p: AchvCustomizer = next((k for k, v in self.registed_achv.items() if v is e.__class__))
+            p: AchvCustomizer = self.customizer_of(e)
             return await p.is_achv_obtained(e)
         else:
             return man.has_static(e)
@@ -313,9 +411,21 @@ class Achv(Plugin, InjectNotifier):
     @delegate()
     async def get_obtained_member_ids(self, e: AchvEnum, group: Group):
         result = set()
-        for member_id, _ in self.gls.get_data_of_group(group.id).items():
+        info: AchvInfo = e.value
+        if info.opts.dynamic_obtained:
+            # 动态成就只能逐个询问所属插件
+            candidate_ids = list(self.gls.get_data_of_group(group.id).keys())
+        else:
+            candidate_ids = [
+                member_id for member_id in self._holder_index().holders_of(e, group.id)
+                if (man := self.gls.get_data(group.id, member_id)) is not None and man.has_static(e)
+            ]
+        for member_id in candidate_ids:
             member = await self.bot.get_group_member(group.id, member_id)
             if member is None: continue
+            if not info.opts.dynamic_obtained:
+                result.add(member_id)
+                continue
             async with self.override(member):
                 if await self.has(e):
                     result.add(member_id)
@@ -352,12 +462,10 @@ class Achv(Plugin, InjectNotifier):
     
     @delegate()
     async def aka_to_achv(self, aka: str):
-        for meta in self.registed_achv.values():
-            e = next((e for e in meta if typing.cast(AchvInfo, e.value).aka == aka), None)
-            if e is not None:
-                return e
-        else:
+        e = self.find_achv(aka)
+        if e is None:
             raise RuntimeError(f'不存在名叫"{aka}"的成就')
+        return e
     
     @delegate()
     async def get_used(self, man: Optional[CollectedAchvMan]):
@@ -423,11 +531,8 @@ class Achv(Plugin, InjectNotifier):
     @top_instr('赋予')
     async def award(self, at: At, aka: str):
         async with self.admin.privilege(type=AdminType.SUPER):
-            for meta in self.registed_achv.values():
-                e = next((e for e in meta if typing.cast(AchvInfo, e.value).aka == aka), None)
-                if e is not None:
-                    break
-            else:
+            e = self.find_achv(aka)
+            if e is None:
                 return f'不存在名叫"{aka}"的成就'
             
             member = await self.member_from(at=at)
@@ -438,11 +543,8 @@ class Achv(Plugin, InjectNotifier):
     @top_instr('撤销')
     async def remove_cmd(self, at: At, aka: str, force_arg: Optional[str]):
         async with self.admin.privilege(type=AdminType.SUPER):
-            for meta in self.registed_achv.values():
-                e = next((e for e in meta if typing.cast(AchvInfo, e.value).aka == aka), None)
-                if e is not None:
-                    break
-            else:
+            e = self.find_achv(aka)
+            if e is None:
                 return f'不存在名叫"{aka}"的成就'
             
             force = force_arg == '强制'
@@ -469,7 +571,7 @@ class Achv(Plugin, InjectNotifier):
         if man is not None and e in man.achvs:
             extra = man.achvs[e]
 
-        p: AchvCustomizer = next((k for k, v in self.registed_achv.items() if v is e.__class__))
+        p: AchvCustomizer = self.customizer_of(e)
         return await p.get_achv_name(e, extra)
     
     @delegate()
@@ -479,10 +581,9 @@ class Achv(Plugin, InjectNotifier):
         
     @delegate()
     async def dynamic_aka_to_achv(self, aka: str):
-        for meta in self.registed_achv.values():
-            e = next((e for e in meta if typing.cast(AchvInfo, e.value).aka == aka), None)
-            if e is not None:
-                return e
+        e = self.find_achv(aka)
+        if e is not None:
+            return e
 
             
         # for achv_enum, extra in man.achvs.items():
@@ -592,7 +693,7 @@ class Achv(Plugin, InjectNotifier):
             ext_str = f'，使用指令【#抽奖 {real_aka}】可用本成就抽取猫条(概率{prob * 100:.1f}%)' if await Achv.is_deletable.__wrapped__(self, achv, man) and info.opts.rarity.value.level >= AchvRarity.UNCOMMON.value.level else ''
             return f'已获得成就"{real_aka}"{ext_str}'
 
-        p = next((k for k, v in self.registed_achv.items() if v is e.__class__))
+        p = self.customizer_of(e)
         if isinstance(p, AchvCustomizer):
             if info.opts.custom_progress_str:
                 return f'{info}({info.condition}): {await p.get_progress_str(e, man.achvs[e])}'
@@ -688,7 +789,7 @@ class Achv(Plugin, InjectNotifier):
                 ext_str = f'，使用指令【#抽奖 {real_aka}】可用本成就抽取猫条(概率{prob * 100:.1f}%)' if await self.is_deletable(achv) and info.opts.rarity.value.level >= AchvRarity.UNCOMMON.value.level else ''
                 return f'已获得成就"{real_aka}"{ext_str}'
 
-            p = next((k for k, v in self.registed_achv.items() if v is e.__class__))
+            p = self.customizer_of(e)
             if isinstance(p, AchvCustomizer):
                 # info: AchvInfo = e.value
                 if info.opts.custom_progress_str:
@@ -704,11 +805,8 @@ class Achv(Plugin, InjectNotifier):
     @top_instr('佩戴')
     async def use_achv(self, aka: str, man: Optional[CollectedAchvMan]):
         await self.admin.check_proxy(disable_required=True)
-        for meta in self.registed_achv.values():
-            e: AchvEnum = next((e for e in meta if (val := typing.cast(AchvInfo, e.value)).aka == aka), None)
-            if e is not None:
-                break
-        else:
+        e = self.find_achv(aka)
+        if e is None:
             return f'不存在名叫"{aka}"的成就'
         
         if not await self.has(e):
@@ -836,6 +934,7 @@ class Achv(Plugin, InjectNotifier):
             await self.bot.member_info().set(member.group.id, member.id, {
                 "member_name": new_name
             })
+            self.nap_cat.invalidate_member_info(member.group.id, member.id)
 
     @delegate()
     async def get_raw_member_name(self, member: GroupMember):
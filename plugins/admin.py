@@ -1,20 +1,16 @@
 import asyncio
 from dataclasses import dataclass, field
 from datetime import datetime
-from enum import Enum, auto
 from io import BytesIO
-import json
 import random
 import re
 import time
-from typing import Dict, Final, Optional, Union
+from typing import Final, Optional, Union
 from collections import Iterable
-from itertools import groupby
 
 from activator import SharpActivator
 import configs.config as config
 from event_types import EffectiveSpeechEvent, ViolationEvent
-import aiohttp
 from mirai import At, AtAll, Event, Face, GroupMessage, Image, MessageChain, MessageEvent, Plain, TempMessage
 from mirai.models.entities import GroupMember, Group
 from plugin import AchvCustomizer, Context, Inject, InstrAttr, MessageContext, PathArg, Plugin, any_instr, autorun, delegate, enable_backup, join_req_instr, joined_instr, recall_instr, route, top_instr
@@ -24,15 +20,14 @@ import traceback
 from mirai.models.api import RespOperate
 from mirai.models.message import App, MusicShare, Quote, MarketFace, Source, Forward, ForwardMessageNode, ShortVideo, File
 import cn2an
-import os
-import imagehash
 
-import pyzbar.pyzbar
-from pyzbar.pyzbar import ZBarSymbol
 from PIL import Image as PImage
 
 from pypinyin import lazy_pinyin
 
+from image_analysis import ImageAnalysis
+from censor_engine import URL_PATTERN, CensorEngine, ReslovedCensorSpeechQual, find_repeated_char
+
 from nap_cat_types import GetGroupMemberInfoResp, GetStrangerInfoResp
 
 from typing import TYPE_CHECKING
@@ -45,6 +40,7 @@ if TYPE_CHECKING:
     from plugins.throttle import Throttle
     from plugins.nap_cat import NapCat
     from plugins.check_in import CheckIn
+    from plugins.image_analyzer import ImageAnalyzer
 
 logger = get_logger()
 
@@ -207,27 +203,6 @@ class MessageHistoryMan():
         if len(self.history) >= self.MAX_HISTORY_LEN:
             self.history.pop(0)
     
-class ReslovedCensorSpeechQual(Enum):
-    BASE = auto()
-    ALL = auto()
-    AT = auto()
-    CURIOUS = auto()
-    PINYIN = auto()
-
-@dataclass
-class ReslovedCensorSpeechKey():
-    quals: Dict[ReslovedCensorSpeechQual, list[str]]
-    reason: str
-    
-    @classmethod
-    def from_expr(cls, expr: str):
-        reason, *remains = expr.split(':')
-
-        return cls(
-            reason=reason,
-            quals={ReslovedCensorSpeechQual[(its := r.split('.'))[0].upper()]: its[1:] for r in remains},
-        )
-
 @route('管理')
 @enable_backup
 class Admin(Plugin, AchvCustomizer):
@@ -246,6 +221,7 @@ class Admin(Plugin, AchvCustomizer):
     throttle: Inject['Throttle']
     nap_cat: Inject['NapCat']
     check_in: Inject['CheckIn']
+    image_analyzer: Inject['ImageAnalyzer']
 
     VIOLATION_ORIGINAL_SIN_THRESHOLD: Final = 3
     VIOLATION_READY_FOR_PURGE_THRESHOLD: Final = 9
@@ -254,6 +230,12 @@ class Admin(Plugin, AchvCustomizer):
         self.gspec = GroupSpec[BrushHistory]()
         self.recall_by_bot_msgs = set()
         self.custom_recall_resons: dict[int, str] = {}
+        self.censor_engine = CensorEngine(
+            self.path.data.of_file('censor_speech.json'),
+            self.path.data.of_file('forbidden_market_face.json'),
+            self.path.data.of_file('image_hashes.txt'),
+            self.path.data['hashes'],
+        )
 
     async def get_achv_name(self, e: 'AchvEnum', extra: Optional['AchvExtra']) -> str:
         if e is AdminAchv.ENDLESS_REINCARNATION:
@@ -591,6 +573,7 @@ class Admin(Plugin, AchvCustomizer):
             await self.bot.member_info().set(group.id, at.target, {
                 "special_title": title
             })
+            self.nap_cat.invalidate_member_info(group.id, at.target)
 
     @top_instr('设置空头衔')
     async def admin_set_empty_special_title(self, at: At, title :str, group: Group):
@@ -599,6 +582,7 @@ class Admin(Plugin, AchvCustomizer):
             await self.bot.member_info().set(group.id, at.target, {
                 "special_title": title
             })
+            self.nap_cat.invalidate_member_info(group.id, at.target)
 
     # @any_instr()
     # async def keep_long_title(self, member: GroupMember):
@@ -625,6 +609,7 @@ class Admin(Plugin, AchvCustomizer):
         await self.bot.member_info().set(member.group.id, member.id, {
             "special_title": title
         })
+        self.nap_cat.invalidate_member_info(member.group.id, member.id)
 
     @top_instr('关联', InstrAttr.FORCE_BACKUP, InstrAttr.NO_ALERT_CALLER)
     async def associate_cmd(self, man: MemberAssociateMan, *ats: At):
@@ -673,9 +658,9 @@ class Admin(Plugin, AchvCustomizer):
             if mc is not None:
                 for comp in mc:
                     if isinstance(comp, Image):
-                        img = await self.load_image(comp)
-                        img_hash = imagehash.crop_resistant_hash(img)
-                        img.convert('RGB').save(self.path.data['hashes'].of_file(f'{img_hash}.jpg'))
+                        analysis = await self.analyze_image(comp)
+                        self.censor_engine.refresh(force=True)
+                        self.censor_engine.image_hashes.add(analysis.crop_hash)
             
             if only:
                 self.recall_by_bot_msgs.add(m_id)
@@ -925,10 +910,9 @@ class Admin(Plugin, AchvCustomizer):
         ...
 
     async def load_image(self, img: Image):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(img.url) as resp:
-                content_type = resp.headers.get('Content-Type')
-                pimg: PImage.Image = PImage.open(BytesIO(await resp.read()))
+        media = await self.http.fetch_media(img.url, key=img.image_id)
+        content_type = media.content_type
+        pimg: PImage.Image = PImage.open(BytesIO(media.data))
         if content_type != 'image/gif':
             return pimg
         logger.debug('found gif')
@@ -936,6 +920,13 @@ class Admin(Plugin, AchvCustomizer):
         pimg.convert('RGB').save(buffered, format="JPEG")
         return PImage.open(buffered)
 
+    async def load_image_bytes(self, img: Image) -> bytes:
+        return (await self.http.fetch_media(img.url, key=img.image_id)).data
+
+    async def analyze_image(self, img: Image) -> ImageAnalysis:
+        '''下载图片并在子进程中分析(尺寸、hash、二维码), 同一张图片只分析一次'''
+        return await self.image_analyzer.analyze(await self.load_image_bytes(img))
+
     async def breakdown_chain(self, chain, regex, cb, ctx=None):
         if ctx is None:
             ctx = {}
@@ -965,7 +956,7 @@ class Admin(Plugin, AchvCustomizer):
     def mark_recall_protected(self, msg_id: int):
         self.recall_by_bot_msgs.add(msg_id)
 
-    @any_instr()
+    @any_instr(InstrAttr.CONCURRENT)
     async def censor_speech(self, event: GroupMessage, member: GroupMember):
         # print(f'{event.message_chain=}')
 
@@ -990,16 +981,11 @@ class Admin(Plugin, AchvCustomizer):
 
         doge_protected = doge_cnt > 0 and doge_cnt < MAX_DOGE_CNT and random.random() > prob
 
-        with open(self.path.data.of_file('censor_speech.json'), encoding='utf-8') as f:
-            censor_speech_o: dict = json.load(f)
-
-        with open(self.path.data.of_file('forbidden_market_face.json'), encoding='utf-8') as f:
-            forbidden_market_face_o: dict[str, dict[str, int]] = json.load(f)
-
-        image_hashes = [imagehash.hex_to_multihash(file_name.split('.')[0]) for file_name in os.listdir(self.path.data['hashes']) if not file_name.startswith('.')]
-
-        url_regex = r'(https?:\/\/)((([0-9a-z]+\.)+[a-z]+)|(([0-9]{1,3}\.){3}[0-9]{1,3}))(:[0-9]+)?(\/[0-9a-z%/.\-_]*)?(\?[0-9a-z=&%_\-]*)?(\#[0-9a-z=&%_\-]*)?'
-        url_pattern  = re.compile(url_regex)
+        # 规则文件只在变动后才会重新加载
+        self.censor_engine.refresh()
+        censor_rules = self.censor_engine.rules
+        forbidden_market_face_o = self.censor_engine.forbidden_market_faces
+        image_hashes = self.censor_engine.image_hashes
 
         async def try_recall(reason: Union[str, list], hint: Optional[str] = None, *, only: bool=False):
             if hint is None:
@@ -1064,60 +1050,39 @@ class Admin(Plugin, AchvCustomizer):
 
         # True -> 干掉了
         async def check_text(txt: str):
-            sorted_sorted = sorted(txt)
-            txt_groups = groupby(sorted_sorted)
-
             if not is_in_white_list:
-                for k, v in txt_groups:
-                    if len(list(v)) >= 70 and k not in (' ', '\n'):
-                        await try_recall(f'消息中包含太多的"{k}"')
-                        return True
-
-            for expr, words in censor_speech_o.items():
-                key = ReslovedCensorSpeechKey.from_expr(expr)
-                if ReslovedCensorSpeechQual.ALL not in key.quals and is_in_white_list:
-                    continue
+                k = find_repeated_char(txt)
+                if k is not None:
+                    await try_recall(f'消息中包含太多的"{k}"')
+                    return True
 
-                if ReslovedCensorSpeechQual.AT in key.quals and member.id not in (int(a) for a in key.quals[ReslovedCensorSpeechQual.AT] if a.isdecimal()):
+            # 命中结果已按规则在文件中的顺序排好, 取第一个对当前成员生效的
+            skipped_rules = set[int]()
+            for hit in censor_rules.scan(txt, with_pinyin=lambda: lazy_pinyin(txt)):
+                key = hit.rule.key
+                if hit.rule.order in skipped_rules:
                     continue
-
-                if ReslovedCensorSpeechQual.CURIOUS in key.quals and not await self.achv.has(AdminAchv.CURIOUS):
+                if (
+                    (ReslovedCensorSpeechQual.ALL not in key.quals and is_in_white_list)
+                    or (ReslovedCensorSpeechQual.AT in key.quals and member.id not in (int(a) for a in key.quals[ReslovedCensorSpeechQual.AT] if a.isdecimal()))
+                    or (ReslovedCensorSpeechQual.CURIOUS in key.quals and not await self.achv.has(AdminAchv.CURIOUS))
+                ):
+                    skipped_rules.add(hit.rule.order)
                     continue
 
-                if ReslovedCensorSpeechQual.PINYIN in key.quals:
-                    txt_pinyin = lazy_pinyin(txt)
-
-                for w_item in words:
-                    replacer = None
-                    if isinstance(w_item, str):
-                        kw = w_item
-                    elif isinstance(w_item, dict):
-                        kw, replacer = next(iter(w_item.items()))
-
-                    forb_word = None
-
-                    if ReslovedCensorSpeechQual.PINYIN in key.quals:
-                        kw_pinyin = lazy_pinyin(kw)
-                        found_idx = find_subsequence_start(kw_pinyin, txt_pinyin)
-                        if found_idx != -1:
-                            forb_word = txt[found_idx:found_idx+len(kw_pinyin)]
-                    else:
-                        m = re.search(kw, txt)
-                        if m is not None:
-                            forb_word = m.group(0)
-
-                    if forb_word is not None:
-                        try:
-                            async def img_op(s, ctx):
-                                img_path = self.path.data.of_file(s)
-                                return Image(path=img_path)
-                            suffix = f'(推荐使用"{replacer}")' if replacer is not None else ''
-                            chain = await self.breakdown_chain(suffix, r'\[img:(.*?)\]', img_op)
-                            await try_recall([key.reason, *chain], f'消息中包含违禁词"{forb_word}", 补充理由: {key.reason}')
-                        except:
-                            traceback.print_exc()
-                        return True
-            if url_pattern.search(txt) is not None and not is_in_white_list:
+                forb_word = hit.matched
+                replacer = hit.replacer
+                try:
+                    async def img_op(s, ctx):
+                        img_path = self.path.data.of_file(s)
+                        return Image(path=img_path)
+                    suffix = f'(推荐使用"{replacer}")' if replacer is not None else ''
+                    chain = await self.breakdown_chain(suffix, r'\[img:(.*?)\]', img_op)
+                    await try_recall([key.reason, *chain], f'消息中包含违禁词"{forb_word}", 补充理由: {key.reason}')
+                except:
+                    traceback.print_exc()
+                return True
+            if URL_PATTERN.search(txt) is not None and not is_in_white_list:
                 await try_recall('消息中包含不明链接')
                 return True
             return False
@@ -1145,24 +1110,22 @@ class Admin(Plugin, AchvCustomizer):
                             await try_recall(reason, reason, only=only)
                             return
                 if isinstance(c, Image):
-                    img = await self.load_image(c)
+                    analysis = await self.analyze_image(c)
                     print(f'Image {c=}')
                     if await self.achv.has(AdminAchv.UNSEEABLE):
-                        if img.width >= 500 or img.height >= 500 or 'gxh.vip.qq.com' in c.image_id:
+                        if analysis.width >= 500 or analysis.height >= 500 or 'gxh.vip.qq.com' in c.image_id:
                             await try_recall('不可直视', only=True)
                             return
-                    qrcodes = pyzbar.pyzbar.decode(img)
+                    qrcodes = analysis.qrcodes
                     logger.debug(f'{qrcodes=}')
                     if len(qrcodes) > 0 and not is_in_white_list:
                         await try_recall('消息中包含不明二维码')
                         return
-                    target_hash = imagehash.crop_resistant_hash(img)
-                    for full_hash in image_hashes:
-                        seg, dist = full_hash.hash_diff(target_hash)
-                        print(f'{seg=}, {dist=}, {str(full_hash)}')
-                        if seg > 0 and dist < 4 * seg:
-                            await try_recall('不适宜的图片')
-                            return
+                    matched = image_hashes.match_multihash(analysis.crop_hash)
+                    if matched is not None:
+                        logger.debug(f'不适宜的图片 {matched=}')
+                        await try_recall('不适宜的图片')
+                        return
                     if not live_img_sent:
                         await self.live.try_show_image(img=c)
                         live_img_sent = True
@@ -1210,33 +1173,3 @@ class Admin(Plugin, AchvCustomizer):
             if not passed: return
 
         return '作业写完了没'
-
-def find_subsequence_start(sub, lst):
-    """
-    查找sub是否是lst的连续子序列，如果是则返回起始下标
-    
-    Args:
-        sub: 子序列列表
-        lst: 主列表
-        
-    Returns:
-        int: 如果是连续子序列返回起始下标，否则返回-1
-    """
-    if not sub:  # 空列表是任何列表的子序列，返回第一个位置
-        return 0
-    if len(sub) > len(lst):
-        return -1
-    
-    n, m = len(lst), len(sub)
-    
-    # 遍历主列表
-    for i in range(n - m + 1):
-        found = True
-        # 检查连续m个元素是否匹配
-        for j in range(m):
-            if lst[i + j] != sub[j]:
-                found = False
-                break
-        if found:
-            return i
-    return -1
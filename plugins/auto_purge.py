@@ -64,13 +64,13 @@ class AutoPurge(Plugin):
                 for group_id in self.known_groups:
                     resp = await self.bot.member_list(group_id)
                     group = await self.bot.get_group(group_id)
+                    infos = await self.nap_cat.fetch_group_member_infos(group_id, [member.id for member in resp.data])
 
                     for i, member in enumerate(resp.data):
                         async with self.override(member):
                             try:
-                                try:
-                                    info: GetGroupMemberInfoResp = await self.nap_cat.get_group_member_info()
-                                except:
+                                info = infos.get(member.id)
+                                if info is None:
                                     logger.error(f'无法获得{member.member_name}({member.id})的成员信息')
                                     continue
                                 if info.title != '':
@@ -11,7 +11,6 @@ from pathlib import Path
 from typing import Optional
 from urllib.parse import parse_qsl, urlencode, urlsplit
 
-import aiohttp
 import aiosqlite
 import qrcode
 from mirai import At, GroupMessage, Image, MessageChain
@@ -178,47 +177,44 @@ class Console(Plugin):
 
     async def _exchange_code(self, code: str):
         app_id, app_key, redirect_uri = self._oauth_config()
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                'https://graph.qq.com/oauth2.0/token',
-                params={
-                    'grant_type': 'authorization_code',
-                    'client_id': app_id,
-                    'client_secret': app_key,
-                    'code': code,
-                    'redirect_uri': redirect_uri,
-                },
-            ) as response:
-                token_text = await response.text()
-            token_data = dict(parse_qsl(token_text))
-            access_token = token_data.get('access_token')
-            if not access_token:
-                raise RuntimeError('QQ OAuth token exchange failed')
-
-            async with session.get(
-                'https://graph.qq.com/oauth2.0/me',
-                params={'access_token': access_token},
-            ) as response:
-                me_text = await response.text()
-            me_match = re.search(r'\{.*\}', me_text)
-            if me_match is None:
-                raise RuntimeError('QQ OAuth openid response invalid')
-            me_data = json.loads(me_match.group(0))
-            openid = me_data.get('openid')
-            if not openid:
-                raise RuntimeError('QQ OAuth openid missing')
-
-            async with session.get(
-                'https://graph.qq.com/user/get_user_info',
-                params={
-                    'access_token': access_token,
-                    'oauth_consumer_key': app_id,
-                    'openid': openid,
-                },
-            ) as response:
-                info = await response.json(content_type=None)
-            if int(info.get('ret', 1)) != 0:
-                raise RuntimeError(info.get('msg') or 'QQ user info failed')
+        token_text = await self.http.get_text(
+            'https://graph.qq.com/oauth2.0/token',
+            params={
+                'grant_type': 'authorization_code',
+                'client_id': app_id,
+                'client_secret': app_key,
+                'code': code,
+                'redirect_uri': redirect_uri,
+            },
+        )
+        token_data = dict(parse_qsl(token_text))
+        access_token = token_data.get('access_token')
+        if not access_token:
+            raise RuntimeError('QQ OAuth token exchange failed')
+
+        me_text = await self.http.get_text(
+            'https://graph.qq.com/oauth2.0/me',
+            params={'access_token': access_token},
+        )
+        me_match = re.search(r'\{.*\}', me_text)
+        if me_match is None:
+            raise RuntimeError('QQ OAuth openid response invalid')
+        me_data = json.loads(me_match.group(0))
+        openid = me_data.get('openid')
+        if not openid:
+            raise RuntimeError('QQ OAuth openid missing')
+
+        info = await self.http.get_json(
+            'https://graph.qq.com/user/get_user_info',
+            params={
+                'access_token': access_token,
+                'oauth_consumer_key': app_id,
+                'openid': openid,
+            },
+            content_type=None,
+        )
+        if int(info.get('ret', 1)) != 0:
+            raise RuntimeError(info.get('msg') or 'QQ user info failed')
 
         return {
             'openid': openid,
@@ -13,13 +13,11 @@ from mirai.models.message import Quote
 from event_types import AchvRemovedEvent
 from plugin import Context, Plugin, autorun, delegate, enable_backup, instr, top_instr, any_instr, InstrAttr, PathArg, route, Inject, nudge_instr, unmute_instr
 import random
-from bilibili_api import topic, dynamic
 import os
 import random
-from PIL import Image, ExifTags, TiffImagePlugin
+from PIL import Image
 from utilities import VOUCHER_NAME, VOUCHER_UNIT, AchvEnum, AchvExtra, AchvInfo, AchvOpts, AchvRarity, AchvRarityVal, GroupLocalStorage, GroupLocalStorageAsEvent, GroupMemberOp, GroupSpec, Source, VoucherRecordExtraClearMute, get_delta_time_str, get_logger, handler, throttle_config
 import uuid
-import aiohttp
 import imghdr
 import json
 import itertools
@@ -28,6 +26,8 @@ from enum import Enum, auto
 from mirai.models.entities import Group, GroupMember
 import pathlib
 
+from image_analysis import read_exif, save_limited_jpeg
+
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -38,6 +38,7 @@ if TYPE_CHECKING:
     from plugins.admin import Admin
     from plugins.voucher import Voucher
     from plugins.throttle import Throttle
+    from plugins.image_analyzer import ImageAnalyzer
 
 logger = get_logger()
 
@@ -133,6 +134,7 @@ class Fur(Plugin):
     admin: Inject['Admin']
     voucher: Inject['Voucher']
     throttle: Inject['Throttle']
+    image_analyzer: Inject['ImageAnalyzer']
 
     FETCH_AUTHOR_HISTORY_SIZE: Final = 10
     FETCH_IMG_PATH_HISTORY_SIZE: Final = 50
@@ -147,22 +149,17 @@ class Fur(Plugin):
         random.seed()
         self.last_run_time = time.time()
 
-    def _thumbnail_resample(self):
-        return getattr(
-            getattr(Image, 'Resampling', Image),
-            'LANCZOS',
-            getattr(Image, 'ANTIALIAS', Image.BICUBIC),
-        )
-
-    def _save_limited_jpeg(self, source_path: str, *, max_dimension: int, quality: int=85):
+    async def _save_limited_jpeg(self, source_path: str, *, max_dimension: int, quality: int=85):
         target_image_file_name = f'{uuid.uuid4()}.jpg'
         target_image_file_path = self.path.data.cache.of_file(target_image_file_name)
-        with Image.open(source_path) as img:
-            img.load()
-            if max(img.size) > max_dimension:
-                img.thumbnail((max_dimension, max_dimension), self._thumbnail_resample())
-            img.convert('RGB').save(target_image_file_path, 'JPEG', quality=quality, optimize=True)
-        return target_image_file_path
+        # 缩放和重新编码比较耗时, 放到子进程中进行
+        return await self.image_analyzer.run(
+            save_limited_jpeg,
+            source_path,
+            target_image_file_path,
+            max_dimension=max_dimension,
+            quality=quality,
+        )
 
     def _remove_generated_cache_file(self, file_path: str):
         cache_path = os.path.abspath(self.path.data.cache)
@@ -174,7 +171,7 @@ class Fur(Plugin):
         except OSError:
             ...
 
-    def _prepare_send_image(self, source_path: str):
+    async def _prepare_send_image(self, source_path: str):
         what = imghdr.what(source_path)
         if what == 'gif':
             return source_path
@@ -183,17 +180,17 @@ class Fur(Plugin):
             width, height = img.size
         if max(width, height) <= self.SEND_IMAGE_MAX_DIMENSION and file_size <= self.SEND_IMAGE_MAX_BYTES:
             return source_path
-        return self._save_limited_jpeg(
+        return await self._save_limited_jpeg(
             source_path,
             max_dimension=self.SEND_IMAGE_MAX_DIMENSION,
             quality=85,
         )
 
-    def _prepare_render_image(self, source_path: str):
+    async def _prepare_render_image(self, source_path: str):
         what = imghdr.what(source_path)
         if what == 'gif':
             return source_path
-        return self._save_limited_jpeg(
+        return await self._save_limited_jpeg(
             source_path,
             max_dimension=self.RENDER_IMAGE_MAX_DIMENSION,
             quality=82,
@@ -238,9 +235,7 @@ class Fur(Plugin):
     @top_instr('万物展厅', InstrAttr.NO_ALERT_CALLER)
     async def wwpass_gallery(self):
         api_url = 'https://www.ww-pass.com/api-v2/portal/list_character?limit=100'
-        async with aiohttp.ClientSession(trust_env=True) as session:
-            async with session.get(api_url) as response:
-                j = await response.json()
+        j = await self.http.get_json(api_url, trust_env=True)
 
         # {
         #     "_id": "662f788e053ebbc5759936b1",
@@ -265,9 +260,7 @@ class Fur(Plugin):
     async def wwpass_queue(self):
         api_url = 'https://web.oss.ww-pass.cn/api-status/order-list.json'
 
-        async with aiohttp.ClientSession(trust_env=True) as session:
-            async with session.get(api_url) as response:
-                j = await response.json()
+        j = await self.http.get_json(api_url, trust_env=True)
         ss = []
 
         for months in j['data']['list']:
@@ -290,7 +283,7 @@ class Fur(Plugin):
     @top_instr('来测试', InstrAttr.NO_ALERT_CALLER)
     async def get_test(self):
         path = r'D:\projects\python\p_bot\plugins\fur\纳延\HT-364784069\Cache_1027207359e17904..jpg'
-        render_image_path = self._prepare_render_image(path)
+        render_image_path = await self._prepare_render_image(path)
         img_url = self.renderer.local_file_url(render_image_path)
 
         try:
@@ -307,6 +300,7 @@ class Fur(Plugin):
 
     @top_instr('毛五', InstrAttr.NO_ALERT_CALLER)
     async def ff(self):
+        from bilibili_api import topic, dynamic
         async with self.bili as credential:
             # res = await topic.search_topic('毛毛星期五')
             t = topic.Topic(topic_id=30607, credential=credential)
@@ -797,7 +791,7 @@ class Fur(Plugin):
                     if skip_img: return
                     return [txt_file.read()]
 
-            target_image_file_path = self._prepare_send_image(refer_image_file_path)
+            target_image_file_path = await self._prepare_send_image(refer_image_file_path)
 
             logger.debug(f'{refer_image_file_path=}')
 
@@ -806,14 +800,6 @@ class Fur(Plugin):
             if what == 'gif':
                 image_msg = mirai.models.message.Image(path=target_image_file_path)
             else:
-                exif = {}
-                with Image.open(refer_image_file_path) as refer_img:
-                    raw_exif = refer_img._getexif()
-                if raw_exif is not None:
-                    exif = { ExifTags.TAGS[k]: v for k, v in raw_exif.items() if k in ExifTags.TAGS }
-
-                logger.debug(exif)
-
                 key_renames = {
                     'Make': 'make',
                     'Model': 'model',
@@ -824,15 +810,16 @@ class Fur(Plugin):
                     'ISOSpeedRatings': 'iso_speed_ratings'
                 }
 
-                logger.debug({key_renames[key]: exif[key] for key in exif if key in key_renames})
+                exif = await self.image_analyzer.run(read_exif, refer_image_file_path, key_renames)
+                logger.debug(exif)
 
-                render_image_file_path = self._prepare_render_image(target_image_file_path)
+                render_image_file_path = await self._prepare_render_image(target_image_file_path)
                 img_url = self.renderer.local_file_url(render_image_file_path)
                 try:
                     b64_img = await self.renderer.render('pic_details', data={
                         'img_url': img_url,
                         'author': author_name,
-                        'exif': {key_renames[key]: float(exif[key]) if isinstance(exif[key], TiffImagePlugin.IFDRational) else exif[key] for key in exif if key in key_renames}
+                        'exif': exif
                     }, local_files={
                         img_url: render_image_file_path,
                     })
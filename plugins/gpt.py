@@ -16,13 +16,7 @@ import inspect
 from typing import Callable, Dict, List, Optional
 from enum import Enum
 from mirai.models.message import MessageComponent
-import aiohttp
 from asyncify import asyncify
-from huaweicloudsdkcore.auth.credentials import BasicCredentials
-from huaweicloudsdkcore.exceptions import exceptions
-from huaweicloudsdkimage.v2 import *
-from huaweicloudsdksis.v1.region.sis_region import SisRegion
-from huaweicloudsdksis.v1 import *
 from mako.lookup import TemplateLookup
 from abc import ABC, abstractmethod
 from PIL import Image as PImage
@@ -154,10 +148,9 @@ class Gpt(Plugin):
     async def load_image(self, img: Image):
         logger.debug(img.url)  
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(img.url) as resp:
-                    content_type = resp.headers.get('Content-Type')
-                    pimg: PImage.Image = PImage.open(BytesIO(await resp.read()))
+            media = await self.http.fetch_media(img.url, key=img.image_id)
+            content_type = media.content_type
+            pimg: PImage.Image = PImage.open(BytesIO(media.data))
             if content_type != 'image/gif':
                 return pimg
             buffered = BytesIO()
@@ -169,6 +162,10 @@ class Gpt(Plugin):
         ...
 
     async def analyze_voice(self, voice: Voice):
+        from huaweicloudsdkcore.auth.credentials import BasicCredentials
+        from huaweicloudsdkcore.exceptions import exceptions
+        from huaweicloudsdksis.v1.region.sis_region import SisRegion
+        from huaweicloudsdksis.v1 import Config, PostShortAudioReq, RecognizeShortAudioRequest, SisClient
         credentials = BasicCredentials(config.HUAWEICLOUD_AK, config.HUAWEICLOUD_SK)
 
         rnd_str = uuid.uuid4()
@@ -1216,7 +1213,5 @@ class ChatContextMan():
         self.news = await self._fetch_news()
 
     async def _fetch_news(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://www.toutiao.com/hot-event/hot-board/?origin=toutiao_pc') as response:
-                j = await response.json()
-                return [e['Title'] for e in j['data']]
+        j = await self.outer.http.get_json('https://www.toutiao.com/hot-event/hot-board/?origin=toutiao_pc')
+        return [e['Title'] for e in j['data']]
@@ -0,0 +1,73 @@
+import asyncio
+import atexit
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Final, Optional, TypeVar
+
+from plugin import Plugin, autorun, route
+from ttl_cache import CacheStats, TTLCache
+from image_analysis import ImageAnalysis, analyze_image, content_key
+from utilities import get_logger
+
+T = TypeVar('T')
+
+logger = get_logger()
+
+@route('图片分析')
+class ImageAnalyzer(Plugin):
+    '''把解码、hash、识别二维码等CPU密集的图片处理放到子进程中执行
+
+    同一张图片(按内容摘要)的分析结果会缓存一段时间, 多人转发同一张图、
+    或者多个插件分析同一条消息里的图片时只计算一次.
+    '''
+    WORKERS: Final = 2
+    ANALYSIS_CACHE_SIZE: Final = 1024
+    ANALYSIS_CACHE_TTL: Final = 60 * 60
+
+    def __init__(self):
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.analyses: TTLCache[str, ImageAnalysis] = TTLCache(
+            maxsize=self.ANALYSIS_CACHE_SIZE, ttl=self.ANALYSIS_CACHE_TTL
+        )
+        self._atexit_registered = False
+
+    @autorun
+    async def startup(self):
+        # 提前拉起子进程, 第一张图片不必等待进程启动
+        await asyncio.gather(*(self.run(content_key, b'') for _ in range(self.WORKERS)))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # 统一使用spawn, 避免fork时复制事件循环和其他线程持有的锁
+            self.pool = ProcessPoolExecutor(max_workers=self.WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            if not self._atexit_registered:
+                atexit.register(self._shutdown_pool)
+                self._atexit_registered = True
+        return self.pool
+
+    def _shutdown_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        '''在进程池中执行fn, fn必须是模块顶层的函数'''
+        pool = self._get_pool()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        except BrokenProcessPool:
+            # 子进程异常退出(比如解码某张图片时崩溃)后整个进程池都不可用, 下次调用时重建
+            logger.error(f'image worker died while running {fn.__name__}')
+            if self.pool is pool:
+                self._shutdown_pool()
+            raise
+
+    async def analyze(self, data: bytes) -> ImageAnalysis:
+        key = content_key(data)
+        return await self.analyses.get_or_load(key, lambda: self.run(analyze_image, data, key))
+
+    @property
+    def analysis_stats(self) -> CacheStats:
+        return self.analyses.stats
@@ -16,16 +16,13 @@ from plugin import AchvCustomizer, Inject, Plugin, any_instr, autorun, delegate,
 from aiomqtt import Client
 import aiomqtt
 from mirai import At, GroupMessage, Image
-from mirai.models.entities import GroupMember, Group, GroupConfigModel
+from mirai.models.entities import GroupMember, Group, GroupConfigModel, Permission
 from bilibili_api import live, search
 import json
 from enum import Enum, auto
 import mirai.models.message
 import inflection
-import aiohttp
 import humanize
-from PIL import Image as PImage, ImageOps
-import pyzbar.pyzbar
 import math
 
 from typing import TYPE_CHECKING, Awaitable, Callable, ClassVar, Final, Optional, overload
@@ -730,9 +727,8 @@ class Live(Plugin, AchvCustomizer):
             pending = self.try_pop_pending_by(req_id=j['id'])
             if pending is None: return
             url = j['url']
-            async with aiohttp.ClientSession() as session:
-                async with session.head(url) as resp:
-                    length = int(resp.headers.get('Content-Length'))
+            headers = await self.http.head(url)
+            length = int(headers.get('Content-Length'))
             await pending.source.op.send([
                 f'录屏GIF上传中...({humanize.naturalsize(length, gnu=True)})'
             ])
@@ -1192,10 +1188,20 @@ class Live(Plugin, AchvCustomizer):
             return
         
         for group_id in self.known_groups:
-            for qq_id in will_update_progress_qqids:
-                member = await self.bot.get_group_member(group_id, qq_id)
-                if member is None:
-                    continue
+            group = await self.bot.get_group(group_id)
+            if group is None:
+                continue
+            # 一次性取回本群内的成员, 不在群内的直接跳过, 不再逐个查询
+            infos = await self.nap_cat.fetch_group_member_infos(group_id, will_update_progress_qqids)
+            for qq_id, info in infos.items():
+                # 批量结果里没有群角色, 这里只用于成就进度, 按普通成员处理
+                member = GroupMember(
+                    id=qq_id,
+                    member_name=info.card or info.nickname or str(qq_id),
+                    permission=Permission.Member,
+                    group=group,
+                    special_title=info.title or '',
+                )
                 async with self.override(member):
                     async def by(extra: 'AchvExtra'):
                         if extra.user_data is None:
@@ -1407,16 +1413,14 @@ class Live(Plugin, AchvCustomizer):
         except RuntimeError as e:
             return ''.join(['CDKEY兑换失败: ', *e.args])
 
-    @any_instr()
+    @any_instr(InstrAttr.CONCURRENT)
     async def barcode_cdkey_cmd(self, event: GroupMessage):
         for c in event.message_chain:
             if isinstance(c, Image):
-                img: PImage = await self.admin.load_image(c)
-                img = img.convert("RGB")
-                img = ImageOps.invert(img)
-                qrcodes: list[pyzbar.pyzbar.Decoded] = pyzbar.pyzbar.decode(img, symbols=[pyzbar.pyzbar.ZBarSymbol.CODE39])
-                if len(qrcodes) > 0:
-                    cdkey = qrcodes[0].data.decode()
+                # 与censor_speech共用同一次分析结果
+                analysis = await self.admin.analyze_image(c)
+                if len(analysis.code39) > 0:
+                    cdkey = analysis.code39[0]
                     print(f'{cdkey=}')
                     return await self.redeem_cdkey(cdkey=cdkey)
 
@@ -4,7 +4,6 @@ from decimal import Decimal
 import inspect
 import traceback
 from types import MethodType
-import aiohttp
 from mirai import get_logger
 from starlette.requests import Request
 from starlette.responses import JSONResponse
@@ -157,17 +156,15 @@ class Mini(Plugin):
     
     @endpoint
     async def login(self, code: str):
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://api.q.qq.com/sns/jscode2session', params={
-                'appid': '1112171843',
-                'secret': '866UZjMprcGQYAHy',
-                'js_code': code,
-                'grant_type': 'authorization_code'
-            }) as response:
-                j = await response.json()
-                return {
-                    "openid": j["openid"],
-                }
+        j = await self.http.get_json('https://api.q.qq.com/sns/jscode2session', params={
+            'appid': '1112171843',
+            'secret': '866UZjMprcGQYAHy',
+            'js_code': code,
+            'grant_type': 'authorization_code'
+        })
+        return {
+            "openid": j["openid"],
+        }
 
     @endpoint
     async def test(self, name: str):
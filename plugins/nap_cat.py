@@ -1,18 +1,36 @@
-from typing import Type, TypeVar, Union, overload
+import asyncio
+from typing import Final, Iterable, Optional, Type, TypeVar, Union, overload
 from mirai import GroupMessage
 from plugin import Plugin, delegate, top_instr, route, enable_backup, Inject
 from mirai.models.entities import GroupMember
 from dacite import Config
 from dacite.core import _build_value
 
-from utilities import User
+from ttl_cache import TTLCache
+from utilities import User, get_logger
 from nap_cat_types import *
 
 T = TypeVar('T')
 
+logger = get_logger()
+
 @route('NapCat')
 @enable_backup
 class NapCat(Plugin):
+    # 成员信息在这段时间(秒)内直接复用, 不再请求NapCat
+    MEMBER_INFO_FRESHNESS: Final = 60
+    MEMBER_INFO_CACHE_SIZE: Final = 20000
+    # 同一个群一次需要查询的未缓存成员不少于这个数量时, 改为拉取一次群成员列表
+    MEMBER_INFO_BULK_THRESHOLD: Final = 8
+
+    def __init__(self):
+        self.member_infos: TTLCache[tuple[int, int], GetGroupMemberInfoResp] = TTLCache(
+            maxsize=self.MEMBER_INFO_CACHE_SIZE, ttl=self.MEMBER_INFO_FRESHNESS
+        )
+        # 只用于合并同一个群并发的成员列表请求, 结果会展开到member_infos中
+        self.member_lists: TTLCache[int, dict[int, GetGroupMemberInfoResp]] = TTLCache(
+            maxsize=256, ttl=self.MEMBER_INFO_FRESHNESS
+        )
 
     async def call(self, action: str, data: dict, ret_type: Type[T] = None) -> T:
         action = action.removeprefix('/')
@@ -34,7 +52,7 @@ class NapCat(Plugin):
         }, list[GetGroupMemberListRespItem])
 
     @overload
-    async def get_group_member_info(self) -> GetGroupMemberInfoResp: ...
+    async def get_group_member_info(self, *, fresh: bool = False) -> GetGroupMemberInfoResp: ...
 
     async def set_essence_msg(self, message_id: int):
         return await self.call('/set_essence_msg', {
@@ -42,12 +60,66 @@ class NapCat(Plugin):
         })
 
     @delegate()
-    async def get_group_member_info(self, member: GroupMember) -> GetGroupMemberInfoResp:
-        return await self.call('/get_group_member_info', {
-            "group_id": member.group.id,
-            "user_id": member.id,
+    async def get_group_member_info(self, member: GroupMember, *, fresh: bool = False) -> GetGroupMemberInfoResp:
+        return await self.fetch_group_member_info(member.group.id, member.id, fresh=fresh)
+
+    async def fetch_group_member_info(self, group_id: int, user_id: int, *, fresh: bool = False) -> GetGroupMemberInfoResp:
+        key = (group_id, user_id)
+        if fresh:
+            self.member_infos.pop(key)
+        return await self.member_infos.get_or_load(key, lambda: self.call('/get_group_member_info', {
+            "group_id": group_id,
+            "user_id": user_id,
             "no_cache": True
-        }, GetGroupMemberInfoResp)
+        }, GetGroupMemberInfoResp))
+
+    async def fetch_group_member_infos(self, group_id: int, user_ids: Iterable[int]) -> dict[int, GetGroupMemberInfoResp]:
+        '''批量获取成员信息, 不在群内或获取失败的成员不会出现在结果中'''
+        user_ids = list(dict.fromkeys(user_ids))
+        res: dict[int, GetGroupMemberInfoResp] = {}
+        missing: list[int] = []
+        for user_id in user_ids:
+            info = self.member_infos.get((group_id, user_id))
+            if info is None:
+                missing.append(user_id)
+            else:
+                res[user_id] = info
+
+        if len(missing) >= self.MEMBER_INFO_BULK_THRESHOLD:
+            try:
+                infos = await self.member_lists.get_or_load(group_id, lambda: self._load_member_list(group_id))
+            except Exception:
+                logger.warning(f'拉取群{group_id}成员列表失败, 改为逐个查询')
+            else:
+                res.update({user_id: infos[user_id] for user_id in missing if user_id in infos})
+                return res
+
+        async def fetch(user_id: int):
+            try:
+                return await self.fetch_group_member_info(group_id, user_id)
+            except Exception:
+                return None
+
+        for user_id, info in zip(missing, await asyncio.gather(*[fetch(user_id) for user_id in missing])):
+            if info is not None:
+                res[user_id] = info
+        return res
+
+    async def _load_member_list(self, group_id: int) -> dict[int, GetGroupMemberInfoResp]:
+        payload = await self.call('/get_group_member_list', {
+            "group_id": group_id
+        })
+        config = Config()
+        infos = {int(item['user_id']): _build_value(type_=GetGroupMemberInfoResp, data=item, config=config) for item in payload}
+        self.member_infos.update({(group_id, user_id): info for user_id, info in infos.items()})
+        return infos
+
+    def invalidate_member_info(self, group_id: int, user_id: Optional[int] = None):
+        if user_id is None:
+            self.member_infos.invalidate_where(lambda key: key[0] == group_id)
+        else:
+            self.member_infos.pop((group_id, user_id))
+        self.member_lists.pop(group_id)
     
     @delegate()
     async def send_poke(self, member: GroupMember):
@@ -1,25 +1,166 @@
 import asyncio
 import atexit
-import io
 import gc
 import contextlib
+import hashlib
+import heapq
+import itertools
 import mimetypes
 import os
 import signal
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Final, Optional, Union
 from mirai import Image
-from plugin import InstrAttr, Plugin, autorun, delegate, enable_backup, route
+from http_client import Media, MediaCache
+from ttl_cache import SingleFlight
+from image_analysis import encode_animation
+from plugin import Inject, InstrAttr, Plugin, autorun, delegate, enable_backup, route
 import urllib.parse
 import uuid
 import json
 import time
-import base64
 import statistics
-from PIL import Image as PILImage
 
 from utilities import SourceOp, get_logger
 
+if TYPE_CHECKING:
+    from plugins.image_analyzer import ImageAnalyzer
+
 logger = get_logger()
 
+# 静态渲染和录制动图时根元素的字号(px), 前端按它缩放
+STATIC_RENDER_SCALE: Final = 2
+ANIMATION_RENDER_SCALE: Final = 1
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+@dataclass
+class RouteStats():
+    renders: int = 0
+    errors: int = 0
+    # 排队超时和渲染超时都计入
+    timeouts: int = 0
+    # 复用了池中已经打开的页面
+    reused: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=256))
+    waits: deque = field(default_factory=lambda: deque(maxlen=256))
+
+    def summary(self) -> str:
+        return (
+            f'renders={self.renders} errors={self.errors} timeouts={self.timeouts} '
+            f'reused={self.reused} '
+            f'p50={percentile(self.latencies, 0.5):.2f}s p95={percentile(self.latencies, 0.95):.2f}s '
+            f'wait_p95={percentile(self.waits, 0.95):.2f}s'
+        )
+
+class RenderQueue():
+    '''限制同时进行的渲染数, priority越小越先分到名额, 同优先级先到先得
+
+    exclusive()等待进行中的渲染全部结束并暂停分配名额, 用于重启或关闭浏览器.
+    '''
+
+    def __init__(self, slots: int) -> None:
+        self.slots = max(1, slots)
+        self.active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._exclusive = 0
+        self._exclusive_lock: Optional[asyncio.Lock] = None
+        self._drained: Optional[asyncio.Future] = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for *_, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority: int = 0, timeout: Optional[float] = None):
+        if self.active < self.slots and not self._exclusive and self.waiting == 0:
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                # 超时或取消的同时已经分到了名额, 转交给下一个
+                self.release()
+            else:
+                fut.cancel()
+            raise
+
+    def release(self):
+        self.active -= 1
+        if self.active == 0 and self._drained is not None and not self._drained.done():
+            self._drained.set_result(None)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.active < self.slots and not self._exclusive:
+            *_, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.active += 1
+            fut.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        if self._exclusive_lock is None:
+            self._exclusive_lock = asyncio.Lock()
+        async with self._exclusive_lock:
+            self._exclusive += 1
+            try:
+                while self.active > 0:
+                    self._drained = asyncio.get_running_loop().create_future()
+                    await self._drained
+                yield
+            finally:
+                self._drained = None
+                self._exclusive -= 1
+                self._wake()
+
+@dataclass
+class RenderCacheStats():
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    # 等待内容相同、正在进行的渲染
+    coalesced: int = 0
+    # 命中时省下的渲染结果字节数(base64)
+    bytes_saved: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.disk_hits + self.coalesced + self.misses
+        return 1 - self.misses / total if total else 0
+
+    def summary(self) -> str:
+        return (
+            f'hit_rate={self.hit_rate:.1%} memory_hits={self.memory_hits} disk_hits={self.disk_hits} '
+            f'coalesced={self.coalesced} misses={self.misses} bytes_saved={self.bytes_saved}'
+        )
+
+@dataclass
+class PooledPage():
+    page: Any
+    page_url: str
+    fullpage: bool
+    # 页面所属的浏览器, 浏览器重启后旧页面直接丢弃
+    browser: Any
+    renders: int = 0
+    loaded: bool = False
+    intercepting: bool = False
+    # 拦截器读取的本地文件表, 每次渲染时替换内容
+    local_files: dict[str, str] = field(default_factory=dict)
+    # 用来注入renderData的协议会话, 脚本随会话存在
+    cdp: Any = None
+    # Page.addScriptToEvaluateOnNewDocument返回的标识, 更换数据时先移除旧脚本
+    data_script_id: Optional[str] = None
+
 # ./.vscode/settings.json ["terminal.integrated.env.windows"]
 # $env:PYPPETEER_CHROMIUM_REVISION=1226537
 # https://vikyd.github.io/download-chromium-history-version/#/
@@ -27,26 +168,67 @@ logger = get_logger()
 @route('渲染')
 # @enable_backup
 class Renderer(Plugin):
+    '''用无头浏览器打开p-bot-fe的页面并截图
+
+    渲染按优先级排队, 最多render_concurrency个同时进行. 静态渲染用过的页面按
+    路由放回池中, 下次复用时替换renderData后重新加载: 省掉的只是newPage,
+    页面仍然要重新导航和执行前端代码(前端没有原地重新渲染的接口). 页面渲染
+    次数或JS堆过大时关闭重开. render_warm_pages中的路由在浏览器启动后预先打开.
+
+    传入cache_key或cache_tag的渲染结果按内容摘要缓存在内存和磁盘中, 命中时不经过浏览器, 见render.
+    '''
     api_base: str = 'http://localhost:4399/' # D:\projects\js\p-bot-fe
     render_scale: float = 2
     max_animation_duration: float = 6
     max_animation_frames: int = 90
     max_animation_dimension: int = 960
+    # 'gif'或'webp', PIL不支持WebP动图时仍输出GIF
+    animation_format: str = 'gif'
     browser_restart_render_count: int = 80
     browser_restart_rss_mb: int = 512
     browser_idle_close_seconds: int = 10 * 60
+    render_concurrency: int = 3
+    # 每个路由最多保留的空闲页面数
+    render_pages_per_route: int = 2
+    # 路由 -> 浏览器启动后预先打开的页面数, 比如{'rich-list': 1}
+    render_warm_pages: dict[str, int] = {}
+    render_page_max_renders: int = 50
+    render_page_max_js_heap_mb: int = 128
+    render_queue_timeout: float = 60
+    render_timeout: float = 60
+    render_cache_dir: str = './cache/render'
+    render_cache_memory_mb: int = 32
+    render_cache_disk_mb: int = 256
+    # 前端改版后加一, 使已缓存的渲染结果全部失效
+    render_cache_version: int = 1
+
+    image_analyzer: Inject['ImageAnalyzer']
 
     def __init__(self):
-        self.render_lock = asyncio.Lock()
+        self.render_queue = RenderQueue(self.render_concurrency)
+        self.browser_lock = asyncio.Lock()
         self.browser = None
         self.browser_render_count = 0
         self.last_render_request_ts = 0
+        # (页面url, fullpage) -> 空闲页面
+        self.idle_pages: dict[tuple[str, bool], list[PooledPage]] = {}
+        self.route_stats: dict[str, RouteStats] = {}
+        self.render_cache = MediaCache(
+            self.render_cache_dir,
+            memory_bytes=self.render_cache_memory_mb * 1024 * 1024,
+            disk_bytes=self.render_cache_disk_mb * 1024 * 1024,
+        )
+        self.render_cache_stats = RenderCacheStats()
+        self.render_cache_lock = asyncio.Lock()
+        self._render_inflight: SingleFlight[str, Union[str, bytes]] = SingleFlight()
         self._atexit_registered = False
 
     @autorun
     async def startup(self):
         ...
-        self.render_lock = asyncio.Lock()
+        self.render_queue = RenderQueue(self.render_concurrency)
+        self.browser_lock = asyncio.Lock()
+        self.render_cache_lock = asyncio.Lock()
         if not self._atexit_registered:
             atexit.register(self._close_browser_at_exit)
             self._atexit_registered = True
@@ -61,7 +243,7 @@ class Renderer(Plugin):
             idle_seconds = time.time() - last_render_request_ts
             if last_render_request_ts <= 0 or idle_seconds < self.browser_idle_close_seconds:
                 continue
-            async with self.render_lock:
+            async with self.render_queue.exclusive():
                 idle_seconds = time.time() - self.last_render_request_ts
                 if (
                     self._browser_alive()
@@ -72,6 +254,15 @@ class Renderer(Plugin):
                     await self._close_browser()
                     gc.collect()
 
+    def stats_report(self) -> str:
+        lines = [
+            f'queue active={self.render_queue.active} waiting={self.render_queue.waiting}',
+            f'cache {self.render_cache_stats.summary()}',
+        ]
+        for route_url, stats in self.route_stats.items():
+            lines.append(f'{route_url}: {stats.summary()}')
+        return '\n'.join(lines)
+
     def _browser_args(self):
         return [
             '--headless',
@@ -113,6 +304,9 @@ class Renderer(Plugin):
             handleSIGHUP=False,
         )
         self.browser_render_count = 0
+        self.idle_pages.clear()
+        if self.render_warm_pages:
+            asyncio.create_task(self._warm_pages(self.browser))
 
     def _browser_alive(self):
         if self.browser is None:
@@ -124,12 +318,16 @@ class Renderer(Plugin):
         return poll is None or poll() is None
 
     async def _ensure_browser(self):
-        if not self._browser_alive():
-            await self._launch_browser()
+        if self._browser_alive():
+            return
+        async with self.browser_lock:
+            if not self._browser_alive():
+                await self._launch_browser()
 
     async def _close_browser(self):
         browser = self.browser
         self.browser = None
+        self.idle_pages.clear()
         if browser is None:
             return
         process = getattr(browser, 'process', None)
@@ -275,22 +473,94 @@ class Renderer(Plugin):
             stack.extend(children.get(pid, []))
         return total_rss
 
-    async def _restart_browser_if_needed(self):
-        self.browser_render_count += 1
+    def _browser_over_limit(self):
         rss_kb = self._browser_tree_rss_kb()
         over_count = self.browser_render_count >= self.browser_restart_render_count
         over_memory = (
             rss_kb > 0 and rss_kb >= self.browser_restart_rss_mb * 1024
         )
-        if not over_count and not over_memory:
+        return over_count or over_memory, rss_kb
+
+    async def _restart_browser_if_needed(self):
+        if not self._browser_over_limit()[0]:
             return
-        logger.info(
-            f'restart chromium: {self.browser_render_count=}, '
-            f'browser_rss_mb={rss_kb / 1024:.1f}'
-        )
-        await self._close_browser()
-        gc.collect()
-        await self._launch_browser()
+        # 等进行中的渲染结束后再重启, 期间新的渲染继续排队
+        async with self.render_queue.exclusive():
+            over_limit, rss_kb = self._browser_over_limit()
+            if not over_limit or not self._browser_alive():
+                return
+            logger.info(
+                f'restart chromium: {self.browser_render_count=}, '
+                f'browser_rss_mb={rss_kb / 1024:.1f}'
+            )
+            await self._close_browser()
+            gc.collect()
+            await self._launch_browser()
+
+    async def _page_js_heap_mb(self, page) -> Optional[float]:
+        try:
+            metrics = await page.metrics()
+        except Exception:
+            return None
+        return metrics.get('JSHeapUsedSize', 0) / 1024 / 1024
+
+    async def _checkout_page(self, page_url: str, fullpage: bool) -> tuple[PooledPage, bool]:
+        '''从池中取出空闲页面, 没有时新开一个; 第二个返回值表示是否复用'''
+        await self._ensure_browser()
+        idle = self.idle_pages.get((page_url, fullpage))
+        while idle:
+            pooled = idle.pop()
+            if pooled.browser is self.browser and not pooled.page.isClosed():
+                return pooled, True
+        page = await self.browser.newPage()
+        return PooledPage(page=page, page_url=page_url, fullpage=fullpage, browser=self.browser), False
+
+    async def _checkin_page(self, pooled: PooledPage, healthy: bool):
+        '''渲染结束后把页面放回池中, 出错、过旧或者池已满时关闭'''
+        key = (pooled.page_url, pooled.fullpage)
+        idle = self.idle_pages.setdefault(key, [])
+        reason = None
+        if not healthy:
+            reason = 'error'
+        elif pooled.browser is not self.browser or pooled.page.isClosed():
+            reason = 'stale'
+        elif pooled.renders >= self.render_page_max_renders:
+            reason = 'renders'
+        elif len(idle) >= self.render_pages_per_route:
+            reason = 'pool full'
+        else:
+            js_heap_mb = await self._page_js_heap_mb(pooled.page)
+            if js_heap_mb is None or js_heap_mb >= self.render_page_max_js_heap_mb:
+                reason = f'js_heap_mb={js_heap_mb}'
+        if reason is None:
+            idle.append(pooled)
+            return
+        logger.debug(f'recycle render page {pooled.page_url} {reason=} renders={pooled.renders}')
+        with contextlib.suppress(Exception):
+            await pooled.page.close()
+
+    async def _warm_pages(self, browser):
+        for url, count in self.render_warm_pages.items():
+            page_url = urllib.parse.urljoin(self.api_base, url)
+            idle = self.idle_pages.setdefault((page_url, False), [])
+            for _ in range(min(count, self.render_pages_per_route)):
+                # 预热不应挤占用户的渲染
+                await self.render_queue.acquire(priority=100)
+                pooled = None
+                try:
+                    if self.browser is not browser or len(idle) >= self.render_pages_per_route:
+                        break
+                    pooled = PooledPage(page=await browser.newPage(), page_url=page_url, fullpage=False, browser=browser)
+                    await self._load_page(pooled, None, fullpage=False)
+                    idle.append(pooled)
+                except Exception as e:
+                    logger.warning(f'warm render page {url} failed {e=}')
+                    if pooled is not None:
+                        with contextlib.suppress(Exception):
+                            await pooled.page.close()
+                    return
+                finally:
+                    self.render_queue.release()
 
     def local_file_url(self, file_path: str, api_base=None):
         if api_base is None:
@@ -331,32 +601,14 @@ class Renderer(Plugin):
             return waitFrames();
         }''')
 
-    def _limit_image_dimensions(self, image: PILImage.Image):
-        max_dimension = max(1, int(self.max_animation_dimension))
-        if max(image.size) <= max_dimension:
-            return image
-        image = image.copy()
-        resample = getattr(getattr(PILImage, 'Resampling', PILImage), 'LANCZOS')
-        image.thumbnail((max_dimension, max_dimension), resample)
-        return image
-
-    def _decode_frame(self, b64_data: str):
-        frame_bytes = base64.b64decode(b64_data)
-        try:
-            with io.BytesIO(frame_bytes) as image_bio:
-                image = PILImage.open(image_bio)
-                image.load()
-            return self._limit_image_dimensions(image.convert('RGBA'))
-        finally:
-            del frame_bytes
-
     @delegate(InstrAttr.BACKGROUND)
     async def render_as_task(self, op: SourceOp, *, url: str, data=None, target_selector='#target', done_selector='#done',
             api_base=None, fullpage=False, duration: float=None, keep_last=False,
-            playback_rate=1):
+            playback_rate=1, animation_format: str=None, priority=0, cache: bool=None, cache_key: str=None, cache_tag=None):
         b64_img = await self.render(
             url, data=data, target_selector=target_selector, done_selector=done_selector, api_base=api_base,
-            fullpage=fullpage, duration=duration, keep_last=keep_last, playback_rate=playback_rate
+            fullpage=fullpage, duration=duration, keep_last=keep_last, playback_rate=playback_rate,
+            animation_format=animation_format, priority=priority, cache=cache, cache_key=cache_key, cache_tag=cache_tag
         )
         await op.send([
             Image(base64=b64_img)
@@ -365,152 +617,298 @@ class Renderer(Plugin):
     async def render(
             self, url, *, data=None, target_selector='#target', done_selector='#done',
             api_base=None, fullpage=False, duration: float=None, keep_last=False,
-            playback_rate=1, local_files: dict[str, str]=None
+            playback_rate=1, animation_format: str=None, local_files: dict[str, str]=None, priority=0,
+            queue_timeout: float=None, cache: bool=None, cache_key: str=None, cache_tag=None
         ):
-        ...
+        '''priority越小越先渲染; 排队超过queue_timeout(默认render_queue_timeout)秒时抛出asyncio.TimeoutError
+
+        默认不缓存: 页面可能依赖data以外的内容(前端时钟、相对时间、前端自己请求的数据).
+        传入cache=True、cache_key或cache_tag时, 结果按(页面, 数据, 选择器, 缩放, 时长等)的摘要
+        缓存到磁盘, 重启后仍然有效. cache_key用来代替data计算摘要, cache_tag(比如数据的版本号)
+        变化时旧结果不再命中. 调用方需要保证这些内容决定了渲染结果.
+        '''
         # # https://developer.mozilla.org/en-US/docs/Web/API/Animation/playbackRate
-        async with self.render_lock:
+        if api_base is None:
+            api_base = self.api_base
+        page_url = urllib.parse.urljoin(api_base, url)
+        if duration is not None:
+            animation_format = (animation_format or self.animation_format).lower()
+        kwargs = dict(
+            data=data, target_selector=target_selector, done_selector=done_selector, fullpage=fullpage,
+            duration=duration, keep_last=keep_last, playback_rate=playback_rate, animation_format=animation_format,
+        )
+        if cache is None:
+            cache = cache_key is not None or cache_tag is not None
+        if not cache:
+            return await self._render_uncached(
+                url, page_url, local_files=local_files, priority=priority, queue_timeout=queue_timeout, **kwargs
+            )
+        key = self.render_cache_key(page_url, cache_key=cache_key, cache_tag=cache_tag, **kwargs)
+        return await self._render_cached(key, lambda: self._render_uncached(
+            url, page_url, local_files=local_files, priority=priority, queue_timeout=queue_timeout, **kwargs
+        ))
+
+    def render_cache_key(
+            self, page_url, *, data, cache_key, cache_tag, target_selector, done_selector,
+            fullpage, duration, keep_last, playback_rate, animation_format
+        ) -> str:
+        content = {'key': cache_key} if cache_key is not None else {'data': data}
+        payload = [
+            self.render_cache_version, page_url, content, cache_tag, target_selector, done_selector, fullpage,
+            STATIC_RENDER_SCALE if duration is None else ANIMATION_RENDER_SCALE, duration, keep_last, playback_rate, animation_format,
+        ]
+        # 排序键并统一格式, 内容相同的数据得到相同的摘要
+        by = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+        return hashlib.blake2b(by, digest_size=16).hexdigest()
+
+    @staticmethod
+    def _from_cached(media: Media) -> Union[str, bytes]:
+        # 静态截图是base64字符串, 动图是base64编码的bytes, 与渲染结果保持一致
+        if media.content_type == 'image/png':
+            return media.data.decode()
+        return media.data
+
+    async def _render_cached(self, key: str, load: Callable[[], Awaitable[Union[str, bytes]]]) -> Union[str, bytes]:
+        stats = self.render_cache_stats
+        media = self.render_cache.get_memory(key)
+        if media is not None:
+            stats.memory_hits += 1
+            stats.bytes_saved += len(media.data)
+            return self._from_cached(media)
+        coalesced = key in self._render_inflight
+        if coalesced:
+            stats.coalesced += 1
+        res = await self._render_inflight.run(key, lambda: self._load_render(key, load))
+        if coalesced:
+            stats.bytes_saved += len(res)
+        return res
+
+    async def _load_render(self, key: str, load: Callable[[], Awaitable[Union[str, bytes]]]) -> Union[str, bytes]:
+        stats = self.render_cache_stats
+        async with self.render_cache_lock:
+            media = await asyncio.to_thread(self.render_cache.read_disk, key)
+        if media is not None:
+            stats.disk_hits += 1
+            stats.bytes_saved += len(media.data)
+            self.render_cache.put_memory(key, media)
+            return self._from_cached(media)
+        stats.misses += 1
+        res = await load()
+        if isinstance(res, bytes):
+            # base64编码后的RIFF头, 即WebP
+            media = Media(data=res, content_type='image/webp' if res.startswith(b'UklGR') else 'image/gif')
+        else:
+            media = Media(data=res.encode(), content_type='image/png')
+        self.render_cache.put_memory(key, media)
+        try:
+            async with self.render_cache_lock:
+                await asyncio.to_thread(self.render_cache.write_disk, key, media)
+        except OSError as e:
+            logger.warning(f'render cache write failed {e=}')
+        return res
+
+    async def _render_uncached(
+            self, url, page_url, *, data, target_selector, done_selector, fullpage, duration,
+            keep_last, playback_rate, animation_format, local_files, priority, queue_timeout
+        ):
+        stats = self.route_stats.setdefault(url, RouteStats())
+        if queue_timeout is None:
+            queue_timeout = self.render_queue_timeout
+        self.last_render_request_ts = time.time()
+        queued_at = time.time()
+        try:
+            await self.render_queue.acquire(priority, queue_timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            logger.warning(f'render queue timeout {url=} waiting={self.render_queue.waiting}')
+            raise
+        start = time.time()
+        stats.waits.append(start - queued_at)
+        try:
             self.last_render_request_ts = time.time()
-            await self._ensure_browser()
-            start = time.time()
-            page = None
-            if api_base is None:
-                api_base = self.api_base
-            try:
-                page = await self.browser.newPage()
-                await self._install_local_file_interceptor(page, local_files or {})
-                await page.evaluateOnNewDocument(f'() => window.renderData={json.dumps(data)}')
-
-                # await page.enable_debugger()
+            if duration is not None:
+                duration = max(0.1, min(float(duration), self.max_animation_duration))
+                coro = self._render_animation(
+                    page_url, data=data, target_selector=target_selector, fullpage=fullpage,
+                    duration=duration, keep_last=keep_last, playback_rate=playback_rate,
+                    animation_format=animation_format, done_selector=done_selector, local_files=local_files or {},
+                )
+            else:
+                coro = self._render_static(
+                    stats, page_url, data=data, target_selector=target_selector,
+                    done_selector=done_selector, fullpage=fullpage, local_files=local_files or {},
+                )
+            res = await asyncio.wait_for(coro, self.render_timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        else:
+            stats.renders += 1
+            stats.latencies.append(time.time() - start)
+            return res
+        finally:
+            self.render_queue.release()
+            self.browser_render_count += 1
+            end = time.time()
+            logger.debug(f'{url} elapsed {end-start:.2f}s waited {start-queued_at:.2f}s')
+            await self._restart_browser_if_needed()
+
+    async def _load_page(self, pooled: PooledPage, data, fullpage: bool):
+        '''替换页面加载时注入的renderData, 然后打开或重新加载页面'''
+        page = pooled.page
+        # evaluateOnNewDocument不返回脚本标识, 无法移除, 改用单独的协议会话发送对应的命令
+        if pooled.cdp is None:
+            pooled.cdp = await page.target.createCDPSession()
+            await pooled.cdp.send('Page.enable')
+        if pooled.data_script_id is not None:
+            await pooled.cdp.send('Page.removeScriptToEvaluateOnNewDocument', {'identifier': pooled.data_script_id})
+            pooled.data_script_id = None
+        res = await pooled.cdp.send('Page.addScriptToEvaluateOnNewDocument', {'source': f'window.renderData={json.dumps(data)}'})
+        pooled.data_script_id = res.get('identifier')
+        if pooled.loaded:
+            await page.reload()
+        else:
+            await page.goto(pooled.page_url)
+            pooled.loaded = True
+        if not fullpage:
+            # render_scale = self.render_scale
+            await page.addStyleTag({'content': f':root {{font-size: {STATIC_RENDER_SCALE}px}}'})
+
+    async def _render_static(self, stats: RouteStats, page_url, *, data, target_selector, done_selector, fullpage, local_files):
+        pooled, reused = await self._checkout_page(page_url, fullpage)
+        healthy = False
+        try:
+            pooled.local_files.clear()
+            pooled.local_files.update(local_files)
+            if local_files and not pooled.intercepting:
+                await self._install_local_file_interceptor(pooled.page, pooled.local_files)
+                pooled.intercepting = True
+            if reused:
+                stats.reused += 1
+            await self._load_page(pooled, data, fullpage)
+            page = pooled.page
+
+            if not fullpage:
+                logger.info('waitSelectors')
+                await page.waitForSelector(done_selector)
+                target = await page.waitForSelector(target_selector)
+            else:
+                target = page
+            await self._wait_render_ready(page)
+
+            res = await target.screenshot({
+                'omitBackground': True,
+                'encoding': 'base64'
+            })
+            healthy = True
+            return res
+        finally:
+            pooled.renders += 1
+            await self._checkin_page(pooled, healthy)
 
-                if duration is not None:
-                    duration = max(0.1, min(float(duration), self.max_animation_duration))
-                    await page.pause_animation()
+    async def _render_animation(self, page_url, *, data, target_selector, done_selector, fullpage, duration, keep_last, playback_rate, animation_format, local_files):
+        # 录屏会暂停页面动画, 动图使用单独的页面, 用完即关闭
+        await self._ensure_browser()
+        page = await self.browser.newPage()
+        try:
+            await self._install_local_file_interceptor(page, local_files)
+            await page.evaluateOnNewDocument(f'() => window.renderData={json.dumps(data)}')
 
-                await page.goto(urllib.parse.urljoin(api_base, url))
+            # await page.enable_debugger()
 
-                # await page.pause_script()
+            await page.pause_animation()
 
-                # render_scale = self.render_scale
-                render_scale = 2
+            await page.goto(page_url)
 
-                if duration is not None:
-                    render_scale = 1
+            # await page.pause_script()
 
-                async def waitSelectors():
-                    if not fullpage:
-                        # await page.pause_script()
-                        logger.info('waitSelectors')
-                        # await page.resume_script()
-                        await page.waitForSelector(done_selector)
-                        await page.waitForSelector(target_selector)
-                    await self._wait_render_ready(page)
-                    ...
+            render_scale = ANIMATION_RENDER_SCALE
 
+            async def waitSelectors():
                 if not fullpage:
-                    await page.addStyleTag({'content': f':root {{font-size: {render_scale}px}}'})
-                    # await page.waitForSelector(done_selector)
-                    # await page.waitForSelector(target_selector)
-                    target = await page.querySelector(target_selector)
-                else:
-                    target = page
-
-                if duration is not None:
-
-                    e = asyncio.Event()
-
-                    async def wait_animation():
-                        await asyncio.sleep(duration)
-                        e.set()
-                        ...
-
                     # await page.pause_script()
+                    logger.info('waitSelectors')
+                    # await page.resume_script()
+                    await page.waitForSelector(done_selector)
+                    await page.waitForSelector(target_selector)
+                await self._wait_render_ready(page)
+                ...
+
+            if not fullpage:
+                await page.addStyleTag({'content': f':root {{font-size: {render_scale}px}}'})
+                target = await page.querySelector(target_selector)
+            else:
+                target = page
+
+            e = asyncio.Event()
+
+            async def wait_animation():
+                await asyncio.sleep(duration)
+                e.set()
+                ...
+
+            # await page.pause_script()
+
+            frames = await target.screencast({
+                'omitBackground': True,
+                'event': e,
+                'waitReady': waitSelectors(),
+                'onStart': lambda: asyncio.create_task(wait_animation()),
+                'format': 'jpeg',
+                'playbackRate': playback_rate
+                # 'quality': 50
+            })
 
-                    frames = await target.screencast({
-                        'omitBackground': True,
-                        'event': e,
-                        'waitReady': waitSelectors(),
-                        'onStart': lambda: asyncio.create_task(wait_animation()),
-                        'format': 'jpeg',
-                        'playbackRate': playback_rate
-                        # 'quality': 50
-                    })
-
-                    selected_frames = []
-                    frame_durations = []
-                    min_frame_delta = 1 / (30 * playback_rate)
-                    prev_ts = None
-                    raw_frame_count = len(frames)
-                    max_frames = max(1, int(self.max_animation_frames))
-                    for frame in frames:
-                        ts = frame['timestamp']
-                        if prev_ts is not None and ts - prev_ts < min_frame_delta:
-                            frame['data'] = None
-                            continue
-
-                        frame_duration = 1 / 30 if prev_ts is None else max(
-                            1 / 30,
-                            (ts - prev_ts) * playback_rate
-                        )
-                        selected_frames.append(self._decode_frame(frame['data']))
-                        frame_durations.append(frame_duration)
-                        frame['data'] = None
-                        prev_ts = ts
-
-                        if len(selected_frames) >= max_frames:
-                            break
-
-                    del frames
-
-                    if len(selected_frames) == 0:
-                        raise RuntimeError('no frames captured')
-
-                    average_duration = statistics.mean(frame_durations)
-                    average_fps = 1 / average_duration
-
-                    if keep_last:
-                        frame_durations[-1] = 5
-
-
-                    logger.debug(
-                        f'{raw_frame_count=} => selected_frame_count={len(selected_frames)}, '
-                        f'{average_fps=:.2f}'
-                    )
-
-
-                    buffered = io.BytesIO()
+            # 这里只按时间戳挑选帧, 解码、去重和编码都在图片处理进程中进行
+            selected_frames = []
+            frame_durations = []
+            min_frame_delta = 1 / (30 * playback_rate)
+            prev_ts = None
+            raw_frame_count = len(frames)
+            max_frames = max(1, int(self.max_animation_frames))
+            for frame in frames:
+                ts = frame['timestamp']
+                if prev_ts is not None and ts - prev_ts < min_frame_delta:
+                    frame['data'] = None
+                    continue
+
+                frame_duration = 1 / 30 if prev_ts is None else max(
+                    1 / 30,
+                    (ts - prev_ts) * playback_rate
+                )
+                selected_frames.append(frame['data'])
+                frame_durations.append(frame_duration)
+                frame['data'] = None
+                prev_ts = ts
+
+                if len(selected_frames) >= max_frames:
+                    break
+
+            del frames
+        finally:
+            with contextlib.suppress(Exception):
+                await page.close()
 
-                    # first_img.save(buffered, format="GIF", save_all=True, append_images=remains_img, duration=durations, loop=0)
+        if len(selected_frames) == 0:
+            raise RuntimeError('no frames captured')
 
-                    first_frame, *remaining_frames = selected_frames
-                    first_frame.save(
-                        buffered,
-                        format='GIF',
-                        save_all=True,
-                        append_images=remaining_frames,
-                        duration=[max(20, int(item * 1000)) for item in frame_durations],
-                        loop=1,
-                        disposal=2,
-                    )
+        average_duration = statistics.mean(frame_durations)
+        average_fps = 1 / average_duration
 
-                    img_str = base64.b64encode(buffered.getvalue())
+        if keep_last:
+            frame_durations[-1] = 5
 
-                    del first_frame, remaining_frames, selected_frames, frame_durations, buffered
-                    gc.collect()
+        img_str, fmt, kept_frame_count = await self.image_analyzer.run(
+            encode_animation, selected_frames, frame_durations,
+            max_dimension=max(1, int(self.max_animation_dimension)), format=animation_format,
+        )
 
-                    # return frames[0]['data']
-                    return img_str
-                else:
-                    await waitSelectors()
+        logger.debug(
+            f'{raw_frame_count=} => selected_frame_count={len(selected_frames)}, '
+            f'{kept_frame_count=}, {average_fps=:.2f}, {fmt=}'
+        )
 
-                    return await target.screenshot({
-                        'omitBackground': True,
-                        'encoding': 'base64'
-                    })
-            finally:
-                if page is not None:
-                    with contextlib.suppress(Exception):
-                        await page.close()
-                await self._restart_browser_if_needed()
-                end = time.time()
-                logger.debug(f'elapsed {end-start:.2f}s')
+        return img_str
@@ -1,6 +1,6 @@
 import json
 import random
-from plugin import Inject, Plugin, route, top_instr
+from plugin import Inject, Plugin, defer_load, route, top_instr
 
 from typing import TYPE_CHECKING
 
@@ -9,6 +9,7 @@ if TYPE_CHECKING:
     from plugins.throttle import Throttle
 
 @route('餐馆')
+@defer_load
 class Restaurant(Plugin):
     throttle: Inject['Throttle']
 
@@ -4,12 +4,11 @@ from mirai import GroupMessage, Image, Plain
 
 import mirai.models.message
 from mirai.models.entities import GroupMember
-from plugin import Plugin, top_instr, any_instr, InstrAttr, route, PathArg
+from plugin import Plugin, defer_load, top_instr, any_instr, InstrAttr, route, PathArg
 import random
 import random
 from PIL import Image as img
 from PIL.Image import Image as PImage
-import aiohttp
 import aiofile
 from enum import Enum, auto
 
@@ -21,6 +20,7 @@ class Dir(Enum):
     小威 = auto()
 
 @route('梗')
+@defer_load
 class Stem(Plugin):
     last_run_time: int
 
@@ -59,10 +59,7 @@ class Stem(Plugin):
     @top_instr('打卡', InstrAttr.NO_ALERT_CALLER)
     async def check_in(self, member: GroupMember):
         avatar_url = member.get_avatar_url()
-        async with aiohttp.ClientSession() as session:
-            async with session.get(avatar_url) as resp:
-                assert resp.status == 200
-                data = await resp.read()
+        data = await self.http.get_bytes(avatar_url)
         file_name = f'{member.id}.jpg'
         file_path = self.path.data.cache.of_file(file_name)
         async with aiofile.async_open(file_path, "wb") as outfile:
@@ -4,10 +4,8 @@ import re
 import time
 from typing import Optional
 from plugin import AchvCustomizer, InstrAttr, Plugin, any_instr, delegate, enable_backup, route, top_instr, Inject
-from py_mini_racer import MiniRacer
-import aiohttp
+from http_client import HttpClient
 from utilities import VOUCHER_NAME, VOUCHER_UNIT, AchvEnum, AchvOpts, AchvRarity, GroupLocalStorage, SourceOp, VoucherRecordExtraStock, throttle_config, voucher_round_half_up
-from py_mini_racer.py_mini_racer import JSEvalException
 from datetime import datetime
 
 from typing import TYPE_CHECKING
@@ -103,14 +101,14 @@ class StockData():
 
 class StockApi():
     @staticmethod
-    async def get_stock_data(r_codes: list[str]) -> dict[str, StockData]:
+    async def get_stock_data(http: HttpClient, r_codes: list[str]) -> dict[str, StockData]:
+        from py_mini_racer import MiniRacer
+        from py_mini_racer.py_mini_racer import JSEvalException
         code_map = {re.sub(r'^us\.?(\w+)(?:\.\w+)?$', r'us\1', c): c for c in r_codes}
         
 
         api_url = f'https://sqt.gtimg.cn/q={",".join(code_map.keys())}'
-        async with aiohttp.ClientSession(trust_env=True) as session:
-            async with session.get(api_url) as response:
-                js_res = await response.text(encoding='gb2312')
+        js_res = await http.get_text(api_url, encoding='gb2312', trust_env=True)
 
         ctx = MiniRacer()
         ctx.eval(js_res)
@@ -134,12 +132,10 @@ class StockApi():
         return res
 
     @classmethod
-    async def search(cls, q: str) -> Optional[SotckInfo]:
+    async def search(cls, http: HttpClient, q: str) -> Optional[SotckInfo]:
         try:
             api_url = f'https://proxy.finance.qq.com/cgi/cgi-bin/smartbox/search?stockFlag=1&fundFlag=1&app=official_website&query={q}'
-            async with aiohttp.ClientSession(trust_env=True) as session:
-                async with session.get(api_url) as response:
-                    j = await response.json(encoding='utf-8')
+            j = await http.get_json(api_url, encoding='utf-8', trust_env=True)
             first_match = j['stock'][0]
 
             if first_match['reportInfo']['match_level'] != 'full_match':
@@ -196,8 +192,8 @@ class StockMan():
     def has(self, code: str):
         return code in self.held_stocks
 
-    async def summary(self) -> list[str]:
-        data = await StockApi.get_stock_data(list(self.held_stocks.keys()))
+    async def summary(self, http: HttpClient) -> list[str]:
+        data = await StockApi.get_stock_data(http, list(self.held_stocks.keys()))
         li = []
         for code, user_stock in self.held_stocks.items():
             if code not in data:
@@ -241,7 +237,7 @@ class Stock(Plugin, AchvCustomizer):
             return ['找不到股票交易记录']
             ...
 
-        li = await man.summary()
+        li = await man.summary(self.http)
         if len(li) == 0:
             return ['还没有持仓任何股票']
 
@@ -260,11 +256,11 @@ class Stock(Plugin, AchvCustomizer):
         if cnt <= 0:
             return [f'卖出数量错误']
 
-        info = await StockApi.search(q)
+        info = await StockApi.search(self.http, q)
         if info is None:
             return [f'找不到名叫"{q}"的股票']
         
-        data = await StockApi.get_stock_data([info.code])
+        data = await StockApi.get_stock_data(self.http, [info.code])
         if info.code not in data:
             return [f'无法获取股票"{q}"的数据']
 
@@ -301,11 +297,11 @@ class Stock(Plugin, AchvCustomizer):
         if cnt <= 0:
             return [f'买入数量错误']
 
-        info = await StockApi.search(q)
+        info = await StockApi.search(self.http, q)
         if info is None:
             return [f'找不到名叫"{q}"的股票']
         
-        data = await StockApi.get_stock_data([info.code])
+        data = await StockApi.get_stock_data(self.http, [info.code])
         if info.code not in data:
             return [f'无法获取股票"{q}"的数据']
         
@@ -3,7 +3,7 @@ from enum import Enum, auto
 from typing import Final, List, Optional
 from mirai import At, GroupMessage
 from mirai.models.entities import GroupMember
-from plugin import Context, Plugin, autorun, instr, route
+from plugin import Context, Plugin, autorun, defer_load, instr, route
 import random
 
 class GameResult(Enum):
@@ -145,6 +145,7 @@ class Game():
         return f'{{对局 {self.id}}}'
 
 @route('井字棋')
+@defer_load
 class TicTacToe(Plugin):
     games: List[Game] = []
 
@@ -398,7 +398,12 @@ class Voucher(Plugin):
         data['share_url'] = share_url
         data['qr_data_url'] = self._make_qr_data_url(share_url)
 
-        b64_img = await self.renderer.render('rich-list', data=data)
+        # 图片不带updated_at(缓存的图片会一直显示第一次渲染的时间), 其余内容作为缓存标记,
+        # 榜单没有变化时直接复用上次的图片
+        data.pop('updated_at', None)
+        b64_img = await self.renderer.render(
+            'rich-list', data=data, cache_key=f'rich-list:{group.id}', cache_tag=data,
+        )
 
         return [
             mirai.models.message.Image(base64=b64_img)
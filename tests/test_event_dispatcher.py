@@ -0,0 +1,148 @@
+import asyncio
+from types import SimpleNamespace
+
+from napcat_adapter import EventDispatcher
+
+
+def group_event(group_id, name):
+    return SimpleNamespace(group_id=group_id, name=name)
+
+
+async def _settle(predicate, timeout=1.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            raise AssertionError("dispatcher did not settle")
+        await asyncio.sleep(0)
+
+
+def test_coalesce_eviction_does_not_strand_lane():
+    async def scenario():
+        emitted = []
+        release = asyncio.Event()
+
+        async def emit(event):
+            emitted.append(event.name)
+            if event.name == "blocker":
+                await release.wait()
+
+        dispatcher = EventDispatcher(emit, workers=1, max_queue=1, overflow="coalesce", prioritize=False)
+        try:
+            dispatcher.submit(group_event(1, "blocker"))
+            await _settle(lambda: emitted == ["blocker"])
+            # the only queued event of a scheduled lane gets evicted
+            assert dispatcher.submit(group_event(2, "evicted"))
+            assert dispatcher.submit(group_event(3, "kept"))
+            assert dispatcher.stats.coalesced == 1
+            release.set()
+            await _settle(lambda: emitted == ["blocker", "kept"] and not dispatcher.lane_depths())
+            # the evicted lane must accept and deliver new events afterwards
+            assert dispatcher.submit(group_event(2, "after"))
+            await _settle(lambda: "after" in emitted)
+            assert dispatcher.depth == 0
+        finally:
+            await dispatcher.close()
+
+    asyncio.run(scenario())
+
+
+def test_drained_lanes_are_released():
+    async def scenario():
+        emitted = []
+
+        async def emit(event):
+            emitted.append(event.name)
+
+        dispatcher = EventDispatcher(emit, workers=2, max_queue=10, prioritize=False)
+        try:
+            for i in range(5):
+                dispatcher.submit(group_event(i % 2, f"e{i}"))
+            await _settle(lambda: len(emitted) == 5)
+            await _settle(lambda: not dispatcher._lanes)
+            assert emitted.index("e0") < emitted.index("e2") < emitted.index("e4")
+        finally:
+            await dispatcher.close()
+
+    asyncio.run(scenario())
+
+
+def test_detached_handler_frees_lane_in_order():
+    async def scenario():
+        emitted = []
+        release = asyncio.Event()
+
+        async def emit(event):
+            emitted.append(event.name)
+            if event.name.startswith("slow"):
+                await release.wait()
+            emitted.append(f"{event.name} done")
+
+        dispatcher = EventDispatcher(emit, workers=1, max_queue=10, lane_timeout=0.01, prioritize=False)
+        try:
+            dispatcher.submit(group_event(1, "slow"))
+            dispatcher.submit(group_event(1, "next"))
+            dispatcher.submit(group_event(2, "other"))
+            # after lane_timeout the slow handler is detached and its group moves on
+            await _settle(lambda: "next done" in emitted and "other done" in emitted)
+            assert dispatcher.stats.detached == 1
+            assert emitted.index("slow") < emitted.index("next")
+            assert "slow done" not in emitted
+            release.set()
+            await _settle(lambda: "slow done" in emitted)
+        finally:
+            await dispatcher.close()
+
+    asyncio.run(scenario())
+
+
+def test_detached_handlers_are_bounded():
+    async def scenario():
+        running = set()
+        peak = 0
+        release = asyncio.Event()
+
+        async def emit(event):
+            nonlocal peak
+            running.add(event.name)
+            peak = max(peak, len(running))
+            await release.wait()
+            running.discard(event.name)
+
+        dispatcher = EventDispatcher(emit, workers=2, max_queue=10, lane_timeout=0.01, max_detached=1, prioritize=False)
+        try:
+            for i in range(6):
+                dispatcher.submit(group_event(i, f"e{i}"))
+            await asyncio.sleep(0.1)
+            # one detached handler plus one per worker still waiting on its own
+            assert peak == 3
+            assert dispatcher.stats.detached == 1
+            release.set()
+            await _settle(lambda: dispatcher.stats.dispatched == 6 and not running)
+        finally:
+            await dispatcher.close()
+
+    asyncio.run(scenario())
+
+
+def test_priority_events_are_capped():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def emit(event):
+            await release.wait()
+
+        dispatcher = EventDispatcher(emit, workers=1, max_queue=2, max_priority_queue=4, lane_timeout=10)
+        try:
+            # events that are not messages count as priority
+            dispatcher.submit(group_event(0, "blocker"))
+            await _settle(lambda: dispatcher.depth == 0 and dispatcher.stats.dispatched == 1)
+            admitted = [dispatcher.submit(group_event(i, f"join{i}")) for i in range(1, 7)]
+            assert admitted == [True] * 4 + [False] * 2
+            assert dispatcher.depth == 4
+            assert dispatcher.stats.dropped == 2
+            release.set()
+        finally:
+            await dispatcher.close()
+
+    asyncio.run(scenario())
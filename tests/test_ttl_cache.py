@@ -0,0 +1,48 @@
+import asyncio
+
+from ttl_cache import TTLCache
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def scenario():
+        cache = TTLCache(maxsize=8, ttl=60)
+        loads = 0
+
+        async def load():
+            nonlocal loads
+            loads += 1
+            await asyncio.sleep(0.05)
+            return 42
+
+        leader = asyncio.create_task(cache.get_or_load("k", load))
+        waiter = asyncio.create_task(cache.get_or_load("k", load))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await waiter == 42
+        assert loads == 1
+        assert cache.stats.coalesced == 1
+        assert cache.peek("k") == 42
+
+    asyncio.run(scenario())
+
+
+def test_load_is_cancelled_when_every_caller_leaves():
+    async def scenario():
+        cache = TTLCache(maxsize=8, ttl=60)
+        cancelled = asyncio.Event()
+
+        async def load():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.create_task(cache.get_or_load("k", load)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert "k" not in cache
+
+    asyncio.run(scenario())
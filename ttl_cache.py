@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Generic, Hashable, Iterator, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    loads: int = 0
+    load_errors: int = 0
+    # callers that waited on a load already in flight instead of starting their own
+    coalesced: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclass
+class _Flight:
+    loop: asyncio.AbstractEventLoop
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class SingleFlight(Generic[K, V]):
+    """At most one running load per key; concurrent callers share its result.
+
+    The load runs in its own task, so cancelling one caller, including the
+    one that started it, does not cancel it for the others. It is cancelled
+    only once every caller waiting on it has gone away. Loads are shared
+    only between callers on the same event loop.
+    """
+
+    def __init__(self) -> None:
+        self._flights: dict[K, _Flight] = {}
+
+    def __contains__(self, key: K) -> bool:
+        flight = self._flights.get(key)
+        return flight is not None and flight.loop is asyncio.get_running_loop()
+
+    async def run(self, key: K, loader: Callable[[], Awaitable[V]]) -> V:
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        if flight is None or flight.loop is not loop:
+            flight = self._flights[key] = _Flight(loop, loop.create_task(loader()))
+            flight.task.add_done_callback(lambda _: self._land(key, flight))
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _land(self, key: K, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # mark retrieved so a load whose callers all left does not warn
+            flight.task.exception()
+
+
+class TTLCache(Generic[K, V]):
+    """Size-bounded LRU cache whose entries also expire after ``ttl`` seconds.
+
+    ``get_or_load`` deduplicates concurrent misses: while a loader for a key is
+    running, other callers on the same event loop wait for its result instead
+    of issuing their own request.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = 600.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._inflight: SingleFlight[K, V] = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(list(self._data))
+
+    def _lookup(self, key: K) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.stats.expired += 1
+            return _MISSING
+        return value
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """Return a fresh entry without touching LRU order or the counters."""
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else float("inf")
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def update(self, items: dict[K, V]) -> None:
+        for key, value in items.items():
+            self.set(key, value)
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.stats.invalidations += 1
+        return entry[1]
+
+    def invalidate_where(self, predicate: Callable[[K], bool]) -> int:
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self.stats.invalidations += len(self._data)
+        self._data.clear()
+
+    async def get_or_load(self, key: K, loader: Callable[[], Awaitable[V]], ttl: Optional[float] = None) -> V:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if key in self._inflight:
+            self.stats.coalesced += 1
+        return await self._inflight.run(key, lambda: self._load(key, loader, ttl))
+
+    async def _load(self, key: K, loader: Callable[[], Awaitable[V]], ttl: Optional[float]) -> V:
+        self.stats.loads += 1
+        try:
+            value = await loader()
+        except Exception:
+            self.stats.load_errors += 1
+            raise
+        self.set(key, value, ttl)
+        return value
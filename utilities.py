@@ -9,7 +9,7 @@ import os
 import re
 import time
 import traceback
-from typing import Any, Callable, Dict, Final, Generic, Iterable, Optional, Type, TypeVar, Union, get_args
+from typing import Any, Callable, Dict, Final, Generic, Iterable, Optional, Set, Type, TypeVar, Union, get_args
 from dataclasses import Field, dataclass, field
 from abc import ABC, abstractmethod
 import typing
@@ -61,6 +61,127 @@ class ResolverMixer(ABC):
     @abstractmethod
     def resolver_mixin(self) -> Dict[type, Callable[..., Any]]: ...
 
+class _Removed():
+    def __reduce__(self):
+        return 'REMOVED'
+
+    def __repr__(self):
+        return 'REMOVED'
+
+REMOVED: Final = _Removed()
+
+# 记录被访问过的键, 供增量备份只写出可能发生变化的条目
+# track_reads为False时只记录增删, 用于GroupLocalStorage的外层字典(内层字典会自己记录)
+class TrackedDict(dict):
+    def __init__(self, *args, on_touch: Callable[[Any], None] = None, track_reads: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_touch = on_touch
+        self.track_reads = track_reads
+
+    def _touch(self, key):
+        if self.on_touch is not None:
+            self.on_touch(key)
+
+    def _touch_read(self, key):
+        if self.track_reads:
+            self._touch(key)
+
+    def _touch_all(self):
+        for key in dict.keys(self):
+            self._touch_read(key)
+
+    def __getitem__(self, key):
+        self._touch_read(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._touch_read(key)
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self._touch(key)
+        return super().setdefault(key, default)
+
+    def __setitem__(self, key, value):
+        self._touch(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._touch(key)
+        super().__delitem__(key)
+
+    def pop(self, key, *args):
+        self._touch(key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._touch(key)
+        return key, value
+
+    def update(self, *args, **kwargs):
+        for key in dict(*args, **kwargs).keys():
+            self._touch(key)
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        for key in dict.keys(self):
+            self._touch(key)
+        super().clear()
+
+    def values(self):
+        self._touch_all()
+        return super().values()
+
+    def items(self):
+        self._touch_all()
+        return super().items()
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+# 可增量备份的存储, touched中记录自上次备份以来可能变化的键路径
+class TrackedStorage():
+    def get_touched(self) -> Set[tuple]:
+        touched = self.__dict__.get('_touched')
+        if touched is None:
+            touched = set()
+            self.__dict__['_touched'] = touched
+        return touched
+
+    def touch(self, *path):
+        self.get_touched().add(path)
+
+    @abstractmethod
+    def lookup(self, path: tuple) -> Any: ...
+
+    @abstractmethod
+    def apply(self, path: tuple, value: Any): ...
+
+    def collect_delta(self) -> list[tuple[tuple, Any]]:
+        touched = self.get_touched()
+        # 整组被替换时, 组内成员的记录已经包含在其中
+        whole = {path for path in touched if len(path) == 1}
+        delta = [(path, self.lookup(path)) for path in touched if len(path) == 1 or path[:1] not in whole]
+        touched.clear()
+        return delta
+
+    def apply_delta(self, delta: list[tuple[tuple, Any]]):
+        for path, value in delta:
+            self.apply(path, value)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_touched', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.track()
+
+    @abstractmethod
+    def track(self, *, touch_all: bool = False): ...
+
 class Target(Enum):
     GROUP = auto()
     TEMP = auto()
@@ -85,9 +206,28 @@ class MsgOp():
         await self.bot.recall(self.msg.id, self.group.id)
 
 @dataclass
-class UserSpec(Generic[T], ResolverMixer):
+class UserSpec(Generic[T], ResolverMixer, TrackedStorage):
     users: Dict[int, T] = field(default_factory=dict)
 
+    def __post_init__(self):
+        self.track(touch_all=True)
+
+    def track(self, *, touch_all: bool = False):
+        self.users = TrackedDict(self.users, on_touch=self.touch)
+        if touch_all:
+            self.users._touch_all()
+
+    def lookup(self, path: tuple):
+        user_id, = path
+        return dict.get(self.users, user_id, REMOVED)
+
+    def apply(self, path: tuple, value: Any):
+        user_id, = path
+        if value is REMOVED:
+            dict.pop(self.users, user_id, None)
+        else:
+            dict.__setitem__(self.users, user_id, value)
+
     def get_or_create_data(self, user_id: int, factory: Callable[[], T] = None):
         if user_id not in self.users:
             if factory is None:
@@ -134,9 +274,28 @@ class UserSpecAsEvent(Generic[T]):
         return self.outter.get_data(self.user.id, _default)
 
 @dataclass
-class GroupSpec(Generic[T], ResolverMixer):
+class GroupSpec(Generic[T], ResolverMixer, TrackedStorage):
     groups: Dict[int, T] = field(default_factory=dict)
 
+    def __post_init__(self):
+        self.track(touch_all=True)
+
+    def track(self, *, touch_all: bool = False):
+        self.groups = TrackedDict(self.groups, on_touch=self.touch)
+        if touch_all:
+            self.groups._touch_all()
+
+    def lookup(self, path: tuple):
+        group_id, = path
+        return dict.get(self.groups, group_id, REMOVED)
+
+    def apply(self, path: tuple, value: Any):
+        group_id, = path
+        if value is REMOVED:
+            dict.pop(self.groups, group_id, None)
+        else:
+            dict.__setitem__(self.groups, group_id, value)
+
     def get_or_create_data(self, group_id: int, factory: Callable[[], T] = None):
         if group_id not in self.groups:
             if factory is None:
@@ -181,11 +340,48 @@ class GroupSpecAsEvent(Generic[T]):
     def get_data(self, _default=None):
         return self.outter.get_data(self.group.id, _default)
 
-class GroupLocalStorage(Generic[T], ResolverMixer):
+class GroupLocalStorage(Generic[T], ResolverMixer, TrackedStorage):
     groups: Dict[int, Dict[int, T]]
 
     def __init__(self) -> None:
         self.groups = {}
+        self.track()
+
+    def track(self, *, touch_all: bool = False):
+        self.groups = GroupLocalStorageGroups(self, self.groups)
+        if touch_all:
+            for group_id in dict.keys(self.groups):
+                self.touch(group_id)
+
+    def lookup(self, path: tuple):
+        if len(path) == 1:
+            group_id, = path
+            group = dict.get(self.groups, group_id)
+            return REMOVED if group is None else dict(group)
+        group_id, member_qq = path
+        group = dict.get(self.groups, group_id)
+        if group is None:
+            return REMOVED
+        return dict.get(group, member_qq, REMOVED)
+
+    def apply(self, path: tuple, value: Any):
+        if len(path) == 1:
+            group_id, = path
+            if value is REMOVED:
+                dict.pop(self.groups, group_id, None)
+            else:
+                dict.__setitem__(self.groups, group_id, self.groups.wrap(group_id, value))
+            return
+        group_id, member_qq = path
+        group = dict.get(self.groups, group_id)
+        if group is None:
+            if value is REMOVED: return
+            group = self.groups.wrap(group_id, {})
+            dict.__setitem__(self.groups, group_id, group)
+        if value is REMOVED:
+            dict.pop(group, member_qq, None)
+        else:
+            dict.__setitem__(group, member_qq, value)
 
     def get_or_create_data(self, group_id: int, member_qq: int, factory: Callable[[], T] = None):
         if group_id not in self.groups:
@@ -241,6 +437,31 @@ class GroupLocalStorage(Generic[T], ResolverMixer):
             # AtData[get_args(self.__orig_class__)[0]]: resolve_at_data,
         }
 
+# 外层字典只记录整组的增删, 组内条目的访问由各组自己的TrackedDict记录
+class GroupLocalStorageGroups(TrackedDict):
+    def __init__(self, outter: GroupLocalStorage, groups: Dict[int, Dict[int, Any]]):
+        super().__init__(on_touch=outter.touch, track_reads=False)
+        self.outter = outter
+        for group_id, group in groups.items():
+            dict.__setitem__(self, group_id, self.wrap(group_id, group))
+
+    def wrap(self, group_id: int, group: Dict[int, Any]):
+        def on_touch(member_qq):
+            self.outter.touch(group_id, member_qq)
+        return TrackedDict(group, on_touch=on_touch)
+
+    def __setitem__(self, group_id, group):
+        super().__setitem__(group_id, self.wrap(group_id, group))
+
+    def setdefault(self, group_id, group=None):
+        if group_id not in self:
+            self[group_id] = {} if group is None else group
+        return dict.__getitem__(self, group_id)
+
+    def update(self, *args, **kwargs):
+        for group_id, group in dict(*args, **kwargs).items():
+            self[group_id] = group
+
 # class _AtData(Generic[T]): ...
 # AtData = Union[T, _AtData[T]]
 